@@ -14,6 +14,11 @@ from extensions import db, migrate, login_manager, babel
 from models_new import *
 from routes.api import api
 from services.audit_logger import audit_logger, init_audit_logger
+from services.search_index import init_search_index
+from services.permission_cache import init_permission_cache
+from services.user_cache import init_user_cache
+from services.workflow_graph import init_workflow_graph
+from services.email_outbox import email_sender, init_email_outbox
 from services.job_scheduler import job_scheduler
 from services.workflow_engine import WorkflowEngine
 
@@ -101,7 +106,30 @@ def sync_from_google_sheets():
         except Exception as e:
             logger.error(f"Google Sheets sync failed: {e}")
 
-def create_app():
+def start_background_services(app):
+    """Start the job scheduler and email sender and run startup background tasks (worker processes only)"""
+    with app.app_context():
+        try:
+            job_scheduler.start()
+            logger.info("Job scheduler started successfully")
+        except Exception as e:
+            logger.error(f"Failed to start job scheduler: {e}")
+        
+        try:
+            email_sender.start()
+        except Exception as e:
+            logger.error(f"Failed to start email sender: {e}")
+        
+        # Sync from Google Sheets if enabled
+        sync_from_google_sheets()
+
+def create_app(start_background=False):
+    """
+    Build the Flask app.
+
+    Web processes leave ``start_background`` off; the scheduler and startup
+    sync run in a dedicated worker (``python worker.py``) instead.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
@@ -117,21 +145,29 @@ def create_app():
         # Initialize audit logger
         init_audit_logger(app)
         
-        # Initialize job scheduler
-        job_scheduler.init_app(app)
+        # Initialize full-text search index
+        init_search_index(app)
         
-        # Start job scheduler in background
-        try:
-            job_scheduler.start()
-            logger.info("Job scheduler started successfully")
-        except Exception as e:
-            logger.error(f"Failed to start job scheduler: {e}")
-
-        # Initialize WorkflowEngine (don't assign to app)
-        workflow_engine = WorkflowEngine()
+        # Initialize permission cache
+        init_permission_cache(app)
         
-        # Sync from Google Sheets if enabled
-        sync_from_google_sheets()
+        # Initialize user cache (login user loader is models_new.load_user)
+        init_user_cache(app)
+        
+        # Initialize the shared workflow step graph
+        init_workflow_graph(app)
+        
+        # Initialize email outbox (the sender runs in worker processes)
+        init_email_outbox(app)
+        
+        # Initialize job scheduler (started only by worker processes)
+        job_scheduler.init_app(app)
+
+        # Initialize WorkflowEngine (stateless; steps come from the shared step graph)
+        app.workflow_engine = WorkflowEngine()
+    
+    if start_background:
+        start_background_services(app)
 
     # Register context processors for timezone utilities
     @app.context_processor
@@ -251,10 +287,6 @@ def create_app():
             return redirect(url_for("users.login"))
         return render_template("audit_log.html")
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        return User.query.get(int(user_id))
-
     # Error handlers
     @app.errorhandler(404)
     def not_found_error(error):
@@ -275,6 +307,10 @@ def create_app():
 app = create_app()
 
 if __name__ == "__main__":
+    # The dev server runs the worker in-process unless SCHEDULER_ENABLED=false.
+    # With the reloader, only the child process that serves requests starts it.
+    if app.config.get('SCHEDULER_ENABLED') and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services(app)
     app.run(debug=True, host="0.0.0.0")
 
 
@@ -0,0 +1,166 @@
+"""
+Run EXPLAIN on the key queries issued by routes/ and services/ and flag full table scans.
+
+The queries are captured from the real code paths (dashboard summary and
+pages, cargo list filters and exports, search, scheduler checks, audit trail)
+so the plans reflect exactly the SQL the app sends. Works on SQLite
+(EXPLAIN QUERY PLAN) and MySQL (EXPLAIN).
+
+Usage:
+    python check_query_plans.py            # report every query
+    python check_query_plans.py --scans    # only report queries with full scans
+
+Exits with status 1 when any full scan is found.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import event
+import sys
+
+from app import app
+from models_new import db, Bill, MAWB, MAWBEvent, ScheduledJob, AuditLog
+from services.dashboard_summary import get_dashboard_summary
+from services.cargo_listing import SORT_MODES, TAB_STATUSES, get_cargo_page
+from services.cargo_export import count_export_rows, iter_export_batches
+from services.search_index import search_filter
+from services.audit_logger import audit_logger
+from services.audit_archive import read_audit_log, audit_log_stats
+
+# Tables small enough that a scan is expected and harmless
+SMALL_TABLES = {'role', 'users', 'carriers', 'features', 'file_types', 'workflow_steps', 'email_template'}
+
+def _key_queries():
+    """Call the code paths we care about; yields a label before each one"""
+    now = datetime.now()
+
+    yield 'dashboard summary'
+    get_dashboard_summary()
+
+    for sort_by in SORT_MODES:
+        for tab in TAB_STATUSES:
+            yield f'dashboard page ({sort_by}, {tab})'
+            get_cargo_page(sort_by, now, tab=tab, per_page=100)
+
+    yield 'cargo list filters'
+    filters = {'status': 'In Progress', 'mawb': '123', 'customer': 'abc', 'responsible': '1'}
+    count_export_rows(filters)
+
+    yield 'export batches'
+    next(iter_export_batches({}, batch_size=100, keyset=True), None)
+
+    yield 'MAWB search'
+    MAWB.query.filter(search_filter(MAWB, 'abc')).limit(20).all()
+
+    yield 'pending scheduled jobs'
+    ScheduledJob.query.filter(
+        ScheduledJob.status == 'pending',
+        ScheduledJob.run_at <= datetime.utcnow()
+    ).all()
+
+    yield 'overdue MAWBs'
+    MAWB.query.filter(MAWB.lfd < now.date(), MAWB.status == 'in_progress').all()
+
+    yield 'approaching LFD'
+    MAWB.query.filter(
+        MAWB.lfd <= now.date() + timedelta(days=3),
+        MAWB.lfd >= now.date(),
+        MAWB.status == 'in_progress'
+    ).all()
+
+    yield 'unpaid bills per cargo'
+    Bill.query.filter(Bill.cargo_id == 1, Bill.payment_status == 'Unpaid').all()
+
+    yield 'audit trail for record'
+    audit_logger.get_changes_for_record('cargo', 1)
+
+    yield 'recent audit activity'
+    AuditLog.query.order_by(AuditLog.changed_at.desc()).limit(50).all()
+
+    yield 'audit log filtered by user and date'
+    read_audit_log({'changed_by': 1}, since=now - timedelta(days=7))
+
+    yield 'audit log filtered by table and date'
+    read_audit_log({'table_name': 'mawbs'}, since=now - timedelta(days=7), before=now)
+
+    yield 'audit log stats'
+    audit_log_stats()
+
+    yield 'MAWB event timeline'
+    MAWBEvent.query.filter(MAWBEvent.mawb_id == 1).order_by(MAWBEvent.event_time).all()
+
+def capture_queries():
+    """Return [(label, statement, parameters)] for every SELECT the key code paths run"""
+    captured = []
+    label = None
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            captured.append((label, statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for label in _key_queries():
+            pass
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return captured
+
+def _sqlite_scans(connection, statement, parameters):
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    plan = [row[-1] for row in rows]
+    scans = []
+    for detail in plan:
+        # Index scans, virtual (FTS) tables and constant rows are not full table scans
+        if not detail.startswith('SCAN ') or 'INDEX' in detail or detail == 'SCAN CONSTANT ROW':
+            continue
+        table = detail.split()[1]
+        if table not in SMALL_TABLES:
+            scans.append(table)
+    return plan, scans
+
+def _mysql_scans(connection, statement, parameters):
+    result = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters)
+    rows = [dict(zip(result.keys(), row)) for row in result]
+    plan = [f"{r['table']}: type={r['type']} key={r['key']} rows={r['rows']}" for r in rows]
+    scans = [r['table'] for r in rows if r['type'] == 'ALL' and r['table'] not in SMALL_TABLES]
+    return plan, scans
+
+def explain(statement, parameters):
+    dialect = db.engine.dialect.name
+    with db.engine.connect() as connection:
+        if dialect == 'sqlite':
+            return _sqlite_scans(connection, statement, parameters)
+        if dialect == 'mysql':
+            return _mysql_scans(connection, statement, parameters)
+    raise RuntimeError(f'EXPLAIN is not supported for {dialect}')
+
+def main():
+    only_scans = '--scans' in sys.argv
+
+    with app.app_context():
+        captured = capture_queries()
+        seen = set()
+        flagged = 0
+
+        for label, statement, parameters in captured:
+            if statement in seen:
+                continue
+            seen.add(statement)
+
+            plan, scans = explain(statement, parameters)
+            if scans:
+                flagged += 1
+            elif only_scans:
+                continue
+
+            marker = 'FULL SCAN: ' + ', '.join(sorted(set(scans))) if scans else 'ok'
+            print(f'[{marker}] {label}')
+            print('    ' + ' '.join(statement.split())[:300])
+            for line in plan:
+                print(f'      {line}')
+            print()
+
+        print(f'{len(seen)} queries checked, {flagged} with full scans')
+        return 1 if flagged else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
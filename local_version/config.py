@@ -37,15 +37,35 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx'}
     
+    # Background export files (written by the job scheduler)
+    EXPORT_FOLDER = os.path.join(basedir, 'exports')
+    # Finished export files are deleted after this many hours
+    EXPORT_RETENTION_HOURS = int(os.environ.get('EXPORT_RETENTION_HOURS', 24))
+    
     # Email Configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'no-reply@wdtsupplychain.com')
+    MAIL_TIMEOUT = float(os.environ.get('MAIL_TIMEOUT', 30))
+    # Outbox sender (runs in worker.py): one thread per pooled SMTP connection
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', 2))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 20))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
+    # Connection failures put a message back without an attempt, up to this many times in a row
+    MAIL_MAX_DEFERRALS = int(os.environ.get('MAIL_MAX_DEFERRALS', 24))
+    MAIL_RETRY_BASE_SECONDS = int(os.environ.get('MAIL_RETRY_BASE_SECONDS', 30))
+    MAIL_POLL_SECONDS = int(os.environ.get('MAIL_POLL_SECONDS', 5))
+    # Idle pooled connections older than this are checked with NOOP before reuse
+    MAIL_IDLE_CHECK_SECONDS = int(os.environ.get('MAIL_IDLE_CHECK_SECONDS', 30))
     
     # Application Settings
     POSTS_PER_PAGE = 25
+    DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 100))
+    # Full-text search index (SQLite FTS5 / MySQL FULLTEXT) for AWB and customer lookups
+    SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', 'true').lower() in ['true', 'on', '1']
     ADMINS = ['admin@wdt.com']
     
     # Timezone Configuration
@@ -53,9 +73,41 @@ class Config:
     
     # Audit Logging
     AUDIT_LOG_ENABLED = os.environ.get('AUDIT_LOG_ENABLED', 'true').lower() == 'true'
+    # 'async' buffers entries and bulk-inserts them from a background thread; 'sync' writes on commit
+    AUDIT_LOG_MODE = os.environ.get('AUDIT_LOG_MODE', 'async')
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 500))
+    AUDIT_FLUSH_SECONDS = float(os.environ.get('AUDIT_FLUSH_SECONDS', 1.0))
+    # Crash-safety spool for entries not yet written
+    AUDIT_SPOOL_FOLDER = os.environ.get('AUDIT_SPOOL_FOLDER') or os.path.join(basedir, 'audit_spool')
+    AUDIT_SPOOL_FSYNC = os.environ.get('AUDIT_SPOOL_FSYNC', 'true').lower() == 'true'
+    # Months kept in the audit_log table (current month included); older ones are archived
+    AUDIT_HOT_MONTHS = int(os.environ.get('AUDIT_HOT_MONTHS', 3))
+    AUDIT_ARCHIVE_FOLDER = os.environ.get('AUDIT_ARCHIVE_FOLDER') or os.path.join(basedir, 'audit_archive')
+    # Point-in-time reads: a full snapshot is kept at least every N audit entries per record
+    AUDIT_SNAPSHOT_INTERVAL = int(os.environ.get('AUDIT_SNAPSHOT_INTERVAL', 20))
+    
+    # Permissions are cached per process; other processes' changes show up within this many seconds
+    PERMISSION_VERSION_CHECK_SECONDS = float(os.environ.get('PERMISSION_VERSION_CHECK_SECONDS', 2.0))
+    # Logged-in users are cached per process; other processes' user edits show up after the TTL
+    USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 30.0))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1000))
+    # Workflow steps are compiled once per process; other processes' step edits show up within this many seconds
+    WORKFLOW_GRAPH_CHECK_SECONDS = float(os.environ.get('WORKFLOW_GRAPH_CHECK_SECONDS', 60.0))
+    # Where the T05 (At Origin Port) pre-alert goes, comma-separated
+    PRE_ALERT_RECIPIENTS = os.environ.get('PRE_ALERT_RECIPIENTS', 'operations@company.com')
     
-    # Job Scheduler
+    # Job Scheduler (SCHEDULER_ENABLED only affects the `python app.py` dev server;
+    # deployments run `python worker.py` next to the web workers)
     SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 4))
+    JOB_CLAIM_BATCH_SIZE = int(os.environ.get('JOB_CLAIM_BATCH_SIZE', 10))
+    # A running job whose lease expires is reclaimed by another worker
+    JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+    # Web processes wake the worker with a UDP datagram to this host:port when they
+    # commit jobs ('' disables; point it at the worker's host when it runs elsewhere)
+    JOB_WAKEUP_ADDRESS = os.environ.get('JOB_WAKEUP_ADDRESS', '127.0.0.1:5599')
+    # Fallback poll for jobs queued by other processes, e.g. if a wakeup was lost (0 disables)
+    JOB_POLL_SECONDS = int(os.environ.get('JOB_POLL_SECONDS', 30))
     
     # Google Cloud SQL Connection Pool
     if os.environ.get('DATABASE_URL'):
@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -45,6 +46,23 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# Search index objects managed by migrations but not declared on the models
+# (see services/search_index.py): FTS5 tables with their shadow tables, and
+# MySQL FULLTEXT indexes
+SEARCH_INDEX_TABLE = re.compile(r'^\w+_fts(_\w+)?$')
+SEARCH_INDEX_PREFIX = 'ft_'
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep autogenerate from dropping the search index"""
+    if reflected and compare_to is None:
+        if type_ == 'table' and SEARCH_INDEX_TABLE.match(name):
+            return False
+        if type_ == 'index' and name and name.startswith(SEARCH_INDEX_PREFIX):
+            return False
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -65,7 +83,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +112,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
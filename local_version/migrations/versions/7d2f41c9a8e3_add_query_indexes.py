@@ -0,0 +1,46 @@
+"""add indexes for hot query predicates
+
+Revision ID: 7d2f41c9a8e3
+Revises: 4388b4d0cb35
+Create Date: 2026-10-18 09:12:31.504217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2f41c9a8e3'
+down_revision = '4388b4d0cb35'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    # Dashboard / cargo list: unarchived cargo, newest first
+    ('ix_cargo_is_archived_created_at', 'cargo', ['is_archived', 'created_at']),
+    # Unpaid bill counts and per-cargo bill lookups
+    ('ix_bill_cargo_id_payment_status', 'bill', ['cargo_id', 'payment_status']),
+    ('ix_bill_payment_status', 'bill', ['payment_status']),
+    # Job processor: pending jobs that are due
+    ('ix_scheduled_jobs_status_run_at', 'scheduled_jobs', ['status', 'run_at']),
+    # Overdue / approaching LFD checks
+    ('ix_mawbs_status_lfd', 'mawbs', ['status', 'lfd']),
+    # Audit trail per record and recent activity
+    ('ix_audit_log_table_name_record_id_changed_at', 'audit_log', ['table_name', 'record_id', 'changed_at']),
+    ('ix_audit_log_changed_at', 'audit_log', ['changed_at']),
+    # MAWB event timelines
+    ('ix_mawb_events_mawb_id_event_time', 'mawb_events', ['mawb_id', 'event_time']),
+    # Cargo list "responsible" filter
+    ('ix_responsible_association_user_id', 'responsible_association', ['user_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, columns in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
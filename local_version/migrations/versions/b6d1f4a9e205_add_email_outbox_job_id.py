@@ -0,0 +1,30 @@
+"""add bulk send job id to email outbox
+
+Revision ID: b6d1f4a9e205
+Revises: a2c5e8f1d347
+Create Date: 2026-10-18 21:44:09.615230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4a9e205'
+down_revision = 'a2c5e8f1d347'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('job_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_email_outbox_job_id', 'scheduled_jobs', ['job_id'], ['id'])
+        batch_op.create_index('ix_email_outbox_job_id_status', ['job_id', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_email_outbox_job_id_status')
+        batch_op.drop_constraint('fk_email_outbox_job_id', type_='foreignkey')
+        batch_op.drop_column('job_id')
@@ -0,0 +1,30 @@
+"""add lease columns to scheduled jobs
+
+Revision ID: b81e5f0d6c27
+Revises: 7d2f41c9a8e3
+Create Date: 2026-10-18 11:40:02.918356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81e5f0d6c27'
+down_revision = '7d2f41c9a8e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('locked_by', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('locked_until', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_scheduled_jobs_status_locked_until', ['status', 'locked_until'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_jobs', schema=None) as batch_op:
+        batch_op.drop_index('ix_scheduled_jobs_status_locked_until')
+        batch_op.drop_column('locked_until')
+        batch_op.drop_column('locked_by')
@@ -0,0 +1,72 @@
+"""partition audit_log by month (MySQL)
+
+Revision ID: c4a9d2e7f130
+Revises: b81e5f0d6c27
+Create Date: 2026-10-18 14:05:47.331902
+
+MySQL only; SQLite keeps a single audit_log table and relies on the monthly
+archival job (services/audit_archive.py) to keep it small.
+
+Partitioned InnoDB tables cannot have foreign keys and every unique key
+must include the partitioning column, so the changed_by foreign key is
+dropped and the primary key becomes (id, changed_at).
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a9d2e7f130'
+down_revision = 'b81e5f0d6c27'
+branch_labels = None
+depends_on = None
+
+
+MONTHS_AHEAD = 3
+
+
+def _add_months(value, months):
+    years, month = divmod(value.month - 1 + months, 12)
+    return datetime(value.year + years, month + 1, 1)
+
+
+def _foreign_keys(bind):
+    rows = bind.execute(sa.text(
+        "SELECT constraint_name FROM information_schema.referential_constraints "
+        "WHERE constraint_schema = DATABASE() AND table_name = 'audit_log'"
+    )).all()
+    return [row[0] for row in rows]
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        return
+
+    for name in _foreign_keys(bind):
+        op.execute(f'ALTER TABLE audit_log DROP FOREIGN KEY {name}')
+    op.execute('ALTER TABLE audit_log DROP PRIMARY KEY, ADD PRIMARY KEY (id, changed_at)')
+
+    # One partition per month from the oldest row to a few months ahead
+    oldest = bind.execute(sa.text('SELECT MIN(changed_at) FROM audit_log')).scalar() or datetime.utcnow()
+    month = datetime(oldest.year, oldest.month, 1)
+    last = _add_months(datetime.utcnow(), MONTHS_AHEAD)
+    partitions = []
+    while month <= last:
+        upper = _add_months(month, 1).strftime('%Y-%m-%d')
+        partitions.append(f"PARTITION p{month.strftime('%Y%m')} VALUES LESS THAN (TO_DAYS('{upper}'))")
+        month = _add_months(month, 1)
+    partitions.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+
+    op.execute(f"ALTER TABLE audit_log PARTITION BY RANGE (TO_DAYS(changed_at)) ({', '.join(partitions)})")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'mysql':
+        return
+
+    op.execute('ALTER TABLE audit_log REMOVE PARTITIONING')
+    op.execute('ALTER TABLE audit_log DROP PRIMARY KEY, ADD PRIMARY KEY (id)')
+    op.create_foreign_key(None, 'audit_log', 'users', ['changed_by'], ['id'])
@@ -0,0 +1,28 @@
+"""add dedup key to scheduled jobs
+
+Revision ID: c8e2a7f4d019
+Revises: b6d1f4a9e205
+Create Date: 2026-10-18 22:31:52.408117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c8e2a7f4d019'
+down_revision = 'b6d1f4a9e205'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('scheduled_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('dedup_key', sa.String(length=255), nullable=True))
+        batch_op.create_index('ix_scheduled_jobs_dedup_key', ['dedup_key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('scheduled_jobs', schema=None) as batch_op:
+        batch_op.drop_index('ix_scheduled_jobs_dedup_key')
+        batch_op.drop_column('dedup_key')
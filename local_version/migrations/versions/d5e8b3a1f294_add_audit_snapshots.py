@@ -0,0 +1,41 @@
+"""add audit snapshots
+
+Revision ID: d5e8b3a1f294
+Revises: c4a9d2e7f130
+Create Date: 2026-10-18 16:22:10.504187
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e8b3a1f294'
+down_revision = 'c4a9d2e7f130'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=100), nullable=False),
+    sa.Column('record_id', sa.Integer(), nullable=False),
+    sa.Column('audit_log_id', sa.Integer(), nullable=False),
+    sa.Column('state', sa.JSON(), nullable=True),
+    sa.Column('complete', sa.Boolean(), nullable=True),
+    sa.Column('taken_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_snapshots', schema=None) as batch_op:
+        batch_op.create_index('ix_audit_snapshots_table_name_record_id_taken_at', ['table_name', 'record_id', 'taken_at'], unique=False)
+        batch_op.create_index('ix_audit_snapshots_audit_log_id', ['audit_log_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_snapshots', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_snapshots_audit_log_id')
+        batch_op.drop_index('ix_audit_snapshots_table_name_record_id_taken_at')
+
+    op.drop_table('audit_snapshots')
@@ -0,0 +1,99 @@
+"""add full-text search index for cargo, mawbs and hawbs
+
+Revision ID: d9b3f6e2a871
+Revises: c8e2a7f4d019
+Create Date: 2026-10-19 09:12:30.518264
+
+SQLite: FTS5 tables <table>_fts with the trigram tokenizer (SQLite 3.34+),
+filled from the source tables and kept in sync by model events in
+services/search_index.py. MySQL: ngram FULLTEXT indexes per column and
+across all columns. Other databases keep the LIKE filters.
+
+The FTS tables and ft_* indexes are not part of the models, so
+migrations/env.py keeps autogenerate from dropping them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b3f6e2a871'
+down_revision = 'c8e2a7f4d019'
+branch_labels = None
+depends_on = None
+
+
+# Keep in sync with services.search_index.SEARCH_COLUMNS
+SEARCH_COLUMNS = {
+    'cargo': ('main_awb', 'flight_no', 'customer_name'),
+    'mawbs': ('mawb_number', 'consignee', 'shipper'),
+    'hawbs': ('hawb_number', 'consignee', 'shipper')
+}
+
+
+def _fulltext_indexes(table, columns):
+    """(index name, columns) for each column and for all columns together"""
+    indexes = [(f'ft_{table}_{column}', (column,)) for column in columns]
+    indexes.append((f'ft_{table}_all', columns))
+    return indexes
+
+
+def _sqlite_has_trigram(bind):
+    version = bind.execute(sa.text('SELECT sqlite_version()')).scalar()
+    return tuple(int(part) for part in version.split('.')[:2]) >= (3, 34)
+
+
+def _mysql_indexes(bind, table):
+    return {
+        row[0] for row in bind.execute(sa.text(
+            'SELECT DISTINCT index_name FROM information_schema.statistics '
+            'WHERE table_schema = DATABASE() AND table_name = :table'
+        ), {'table': table})
+    }
+
+
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+
+    if dialect == 'sqlite':
+        if not _sqlite_has_trigram(bind):
+            return
+        for table, columns in SEARCH_COLUMNS.items():
+            op.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts "
+                f"USING fts5({', '.join(columns)}, tokenize='trigram')"
+            )
+            # Databases that built the index at startup before this revision are refilled
+            source_columns = ', '.join(f"COALESCE({c}, '')" for c in columns)
+            op.execute(f'DELETE FROM {table}_fts')
+            op.execute(
+                f"INSERT INTO {table}_fts(rowid, {', '.join(columns)}) "
+                f"SELECT id, {source_columns} FROM {table}"
+            )
+
+    elif dialect == 'mysql':
+        for table, columns in SEARCH_COLUMNS.items():
+            existing = _mysql_indexes(bind, table)
+            for name, index_columns in _fulltext_indexes(table, columns):
+                if name not in existing:
+                    op.execute(
+                        f"ALTER TABLE {table} ADD FULLTEXT INDEX {name} "
+                        f"({', '.join(index_columns)}) WITH PARSER ngram"
+                    )
+
+
+def downgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+
+    if dialect == 'sqlite':
+        for table in SEARCH_COLUMNS:
+            op.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+    elif dialect == 'mysql':
+        for table, columns in SEARCH_COLUMNS.items():
+            existing = _mysql_indexes(bind, table)
+            for name, _ in _fulltext_indexes(table, columns):
+                if name in existing:
+                    op.drop_index(name, table_name=table)
@@ -0,0 +1,33 @@
+"""add audit log filter indexes
+
+Revision ID: e1f7c6a2b853
+Revises: d5e8b3a1f294
+Create Date: 2026-10-18 17:48:31.206714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f7c6a2b853'
+down_revision = 'd5e8b3a1f294'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = [
+    # Audit log page: entries by user, and by table, within a date range
+    ('ix_audit_log_changed_by_changed_at', ['changed_by', 'changed_at']),
+    ('ix_audit_log_table_name_changed_at', ['table_name', 'changed_at']),
+]
+
+
+def upgrade():
+    for name, columns in INDEXES:
+        op.create_index(name, 'audit_log', columns, unique=False)
+
+
+def downgrade():
+    for name, columns in reversed(INDEXES):
+        op.drop_index(name, table_name='audit_log')
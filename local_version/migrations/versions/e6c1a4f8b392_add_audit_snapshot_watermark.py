@@ -0,0 +1,32 @@
+"""add audit snapshot watermark
+
+Revision ID: e6c1a4f8b392
+Revises: d9b3f6e2a871
+Create Date: 2026-10-19 11:40:06.217935
+
+Snapshots now track the audit_log ids they have seen instead of the newest
+changed_at. The watermark starts at 0, so the first run re-checks every
+hot row and rebuilds snapshots of records that had late entries.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6c1a4f8b392'
+down_revision = 'd9b3f6e2a871'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    audit_snapshot_watermarks = op.create_table('audit_snapshot_watermarks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('audit_log_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(audit_snapshot_watermarks, [{'id': 1, 'audit_log_id': 0}])
+
+
+def downgrade():
+    op.drop_table('audit_snapshot_watermarks')
@@ -0,0 +1,26 @@
+"""add email outbox deferral count
+
+Revision ID: f2b7d5c9a416
+Revises: e6c1a4f8b392
+Create Date: 2026-10-19 14:08:51.772604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7d5c9a416'
+down_revision = 'e6c1a4f8b392'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deferrals', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('email_outbox', schema=None) as batch_op:
+        batch_op.drop_column('deferrals')
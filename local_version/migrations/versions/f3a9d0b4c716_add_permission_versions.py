@@ -0,0 +1,29 @@
+"""add permission version counter
+
+Revision ID: f3a9d0b4c716
+Revises: e1f7c6a2b853
+Create Date: 2026-10-18 19:05:12.840391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d0b4c716'
+down_revision = 'e1f7c6a2b853'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    permission_versions = op.create_table('permission_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(permission_versions, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('permission_versions')
@@ -11,6 +11,8 @@ from models_new import (
     Cargo, Attachment, Bill, EventLog, EmailLog, ExternalContact, 
     EmailTemplate, StatusMilestone
 )
+# The login user loader is registered once, in models_new (cached)
+from models_new import load_user
 
 # Predefined permissions
 PERMISSIONS = {
@@ -61,13 +63,3 @@ DEFAULT_ROLES = {
         'archive_records'
     ]
 }
-
-@login_manager.user_loader
-def load_user(user_id):
-    try:
-        return User.query.get(int(user_id))
-    except (ValueError, TypeError):
-        return None
-
-
-
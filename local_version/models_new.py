@@ -63,6 +63,9 @@ class UserOverride(db.Model):
 
 class MAWB(db.Model):
     __tablename__ = 'mawbs'
+    __table_args__ = (
+        db.Index('ix_mawbs_status_lfd', 'status', 'lfd'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     mawb_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -128,6 +131,9 @@ class HAWB(db.Model):
 
 class MAWBEvent(db.Model):
     __tablename__ = 'mawb_events'
+    __table_args__ = (
+        db.Index('ix_mawb_events_mawb_id_event_time', 'mawb_id', 'event_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     mawb_id = db.Column(db.Integer, db.ForeignKey('mawbs.id'), nullable=False)
@@ -182,6 +188,11 @@ class MAWBWorkflow(db.Model):
 
 class ScheduledJob(db.Model):
     __tablename__ = 'scheduled_jobs'
+    __table_args__ = (
+        db.Index('ix_scheduled_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('ix_scheduled_jobs_status_locked_until', 'status', 'locked_until'),
+        db.Index('ix_scheduled_jobs_dedup_key', 'dedup_key', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     mawb_id = db.Column(db.Integer, db.ForeignKey('mawbs.id'))
@@ -192,6 +203,11 @@ class ScheduledJob(db.Model):
     payload = db.Column(db.JSON)
     attempts = db.Column(db.Integer, nullable=False, default=0)
     max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    # Lease held by the worker currently running the job
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    # Identifies the job for upserts (see services.job_worker.upsert_jobs); NULL for one-off jobs
+    dedup_key = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -201,6 +217,12 @@ class ScheduledJob(db.Model):
 
 class AuditLog(db.Model):
     __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_table_name_record_id_changed_at', 'table_name', 'record_id', 'changed_at'),
+        db.Index('ix_audit_log_changed_at', 'changed_at'),
+        db.Index('ix_audit_log_changed_by_changed_at', 'changed_by', 'changed_at'),
+        db.Index('ix_audit_log_table_name_changed_at', 'table_name', 'changed_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     table_name = db.Column(db.String(100), nullable=False)
@@ -214,6 +236,29 @@ class AuditLog(db.Model):
     # Relationships
     user = db.relationship('User', foreign_keys=[changed_by])
 
+class AuditSnapshot(db.Model):
+    """Full state of an audited record as of one audit entry, for point-in-time reads"""
+    __tablename__ = 'audit_snapshots'
+    __table_args__ = (
+        db.Index('ix_audit_snapshots_table_name_record_id_taken_at', 'table_name', 'record_id', 'taken_at'),
+        db.Index('ix_audit_snapshots_audit_log_id', 'audit_log_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(100), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    audit_log_id = db.Column(db.Integer, nullable=False)  # last audit entry folded in
+    state = db.Column(db.JSON)  # None once the record is deleted
+    complete = db.Column(db.Boolean, default=True)  # False if history starts mid-life
+    taken_at = db.Column(db.DateTime, nullable=False)  # changed_at of that entry
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AuditSnapshotWatermark(db.Model):
+    """Single row holding the highest audit_log id already folded into snapshots"""
+    __tablename__ = 'audit_snapshot_watermarks'
+    id = db.Column(db.Integer, primary_key=True)
+    audit_log_id = db.Column(db.Integer, nullable=False, default=0)
+
 # ============================================================================
 # ENHANCED EXISTING MODELS
 # ============================================================================
@@ -222,7 +267,8 @@ class AuditLog(db.Model):
 responsible_association = db.Table(
     'responsible_association',
     db.Column('cargo_id', db.Integer, db.ForeignKey('cargo.id'), primary_key=True),
-    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    db.Column('user_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Index('ix_responsible_association_user_id', 'user_id')
 )
 
 class Role(db.Model):
@@ -249,6 +295,12 @@ class Role(db.Model):
         except Exception:
             return False
 
+class PermissionVersion(db.Model):
+    """Single-row counter bumped whenever role permissions or user overrides change"""
+    __tablename__ = "permission_versions"
+    id      = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 # Predefined permissions
 PERMISSIONS = {
     'view_cargo': 'View cargo details',
@@ -340,16 +392,14 @@ class User(UserMixin, db.Model):
     
     def has_permission(self, permission):
         """Check if user has specific permission"""
-        # Check role permissions
-        if self.role and self.role.has_permission(permission):
-            return True
-        
-        # Check user overrides - join with Feature table to get feature key
-        override = self.user_overrides.join(Feature).filter_by(key=permission).first()
-        if override:
-            return override.granted
-        
-        return False
+        from services.permission_cache import permission_cache
+        # Role permissions plus granted overrides, resolved once and cached
+        return permission in permission_cache.permissions_for(self)
+    
+    def effective_permissions(self):
+        """All permission keys the user has, as a frozenset"""
+        from services.permission_cache import permission_cache
+        return permission_cache.permissions_for(self)
     
     def can_view_cargo(self):
         return self.has_permission('view_cargo')
@@ -389,13 +439,17 @@ class User(UserMixin, db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
+    from services.user_cache import user_cache
     try:
-        return User.query.get(int(user_id))
+        return user_cache.get(int(user_id))
     except (ValueError, TypeError):
         return None
 
 class Cargo(db.Model):
     __tablename__ = "cargo"
+    __table_args__ = (
+        db.Index('ix_cargo_is_archived_created_at', 'is_archived', 'created_at'),
+    )
     id            = db.Column(db.Integer, primary_key=True)
     main_awb      = db.Column(db.String(100), unique=True, nullable=False)
     flight_no     = db.Column(db.String(50), nullable=True)
@@ -490,6 +544,10 @@ class Attachment(db.Model):
 
 class Bill(db.Model):
     __tablename__ = "bill"
+    __table_args__ = (
+        db.Index('ix_bill_cargo_id_payment_status', 'cargo_id', 'payment_status'),
+        db.Index('ix_bill_payment_status', 'payment_status'),
+    )
     id              = db.Column(db.Integer, primary_key=True)
     cargo_id        = db.Column(db.Integer, db.ForeignKey('cargo.id'), nullable=False)
     supplier_name   = db.Column(db.String(100), nullable=False)
@@ -551,6 +609,40 @@ class EmailLog(db.Model):
     def __repr__(self):
         return f"<EmailLog {self.subject} to {self.recipients}>"
 
+class EmailOutbox(db.Model):
+    """Outgoing email waiting for (or done with) the background sender"""
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('ix_email_outbox_status_locked_until', 'status', 'locked_until'),
+        db.Index('ix_email_outbox_job_id_status', 'job_id', 'status'),
+    )
+    id              = db.Column(db.Integer, primary_key=True)
+    cargo_id        = db.Column(db.Integer, db.ForeignKey('cargo.id'))
+    template_name   = db.Column(db.String(100))
+    sender          = db.Column(db.String(120), nullable=False)
+    recipients      = db.Column(db.String(300), nullable=False)  # comma separated
+    subject         = db.Column(db.String(200))
+    body            = db.Column(db.Text)
+    subtype         = db.Column(db.String(20), nullable=False, default='html')
+    status          = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts        = db.Column(db.Integer, nullable=False, default=0)
+    deferrals       = db.Column(db.Integer, nullable=False, default=0)  # consecutive connection failures
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error      = db.Column(db.Text)
+    # Lease held by the sender currently delivering the message
+    locked_by       = db.Column(db.String(100))
+    locked_until    = db.Column(db.DateTime)
+    created_by_id   = db.Column(db.Integer, db.ForeignKey('users.id'))
+    job_id          = db.Column(db.Integer, db.ForeignKey('scheduled_jobs.id'))  # bulk send that queued it
+    created_at      = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at         = db.Column(db.DateTime)
+
+    created_by = db.relationship('User', foreign_keys=[created_by_id])
+
+    def __repr__(self):
+        return f"<EmailOutbox {self.subject} to {self.recipients} ({self.status})>"
+
 class ExternalContact(db.Model):
     __tablename__ = "external_contact"
     id              = db.Column(db.Integer, primary_key=True)
@@ -596,12 +688,13 @@ class EmailTemplate(db.Model):
         return []
 
     def render_template(self, **kwargs):
-        """Render template with provided variables"""
-        body = self.body
-        for key, value in kwargs.items():
-            placeholder = f"{{{{{key}}}}}"
-            body = body.replace(placeholder, str(value))
-        return body
+        """Render the body with provided variables"""
+        return self.render(**kwargs).body
+    
+    def render(self, **kwargs):
+        """Render subject and body; returns RenderedEmail(subject, body, missing)"""
+        from services.template_renderer import render_email
+        return render_email(self, kwargs)
 
 class StatusMilestone(db.Model):
     __tablename__ = "status_milestone"
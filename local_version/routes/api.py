@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 from models_new import (
     db, MAWB, HAWB, MAWBEvent, HAWBEvent, Carrier, FileType, 
@@ -8,6 +8,14 @@ from models_new import (
     Attachment, Bill
 )
 
+from services.search_index import search_filter
+from services.audit_archive import read_audit_log, audit_log_stats
+from services.audit_history import reconstruct_as_of
+from services.user_cache import user_cache
+from services.step_actions import schedule_lfd_reminders
+from services.workflow_graph import workflow_graph
+from sqlalchemy.orm import joinedload
+
 api = Blueprint('api', __name__, url_prefix='/api/v1')
 
 # ============================================================================
@@ -23,24 +31,32 @@ def get_mawbs():
     status = request.args.get('status')
     carrier_id = request.args.get('carrier_id', type=int)
     search = request.args.get('search')
+    current_step = request.args.get('current_step')
+    include_workflow = request.args.get('include_workflow', type=int)
     
-    query = MAWB.query
+    query = MAWB.query.options(joinedload(MAWB.carrier))
     
     if status:
         query = query.filter(MAWB.status == status)
     if carrier_id:
         query = query.filter(MAWB.carrier_id == carrier_id)
     if search:
-        query = query.filter(
-            MAWB.mawb_number.ilike(f'%{search}%') |
-            MAWB.consignee.ilike(f'%{search}%') |
-            MAWB.shipper.ilike(f'%{search}%')
-        )
+        query = query.filter(search_filter(MAWB, search))
+    if current_step or include_workflow:
+        # Active workflow joined in the same query instead of one request per MAWB
+        on_workflow = db.and_(MAWBWorkflow.mawb_id == MAWB.id, MAWBWorkflow.is_active == True)
+        if current_step:
+            query = query.join(MAWBWorkflow, on_workflow).filter(MAWBWorkflow.current_step == current_step)
+        else:
+            query = query.outerjoin(MAWBWorkflow, on_workflow)
+        query = query.add_entity(MAWBWorkflow)
     
     mawbs = query.paginate(page=page, per_page=per_page, error_out=False)
+    rows = mawbs.items if (current_step or include_workflow) else [(mawb, None) for mawb in mawbs.items]
     
-    return jsonify({
-        'mawbs': [{
+    items = []
+    for mawb, workflow in rows:
+        item = {
             'id': mawb.id,
             'mawb_number': mawb.mawb_number,
             'origin_port': mawb.origin_port,
@@ -59,7 +75,13 @@ def get_mawbs():
             'created_at': mawb.created_at.isoformat(),
             'is_overdue': mawb.is_overdue,
             'time_until_lfd': mawb.time_until_lfd
-        } for mawb in mawbs.items],
+        }
+        if current_step or include_workflow:
+            item['workflow'] = _workflow_json(workflow)
+        items.append(item)
+    
+    return jsonify({
+        'mawbs': items,
         'pagination': {
             'page': page,
             'per_page': per_page,
@@ -172,13 +194,20 @@ def update_mawb(mawb_id):
     data = request.get_json()
     
     try:
+        old_lfd = mawb.lfd
         for field, value in data.items():
             if hasattr(mawb, field):
                 if field in ['eta', 'etd', 'lfd'] and value:
-                    setattr(mawb, field, datetime.fromisoformat(value))
+                    setattr(mawb, field, datetime.fromisoformat(value).date())
                 else:
                     setattr(mawb, field, value)
         
+        # LFD reminders follow the new LFD; ones it no longer produces are cancelled
+        if mawb.lfd != old_lfd:
+            workflow = MAWBWorkflow.query.filter_by(mawb_id=mawb.id, is_active=True).first()
+            if workflow and not workflow.is_completed and workflow_graph.get().has_reached(workflow.current_step, 'T06'):
+                schedule_lfd_reminders(mawb, {})
+        
         mawb.updated_at = datetime.utcnow()
         db.session.commit()
         
@@ -247,11 +276,7 @@ def get_hawbs():
     if status:
         query = query.filter(HAWB.status == status)
     if search:
-        query = query.filter(
-            HAWB.hawb_number.ilike(f'%{search}%') |
-            HAWB.consignee.ilike(f'%{search}%') |
-            HAWB.shipper.ilike(f'%{search}%')
-        )
+        query = query.filter(search_filter(HAWB, search))
     
     hawbs = query.paginate(page=page, per_page=per_page, error_out=False)
     
@@ -315,6 +340,48 @@ def create_hawb():
 # Workflow API Endpoints
 # ============================================================================
 
+def _workflow_json(workflow):
+    if workflow is None:
+        return None
+    return {
+        'id': workflow.id,
+        'current_step': workflow.current_step,
+        'started_at': workflow.started_at.isoformat(),
+        'updated_at': workflow.updated_at.isoformat(),
+        'completed_at': workflow.completed_at.isoformat() if workflow.completed_at else None,
+        'is_completed': workflow.is_completed
+    }
+
+@api.route('/workflow/steps', methods=['GET'])
+@login_required
+def get_workflow_steps():
+    """Active workflow steps in order"""
+    return jsonify({'steps': list(workflow_graph.get().steps)})
+
+@api.route('/workflows', methods=['GET'])
+@login_required
+def get_workflows():
+    """Active workflows for a list of MAWBs (?mawb_ids=1,2,3), in one query"""
+    try:
+        mawb_ids = [int(value) for value in request.args.get('mawb_ids', '').split(',') if value.strip()]
+    except ValueError:
+        return jsonify({'success': False, 'error': 'mawb_ids must be a comma-separated list of ids'}), 400
+    if len(mawb_ids) > 500:
+        return jsonify({'success': False, 'error': 'At most 500 MAWBs per request'}), 400
+    
+    workflows = {}
+    if mawb_ids:
+        for workflow in MAWBWorkflow.query.filter(
+            MAWBWorkflow.mawb_id.in_(mawb_ids),
+            MAWBWorkflow.is_active == True
+        ):
+            workflows[workflow.mawb_id] = workflow
+    
+    return jsonify({
+        'workflows': {str(mawb_id): _workflow_json(workflows.get(mawb_id)) for mawb_id in mawb_ids},
+        'steps': list(workflow_graph.get().steps)
+    })
+
 @api.route('/workflows/mawb/<int:mawb_id>', methods=['GET'])
 @login_required
 def get_mawb_workflow(mawb_id):
@@ -327,26 +394,15 @@ def get_mawb_workflow(mawb_id):
             'error': 'No active workflow found'
         }), 404
     
-    # Get all workflow steps
-    steps = WorkflowStep.query.filter_by(is_active=True).all()
+    graph = workflow_graph.get()
     
     return jsonify({
-        'workflow': {
-            'id': workflow.id,
-            'current_step': workflow.current_step,
-            'started_at': workflow.started_at.isoformat(),
-            'updated_at': workflow.updated_at.isoformat(),
-            'completed_at': workflow.completed_at.isoformat() if workflow.completed_at else None,
-            'is_completed': workflow.is_completed
-        },
+        'workflow': _workflow_json(workflow),
         'steps': [{
-            'code': step.code,
-            'name': step.name,
-            'description': step.description,
-            'next_step': step.next_step,
-            'is_current': step.code == workflow.current_step,
-            'is_completed': step.code in [s.code for s in steps[:steps.index(next(s for s in steps if s.code == workflow.current_step))]] if workflow.current_step in [s.code for s in steps] else False
-        } for step in steps]
+            **step,
+            'is_current': step['code'] == workflow.current_step,
+            'is_completed': graph.is_completed(step['code'], workflow.current_step)
+        } for step in graph.steps]
     })
 
 @api.route('/workflows/mawb/<int:mawb_id>/advance', methods=['POST'])
@@ -379,6 +435,46 @@ def advance_workflow(mawb_id):
             'error': str(e)
         }), 400
 
+@api.route('/workflows/advance', methods=['POST'])
+@login_required
+def advance_workflows():
+    """Advance many MAWBs to their next step in one transaction"""
+    if not hasattr(current_app, 'workflow_engine'):
+        return jsonify({
+            'success': False,
+            'error': 'Workflow engine not available'
+        }), 500
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        mawb_ids = [int(mawb_id) for mawb_id in data.get('mawb_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'mawb_ids must be a list of ids'}), 400
+    if not mawb_ids:
+        return jsonify({'success': False, 'error': 'mawb_ids is required'}), 400
+    if len(mawb_ids) > 1000:
+        return jsonify({'success': False, 'error': 'At most 1000 MAWBs per request'}), 400
+    
+    try:
+        advanced, errors = current_app.workflow_engine.advance_workflows(
+            mawb_ids,
+            user_id=current_user.id,
+            to_step=data.get('to_step'),
+            event_details=data.get('details')
+        )
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'advanced': advanced,
+        'errors': {str(mawb_id): error for mawb_id, error in errors.items()},
+        'message': f'{len(advanced)} workflows advanced'
+    })
+
 # ============================================================================
 # Scheduled Jobs API Endpoints
 # ============================================================================
@@ -524,43 +620,116 @@ def get_dashboard_stats():
         } for event in recent_events]
     })
 
+def _parse_audit_time(value, end_of_day=False):
+    """Parse a date or ISO timestamp from the audit log filters into naive UTC"""
+    if not value:
+        return None
+    if len(value) == 10:
+        day = datetime.strptime(value, '%Y-%m-%d')
+        return day + timedelta(days=1) if end_of_day else day
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@api.route('/users', methods=['GET'])
+@login_required
+def get_users():
+    """Active users, for filter dropdowns"""
+    users = User.query.filter_by(is_active=True).order_by(User.username).all()
+    return jsonify({
+        'users': [{
+            'id': user.id,
+            'username': user.username,
+            'name': f'{user.first_name} {user.last_name}'
+        } for user in users]
+    })
+
+@api.route('/user-cache/stats', methods=['GET'])
+@login_required
+def get_user_cache_stats():
+    """Hit rate and size of this process's user cache"""
+    if not current_user.has_permission('manage_users'):
+        return jsonify({
+            'success': False,
+            'error': 'Permission denied'
+        }), 403
+    return jsonify(user_cache.stats())
+
 @api.route('/audit-log', methods=['GET'])
 @login_required
 def get_audit_log():
     """Get audit log entries"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 20, type=int)
-    table_name = request.args.get('table_name')
-    action = request.args.get('action')
+    filters = {
+        'table_name': request.args.get('table_name') or None,
+        'action': request.args.get('action') or None,
+        'record_id': request.args.get('record_id', type=int),
+        'changed_by': request.args.get('user_id', type=int)
+    }
+    
+    username = request.args.get('user')
+    if username:
+        user = User.query.filter_by(username=username).first()
+        # An unknown user has no entries; -1 matches nothing
+        filters['changed_by'] = user.id if user else -1
     
-    query = AuditLog.query
-    
-    if table_name:
-        query = query.filter(AuditLog.table_name == table_name)
-    if action:
-        query = query.filter(AuditLog.action == action)
+    try:
+        since = _parse_audit_time(request.args.get('date_from'))
+        # A plain date_to includes that whole day
+        before = _parse_audit_time(request.args.get('date_to'), end_of_day=True)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid date_from or date_to'
+        }), 400
     
-    logs = query.order_by(AuditLog.changed_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    # Reads the hot table first, then the archived months. Queries the archive
+    # index cannot count (record_id, partial months) get total/pages of None
+    logs, total, has_more = read_audit_log(filters, page=page, per_page=per_page, since=since, before=before)
     
     return jsonify({
-        'logs': [{
-            'id': log.id,
-            'table_name': log.table_name,
-            'record_id': log.record_id,
-            'action': log.action,
-            'old_values': log.old_values,
-            'new_values': log.new_values,
-            'changed_by': log.user.username if log.user else None,
-            'changed_at': log.changed_at.isoformat()
-        } for log in logs.items],
+        'logs': logs,
         'pagination': {
             'page': page,
             'per_page': per_page,
-            'total': logs.total,
-            'pages': logs.pages
+            'total': total,
+            'pages': ((total + per_page - 1) // per_page if per_page else 0) if total is not None else None,
+            'has_more': has_more
         }
     })
 
+@api.route('/audit-log/stats', methods=['GET'])
+@login_required
+def get_audit_log_stats():
+    """Counts for the audit log stats cards"""
+    return jsonify(audit_log_stats())
+
+@api.route('/audit-log/<table_name>/<int:record_id>/as-of', methods=['GET'])
+@login_required
+def get_record_as_of(table_name, record_id):
+    """Reconstruct an audited record as it was at ?ts= (ISO 8601, UTC; default now)"""
+    ts = request.args.get('ts')
+    try:
+        as_of = datetime.fromisoformat(ts.replace('Z', '+00:00')) if ts else datetime.utcnow()
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid ts, expected an ISO 8601 timestamp'
+        }), 400
+    if as_of.tzinfo:
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    record = reconstruct_as_of(table_name, record_id, as_of)
+    if record is None:
+        return jsonify({
+            'success': False,
+            'error': 'No audit history for this record at that time'
+        }), 404
+    
+    return jsonify(record)
+
 # Error handlers
 @api.errorhandler(404)
 def not_found(error):
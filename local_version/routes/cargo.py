@@ -1,12 +1,18 @@
 # routes/cargo.py
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, abort, send_file
 from flask_login import login_required, current_user
 from datetime import datetime
-from models_new import Cargo, db, EventLog, StatusMilestone
+from models_new import Cargo, db, EventLog, StatusMilestone, ScheduledJob
+from services.cargo_listing import apply_cargo_filters, get_cargo_filters
+from services.export_jobs import (
+    EXCEL_EXPORT_JOB, create_excel_export_job, get_export_progress, get_export_file_path
+)
 from flask_login import current_user
 from flask_babel import _
 from functools import wraps
+import os
+import re
 import pytz
 
 bp = Blueprint('cargo', __name__, url_prefix='/cargo')
@@ -27,23 +33,9 @@ def permission_required(permission):
 @login_required
 @permission_required('view_cargo')
 def cargo_list():
-    # Get filter parameters
-    status_filter = request.args.get('status')
-    mawb_filter = request.args.get('mawb')
-    flight_filter = request.args.get('flight')
-    customer_filter = request.args.get('customer')
-    
     # Build query
     query = Cargo.query.filter_by(is_archived=False)
-    
-    if status_filter:
-        query = query.filter(Cargo.status == status_filter)
-    if mawb_filter:
-        query = query.filter(Cargo.main_awb.contains(mawb_filter))
-    if flight_filter:
-        query = query.filter(Cargo.flight_no.contains(flight_filter))
-    if customer_filter:
-        query = query.filter(Cargo.customer_name.contains(customer_filter))
+    query = apply_cargo_filters(query, get_cargo_filters(request.args))
     
     cargos = query.order_by(Cargo.created_at.desc()).all()
     
@@ -264,68 +256,85 @@ def edit_cargo_alt(cargo_id):
     """
     return redirect(url_for('cargo.edit_cargo', cargo_id=cargo_id))
 
-@bp.route('/batch-edit', methods=['POST'])
-@login_required
-def batch_edit():
+# Batch edit form fields are named <field>_<cargo id>
+BATCH_EDIT_FIELD_RE = re.compile(r'^(flight_no|customer_name|eta|lfd_date|status)_(\d+)$')
+
+def _parse_batch_edit_form(form):
+    """Group the submitted batch edit fields by cargo id: {id: {field: value}}"""
+    submitted = {}
+    for key, value in form.items():
+        match = BATCH_EDIT_FIELD_RE.match(key)
+        if match:
+            field, cargo_id = match.groups()
+            submitted.setdefault(int(cargo_id), {})[field] = value
+    return submitted
+
+def _format_date(value):
+    return value.strftime('%Y-%m-%d') if value else 'None'
+
+def _diff_batch_edit(form):
     """
-    Handle batch editing of multiple cargo entries - returns changes summary.
+    Compare the submitted batch edit fields against only the submitted cargo.
+
+    Only the cargo ids present in the form are loaded, and only the fields
+    that were submitted are compared. Returns ``(changes, updates)``: the
+    human-readable summary per MAWB and a ``(cargo, values)`` pair for each
+    cargo that actually changed. Raises ValueError with a user-facing message
+    on an invalid date.
     """
-    changes = []
+    submitted = _parse_batch_edit_form(form)
+    if not submitted:
+        return [], []
     
-    # Get all cargo entries
-    all_cargos = Cargo.query.all()
+    cargos = Cargo.query.filter(Cargo.id.in_(submitted.keys())).order_by(Cargo.id).all()
     
-    for cargo in all_cargos:
-        cargo_id = str(cargo.id)
-        
-        # Get form values for this cargo
-        flight_no = request.form.get(f'flight_no_{cargo_id}')
-        customer_name = request.form.get(f'customer_name_{cargo_id}')
-        eta_str = request.form.get(f'eta_{cargo_id}')
-        lfd_str = request.form.get(f'lfd_date_{cargo_id}')
-        status = request.form.get(f'status_{cargo_id}')
-        
-        # Check if any changes were made
+    changes = []
+    updates = []
+    for cargo in cargos:
+        fields = submitted[cargo.id]
         changes_made = []
+        values = {}
+        
+        for field, label in (('flight_no', 'Flight No'), ('customer_name', 'Customer'), ('status', 'Status')):
+            if field not in fields:
+                continue
+            new_value = fields[field]
+            old_value = getattr(cargo, field)
+            if new_value != (old_value or ''):
+                changes_made.append(f"{label}: {old_value or 'None'} → {new_value or 'None'}")
+                values[field] = new_value or None
         
-        if flight_no != (cargo.flight_no or ''):
-            changes_made.append(f"Flight No: {cargo.flight_no or 'None'} → {flight_no or 'None'}")
-            
-        if customer_name != (cargo.customer_name or ''):
-            changes_made.append(f"Customer: {cargo.customer_name or 'None'} → {customer_name or 'None'}")
-            
-        if status != (cargo.status or ''):
-            changes_made.append(f"Status: {cargo.status or 'None'} → {status or 'None'}")
-            
-        # Handle date changes
         try:
-            new_eta = None
-            if eta_str:
-                new_eta = datetime.strptime(eta_str, '%Y-%m-%d')
-            
-            if new_eta != cargo.eta:
-                old_eta_str = cargo.eta.strftime('%Y-%m-%d') if cargo.eta else 'None'
-                new_eta_str = new_eta.strftime('%Y-%m-%d') if new_eta else 'None'
-                changes_made.append(f"ETA: {old_eta_str} → {new_eta_str}")
-                
-            new_lfd = None
-            if lfd_str:
-                new_lfd = datetime.strptime(lfd_str, '%Y-%m-%d')
-                
-            if new_lfd != cargo.lfd_date:
-                old_lfd_str = cargo.lfd_date.strftime('%Y-%m-%d') if cargo.lfd_date else 'None'
-                new_lfd_str = new_lfd.strftime('%Y-%m-%d') if new_lfd else 'None'
-                changes_made.append(f"LFD: {old_lfd_str} → {new_lfd_str}")
-                
+            for field, label in (('eta', 'ETA'), ('lfd_date', 'LFD')):
+                if field not in fields:
+                    continue
+                new_date = datetime.strptime(fields[field], '%Y-%m-%d') if fields[field] else None
+                old_date = getattr(cargo, field)
+                if new_date != old_date:
+                    changes_made.append(f"{label}: {_format_date(old_date)} → {_format_date(new_date)}")
+                    values[field] = new_date
         except ValueError:
-            return jsonify({'success': False, 'message': f"Invalid date format for cargo {cargo.main_awb}"})
+            raise ValueError(f"Invalid date format for cargo {cargo.main_awb}")
         
-        # If changes were made, add to changes list
         if changes_made:
             changes.append({
                 'mawb': cargo.main_awb,
                 'changes': changes_made
             })
+            updates.append((cargo, values))
+    
+    return changes, updates
+
+@bp.route('/batch-edit', methods=['POST'])
+@login_required
+def batch_edit():
+    """
+    Handle batch editing of multiple cargo entries - returns changes summary.
+    """
+    try:
+        changes, _updates = _diff_batch_edit(request.form)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
     
     # If no changes, return message
     if not changes:
@@ -342,40 +351,18 @@ def batch_edit_confirm():
     """
     Apply the confirmed batch changes to the database.
     """
-    changes = session.get('batch_changes', [])
-    
-    if not changes:
+    if not session.get('batch_changes'):
         return jsonify({'success': False, 'message': 'No changes to apply.'})
     
-    # Get all cargo entries
-    all_cargos = Cargo.query.all()
-    
     try:
-        for cargo in all_cargos:
-            cargo_id = str(cargo.id)
-            
-            # Get form values for this cargo
-            flight_no = request.form.get(f'flight_no_{cargo_id}')
-            customer_name = request.form.get(f'customer_name_{cargo_id}')
-            eta_str = request.form.get(f'eta_{cargo_id}')
-            lfd_str = request.form.get(f'lfd_date_{cargo_id}')
-            status = request.form.get(f'status_{cargo_id}')
-            
-            # Apply changes
-            cargo.flight_no = flight_no if flight_no else None
-            cargo.customer_name = customer_name if customer_name else None
-            cargo.status = status if status else None
-            
-            # Handle dates
-            if eta_str:
-                cargo.eta = datetime.strptime(eta_str, '%Y-%m-%d')
-            else:
-                cargo.eta = None
-                
-            if lfd_str:
-                cargo.lfd_date = datetime.strptime(lfd_str, '%Y-%m-%d')
-            else:
-                cargo.lfd_date = None
+        _changes, updates = _diff_batch_edit(request.form)
+        
+        # Only changed cargo become dirty, so the flush sees just those rows. The ORM (not a
+        # Core UPDATE) keeps the search index sync hooks and the updated_at onupdate firing;
+        # cargo is not an audited table
+        for cargo, values in updates:
+            for field, value in values.items():
+                setattr(cargo, field, value)
         
         # Commit all changes
         db.session.commit()
@@ -383,7 +370,7 @@ def batch_edit_confirm():
         # Clear session data
         session.pop('batch_changes', None)
         
-        return jsonify({'success': True, 'message': f'Successfully updated {len(changes)} cargo entries.'})
+        return jsonify({'success': True, 'message': f'Successfully updated {len(updates)} cargo entries.'})
         
     except Exception as e:
         db.session.rollback()
@@ -434,107 +421,93 @@ def add_milestone(cargo_id):
 @login_required
 @permission_required('view_cargo')
 def export_excel():
-    """Export cargo list to Excel"""
+    """Queue a background Excel export of the (filtered) cargo list"""
     try:
-        import pandas as pd
-        from io import BytesIO
-        from flask import send_file
-        
-        # Get all cargo data
-        cargos = Cargo.query.filter_by(is_archived=False).all()
-        
-        # Prepare data for export
-        data = []
-        for cargo in cargos:
-            responsibles = ', '.join([u.username for u in cargo.responsibles]) if cargo.responsibles else ''
-            data.append({
-                'MAWB': cargo.main_awb,
-                'Flight No.': cargo.flight_no or '',
-                'Customer': cargo.customer_name or '',
-                'Origin': cargo.origin or '',
-                'Destination': cargo.destination or '',
-                'ETA': cargo.eta.strftime('%Y-%m-%d') if cargo.eta else '',
-                'LFD': cargo.lfd_date.strftime('%Y-%m-%d') if cargo.lfd_date else '',
-                'Status': cargo.status or '',
-                'Weight': cargo.weight or '',
-                'Pieces': cargo.pieces or '',
-                'Responsibles': responsibles,
-                'Created': cargo.created_at.strftime('%Y-%m-%d %H:%M'),
-                'Updated': cargo.updated_at.strftime('%Y-%m-%d %H:%M')
-            })
-        
-        # Create DataFrame and export
-        df = pd.DataFrame(data)
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Cargo List', index=False)
-        
-        output.seek(0)
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'cargo_list_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        )
+        import openpyxl  # noqa: F401 - the export job writes with openpyxl
     except ImportError:
-        flash(_('Excel export requires pandas and openpyxl packages.'), 'error')
+        flash(_('Excel export requires the openpyxl package.'), 'error')
         return redirect(url_for('cargo.cargo_list'))
+    
+    try:
+        job = create_excel_export_job(get_cargo_filters(request.args), current_user.id)
     except Exception as e:
+        db.session.rollback()
         flash(_('Error exporting to Excel: ') + str(e), 'error')
         return redirect(url_for('cargo.cargo_list'))
+    
+    flash(_('Your Excel export has been queued. A download link will appear when it is ready.'), 'info')
+    return redirect(url_for('cargo.export_status', job_id=job.id))
+
+def _get_export_job_or_404(job_id):
+    """Load an export job the current user is allowed to see"""
+    job = ScheduledJob.query.filter_by(id=job_id, job_type=EXCEL_EXPORT_JOB).first_or_404()
+    requested_by = (job.payload or {}).get('requested_by')
+    if requested_by != current_user.id and not current_user.has_permission('manage_users'):
+        abort(404)
+    return job
+
+@bp.route("/export/jobs/<int:job_id>")
+@login_required
+def export_status(job_id):
+    """Show the progress of a background export"""
+    job = _get_export_job_or_404(job_id)
+    return render_template('export_status.html', job=job, progress=get_export_progress(job))
+
+@bp.route("/export/jobs/<int:job_id>/status")
+@login_required
+def export_status_json(job_id):
+    """Progress of a background export, polled by the status page"""
+    job = _get_export_job_or_404(job_id)
+    return jsonify(get_export_progress(job))
+
+@bp.route("/export/jobs/<int:job_id>/download")
+@login_required
+def export_download(job_id):
+    """Download a finished background export"""
+    job = _get_export_job_or_404(job_id)
+    path = get_export_file_path(job)
+    if not path:
+        flash(_('This export is not ready yet.'), 'warning')
+        return redirect(url_for('cargo.export_status', job_id=job_id))
+    
+    return send_file(
+        path,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=os.path.basename(path)
+    )
 
 @bp.route("/export/csv")
 @login_required
 @permission_required('view_cargo')
 def export_csv():
-    """Export cargo list to CSV"""
-    try:
-        import csv
-        from io import StringIO
-        from flask import Response
-        
-        # Get all cargo data
-        cargos = Cargo.query.filter_by(is_archived=False).all()
-        
-        # Create CSV data
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'MAWB', 'Flight No.', 'Customer', 'Origin', 'Destination', 
-            'ETA', 'LFD', 'Status', 'Weight', 'Pieces', 'Responsibles', 
-            'Created', 'Updated'
-        ])
+    """Stream the (filtered) cargo list as CSV"""
+    import csv
+    from io import StringIO
+    from flask import Response, stream_with_context
+    from services.cargo_export import EXPORT_HEADERS, iter_export_batches
+    
+    filters = get_cargo_filters(request.args)
+    
+    def generate():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
         
-        # Write data
-        for cargo in cargos:
-            responsibles = ', '.join([u.username for u in cargo.responsibles]) if cargo.responsibles else ''
-            writer.writerow([
-                cargo.main_awb,
-                cargo.flight_no or '',
-                cargo.customer_name or '',
-                cargo.origin or '',
-                cargo.destination or '',
-                cargo.eta.strftime('%Y-%m-%d') if cargo.eta else '',
-                cargo.lfd_date.strftime('%Y-%m-%d') if cargo.lfd_date else '',
-                cargo.status or '',
-                cargo.weight or '',
-                cargo.pieces or '',
-                responsibles,
-                cargo.created_at.strftime('%Y-%m-%d %H:%M'),
-                cargo.updated_at.strftime('%Y-%m-%d %H:%M')
-            ])
+        # Send the header straight away so the download starts immediately
+        writer.writerow(EXPORT_HEADERS)
+        yield buffer.getvalue()
         
-        output.seek(0)
-        return Response(
-            output.getvalue(),
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=cargo_list_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-        )
-    except Exception as e:
-        flash(_('Error exporting to CSV: ') + str(e), 'error')
-        return redirect(url_for('cargo.cargo_list'))
+        for rows in iter_export_batches(filters):
+            buffer.seek(0)
+            buffer.truncate(0)
+            writer.writerows(rows)
+            yield buffer.getvalue()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename=cargo_list_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
+    )
 
 @bp.route('/delete/<int:cargo_id>')
 @login_required
@@ -1,9 +1,10 @@
-import smtplib
-from email.mime.text import MIMEText
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import login_required, current_user
-from models_new import EmailLog, Cargo, EmailTemplate, db
+from models_new import EmailLog, Cargo, EmailTemplate, ScheduledJob, db
 from flask_babel import _
+from services.bulk_email import BULK_EMAIL_JOB, create_bulk_email_job, get_bulk_email_progress
+from services.cargo_listing import get_cargo_filters
+from services.email_outbox import enqueue_email
 
 bp = Blueprint('email_center', __name__, url_prefix='/email')
 
@@ -58,30 +59,75 @@ def send_business_email(cargo_id):
         subject = request.form.get('subject')
         body = request.form.get('body')
 
-        msg = MIMEText(body, 'html')
-        msg['Subject'] = subject
-        msg['From'] = 'no-reply@wdtsupplychain.com'
-        msg['To'] = to_emails
-
         try:
-            smtp = smtplib.SMTP('localhost')
-            smtp.sendmail(msg['From'], to_emails.split(','), msg.as_string())
-            smtp.quit()
-
-            log = EmailLog(
+            # Sent by the background sender, which also writes the EmailLog entry
+            enqueue_email(
+                to_emails,
+                subject,
+                body,
                 cargo_id=cargo_id,
                 template_name=template_name,
-                recipients=to_emails,
-                subject=subject,
-                body=body,
-                sent_by_id=current_user.id
+                created_by_id=current_user.id
             )
-            db.session.add(log)
             db.session.commit()
-            flash(_("Email sent and logged."), "success")
+            flash(_("Email queued for sending."), "success")
         except Exception as e:
-            flash(_("Failed to send email: %(err)s", err=str(e)), "danger")
+            db.session.rollback()
+            flash(_("Failed to queue email: %(err)s", err=str(e)), "danger")
 
         return redirect(url_for('email_center.send_business_email', cargo_id=cargo_id))
 
     return render_template('email_center.html', cargo=cargo)
+
+def _flag(value):
+    """A boolean from JSON or a form field"""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'on', 'yes')
+    return bool(value)
+
+@bp.route('/bulk-send', methods=['POST'])
+@login_required
+def bulk_send():
+    """
+    Queue one template for every cargo matching the cargo list filters.
+
+    Accepts JSON or form data: template_id, to_emails, include_responsibles,
+    optional variables (JSON only) and the cargo list filters (status, mawb,
+    flight, customer, responsible). At least one filter is required unless
+    ``all`` is true. Returns the job id and its progress.
+    """
+    if not current_user.has_permission('send_emails'):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True) or request.form
+    filters = data.get('filters')
+    if not isinstance(filters, dict):
+        filters = data
+    include_responsibles = _flag(data.get('include_responsibles'))
+    variables = data.get('variables')
+
+    try:
+        job = create_bulk_email_job(
+            int(data.get('template_id') or 0),
+            get_cargo_filters(filters),
+            current_user.id,
+            to_emails=data.get('to_emails'),
+            include_responsibles=include_responsibles,
+            variables=variables if isinstance(variables, dict) else None,
+            all_cargo=_flag(data.get('all'))
+        )
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(get_bulk_email_progress(job)), 202
+
+@bp.route('/bulk-send/<int:job_id>', methods=['GET'])
+@login_required
+def bulk_send_status(job_id):
+    """Progress of a bulk send: messages queued so far and their delivery"""
+    job = ScheduledJob.query.filter_by(id=job_id, job_type=BULK_EMAIL_JOB).first_or_404()
+    requested_by = (job.payload or {}).get('requested_by')
+    if requested_by != current_user.id and not current_user.has_permission('manage_users'):
+        abort(404)
+    return jsonify(get_bulk_email_progress(job))
@@ -0,0 +1,439 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.orm import joinedload
+from models_new import db, AuditLog, User
+import gzip
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'archive.lock'
+# A lock older than this is assumed to belong to a crashed archiver
+STALE_LOCK_SECONDS = 6 * 3600
+ARCHIVE_BATCH_SIZE = 1000
+# Future monthly partitions kept ready on MySQL
+PARTITIONS_AHEAD = 3
+
+AUDIT_COLUMNS = ('id', 'table_name', 'record_id', 'action', 'old_values', 'new_values', 'changed_by', 'changed_at')
+# Fields of a part's ``counts_by_user`` keys, so these filters are counted without reading the part
+COUNTED_FIELDS = ('table_name', 'action', 'changed_by')
+
+# --- Months --------------------------------------------------------------
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def _add_months(value, months):
+    years, month = divmod(value.month - 1 + months, 12)
+    return datetime(value.year + years, month + 1, 1)
+
+def _month_key(value):
+    return value.strftime('%Y-%m')
+
+def _month_from_key(key):
+    return datetime.strptime(key, '%Y-%m')
+
+# --- Archive folder and index ----------------------------------------------
+
+def _archive_folder():
+    folder = current_app.config.get('AUDIT_ARCHIVE_FOLDER') or os.path.join(current_app.root_path, 'audit_archive')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def load_archive_index():
+    """The archive index: {'months': {'YYYY-MM': {'parts': [...]}}}"""
+    path = os.path.join(_archive_folder(), INDEX_FILE)
+    if not os.path.exists(path):
+        return {'months': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_archive_index(index):
+    path = os.path.join(_archive_folder(), INDEX_FILE)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+def _acquire_lock():
+    path = os.path.join(_archive_folder(), LOCK_FILE)
+    try:
+        if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+            os.remove(path)
+    except OSError:
+        pass
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    return path
+
+def _serialize(row):
+    record = {column: getattr(row, column) for column in AUDIT_COLUMNS}
+    record['changed_at'] = row.changed_at.isoformat()
+    return record
+
+def iter_archive_part(part):
+    """Yield the records of one archive part, newest first"""
+    path = os.path.join(_archive_folder(), part['file'])
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# --- MySQL partitions --------------------------------------------------------
+
+def _partition_name(month):
+    return 'p' + month.strftime('%Y%m')
+
+def _mysql_partitions(connection):
+    rows = connection.execute(db.text(
+        'SELECT partition_name FROM information_schema.partitions '
+        "WHERE table_schema = DATABASE() AND table_name = 'audit_log' AND partition_name IS NOT NULL"
+    )).all()
+    return {row[0] for row in rows}
+
+def ensure_partitions(now=None):
+    """Split the catch-all partition so the next few months have their own (MySQL only)"""
+    if db.engine.dialect.name != 'mysql':
+        return
+    now = now or datetime.utcnow()
+    with db.engine.begin() as connection:
+        existing = _mysql_partitions(connection)
+        if 'pmax' not in existing:
+            return  # table is not partitioned
+        for offset in range(PARTITIONS_AHEAD + 1):
+            month = _add_months(_month_start(now), offset)
+            name = _partition_name(month)
+            if name in existing:
+                continue
+            upper = _add_months(month, 1).strftime('%Y-%m-%d')
+            connection.execute(db.text(
+                f"ALTER TABLE audit_log REORGANIZE PARTITION pmax INTO ("
+                f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{upper}')), "
+                f"PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            ))
+            logger.info(f"Added audit_log partition {name}")
+
+# --- Archival ------------------------------------------------------------------
+
+def _delete_rows(start, end, min_id, max_id):
+    """Delete archived rows of one month from the hot table, in id batches"""
+    month_filter = db.and_(
+        AuditLog.changed_at >= start, AuditLog.changed_at < end,
+        AuditLog.id >= min_id, AuditLog.id <= max_id
+    )
+    if db.engine.dialect.name == 'mysql':
+        name = _partition_name(start)
+        with db.engine.begin() as connection:
+            if name in _mysql_partitions(connection):
+                in_partition = connection.execute(db.text(
+                    f'SELECT COUNT(*) FROM audit_log PARTITION ({name})'
+                )).scalar()
+                archived = db.session.query(db.func.count(AuditLog.id)).filter(month_filter).scalar()
+                # Dropping the partition is instant, but only safe if it holds nothing else
+                if in_partition == archived:
+                    connection.execute(db.text(f'ALTER TABLE audit_log DROP PARTITION {name}'))
+                    return
+
+    while True:
+        ids = [row.id for row in db.session.query(AuditLog.id).filter(month_filter).limit(ARCHIVE_BATCH_SIZE)]
+        if not ids:
+            break
+        db.session.query(AuditLog).filter(AuditLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+
+def _write_part(month_key, start, end, part_number):
+    """Write the month's hot rows to a gzip JSONL part, newest first; None if there are none"""
+    filename = f'audit_log-{month_key}.{part_number}.jsonl.gz'
+    path = os.path.join(_archive_folder(), filename)
+    temp_path = path + '.part'
+
+    count = 0
+    counts = {}
+    counts_by_user = {}
+    min_id = max_id = None
+    last = None
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+        while True:
+            query = db.session.query(
+                *[getattr(AuditLog, column) for column in AUDIT_COLUMNS]
+            ).filter(AuditLog.changed_at >= start, AuditLog.changed_at < end)
+            if last:
+                query = query.filter(db.or_(
+                    AuditLog.changed_at < last[0],
+                    db.and_(AuditLog.changed_at == last[0], AuditLog.id < last[1])
+                ))
+            rows = query.order_by(AuditLog.changed_at.desc(), AuditLog.id.desc()).limit(ARCHIVE_BATCH_SIZE).all()
+            if not rows:
+                break
+            for row in rows:
+                f.write(json.dumps(_serialize(row), default=str) + '\n')
+                key = f'{row.table_name}|{row.action}'
+                counts[key] = counts.get(key, 0) + 1
+                user_key = f"{key}|{row.changed_by if row.changed_by is not None else ''}"
+                counts_by_user[user_key] = counts_by_user.get(user_key, 0) + 1
+                min_id = row.id if min_id is None else min(min_id, row.id)
+                max_id = row.id if max_id is None else max(max_id, row.id)
+            count += len(rows)
+            last = (rows[-1].changed_at, rows[-1].id)
+
+    if not count:
+        os.remove(temp_path)
+        return None
+    os.replace(temp_path, path)
+    return {
+        'file': filename,
+        'count': count,
+        'min_id': min_id,
+        'max_id': max_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'counts': counts,
+        'counts_by_user': counts_by_user
+    }
+
+def archive_closed_months(now=None, hot_months=None):
+    """
+    Move audit rows of closed months older than the hot window to compressed archives.
+
+    Each month becomes one or more ``audit_log-YYYY-MM.N.jsonl.gz`` parts
+    listed in ``index.json`` with their id range and per table/action (and
+    per table/action/user) counts. A part is recorded in the index before its rows are deleted, so
+    an interrupted run only has to finish the delete. Returns the number of
+    rows archived.
+    """
+    now = now or datetime.utcnow()
+    if hot_months is None:
+        hot_months = current_app.config.get('AUDIT_HOT_MONTHS', 3)
+    cutoff = _add_months(_month_start(now), -(hot_months - 1))
+
+    lock = _acquire_lock()
+    if not lock:
+        logger.info("Audit archival already running elsewhere, skipping")
+        return 0
+
+    archived = 0
+    try:
+        index = load_archive_index()
+
+        # Finish deletes of parts written by an interrupted run
+        for month_key, month in index['months'].items():
+            start = _month_from_key(month_key)
+            for part in month['parts']:
+                _delete_rows(start, _add_months(start, 1), part['min_id'], part['max_id'])
+
+        oldest = db.session.query(db.func.min(AuditLog.changed_at)).filter(AuditLog.changed_at < cutoff).scalar()
+        if oldest is None:
+            return 0
+
+        month = _month_start(oldest)
+        while month < cutoff:
+            end = _add_months(month, 1)
+            month_key = _month_key(month)
+            parts = index['months'].setdefault(month_key, {'parts': []})['parts']
+
+            part = _write_part(month_key, month, end, len(parts) + 1)
+            if part:
+                parts.append(part)
+                _save_archive_index(index)
+                _delete_rows(month, end, part['min_id'], part['max_id'])
+                archived += part['count']
+                logger.info(f"Archived {part['count']} audit rows for {month_key} to {part['file']}")
+            elif not parts:
+                del index['months'][month_key]
+            month = end
+    finally:
+        os.remove(lock)
+
+    return archived
+
+def run_audit_maintenance():
+    """Daily task: keep MySQL partitions ahead, snapshot records, and archive cold months"""
+    from services.audit_history import take_audit_snapshots
+
+    ensure_partitions()
+    # Snapshot first so point-in-time reads of archived months rarely open the archive
+    take_audit_snapshots()
+    return archive_closed_months()
+
+# --- Reading across hot table and archives --------------------------------------
+
+def _record_matches(record, filters, since=None, before=None):
+    if not all(record.get(field) == value for field, value in filters.items()):
+        return False
+    if since is None and before is None:
+        return True
+    changed_at = datetime.fromisoformat(record['changed_at'])
+    return (since is None or changed_at >= since) and (before is None or changed_at < before)
+
+def _part_overlaps(part, since, before):
+    return (since is None or datetime.fromisoformat(part['end']) > since) and \
+        (before is None or datetime.fromisoformat(part['start']) < before)
+
+def _counted_key(key):
+    table_name, action, changed_by = key.split('|', 2)
+    return {'table_name': table_name, 'action': action, 'changed_by': int(changed_by) if changed_by else None}
+
+def _indexed_count(part, filters, since=None, before=None):
+    """
+    Records in a part matching the filters, from the index counts alone.
+
+    None when only reading the part could tell: a record_id filter, a date
+    range that cuts through the part, or a user filter on a part archived
+    before per-user counts were kept.
+    """
+    inside = (since is None or datetime.fromisoformat(part['start']) >= since) and \
+        (before is None or datetime.fromisoformat(part['end']) <= before)
+    if not inside:
+        return None
+    if not filters:
+        return part['count']
+    if set(filters) <= {'table_name', 'action'}:
+        return sum(
+            count for key, count in part['counts'].items()
+            if _record_matches(dict(zip(('table_name', 'action'), key.split('|', 1))), filters)
+        )
+    if set(filters) <= set(COUNTED_FIELDS) and 'counts_by_user' in part:
+        return sum(
+            count for key, count in part['counts_by_user'].items()
+            if _record_matches(_counted_key(key), filters)
+        )
+    return None
+
+def _archive_parts_newest_first(index, since=None, before=None):
+    for month_key in sorted(index['months'], reverse=True):
+        for part in reversed(index['months'][month_key]['parts']):
+            if _part_overlaps(part, since, before):
+                yield part
+
+def _hot_log_to_dict(log):
+    return {
+        'id': log.id,
+        'table_name': log.table_name,
+        'record_id': log.record_id,
+        'action': log.action,
+        'old_values': log.old_values,
+        'new_values': log.new_values,
+        'changed_by': log.user.username if log.user else None,
+        'changed_at': log.changed_at.isoformat()
+    }
+
+def read_audit_log(filters=None, page=1, per_page=20, since=None, before=None):
+    """
+    One page of audit entries, newest first, across the hot table and the archives.
+
+    ``filters`` maps AuditLog column names to required values and
+    ``since``/``before`` bound ``changed_at`` (inclusive/exclusive). Returns
+    ``(entries, total, has_more)`` with entries as dicts (``changed_by`` is
+    the username). Archived months are older than anything in the hot
+    table, so the archive is only opened once the hot rows are exhausted,
+    and only the parts overlapping the date range are read.
+
+    ``total`` is exact when the archive index can count the matches
+    (table, action and user filters over whole months). Otherwise it is
+    None and paging relies on ``has_more``, so archive parts are read only
+    until the page is full instead of being scanned to count them.
+    """
+    filters = {field: value for field, value in (filters or {}).items() if value is not None}
+    offset = max(page - 1, 0) * per_page
+
+    query = AuditLog.query
+    for field, value in filters.items():
+        query = query.filter(getattr(AuditLog, field) == value)
+    if since is not None:
+        query = query.filter(AuditLog.changed_at >= since)
+    if before is not None:
+        query = query.filter(AuditLog.changed_at < before)
+    hot_total = query.order_by(None).count()
+
+    entries = []
+    if offset < hot_total:
+        logs = query.options(joinedload(AuditLog.user)).order_by(
+            AuditLog.changed_at.desc(), AuditLog.id.desc()
+        ).offset(offset).limit(per_page).all()
+        entries = [_hot_log_to_dict(log) for log in logs]
+
+    parts = list(_archive_parts_newest_first(load_archive_index(), since, before))
+    part_counts = [_indexed_count(part, filters, since, before) for part in parts]
+    exact = all(count is not None for count in part_counts)
+
+    hot_more = offset + per_page < hot_total
+    wanted = per_page - len(entries)
+    # Without a total, one more match than the page holds tells whether there is a next page
+    need = wanted if exact or hot_more else wanted + 1
+    skip = max(offset - hot_total, 0)
+    archived_entries = []
+    for part, part_count in zip(parts, part_counts):
+        if len(archived_entries) >= need:
+            break
+        if part_count is not None and skip >= part_count:
+            skip -= part_count
+            continue
+        for record in iter_archive_part(part):
+            if not _record_matches(record, filters, since, before):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            archived_entries.append(record)
+            if len(archived_entries) >= need:
+                break
+
+    if exact:
+        total = hot_total + sum(part_counts)
+        has_more = offset + per_page < total
+    else:
+        total = None
+        has_more = hot_more or len(archived_entries) > wanted
+        archived_entries = archived_entries[:max(wanted, 0)]
+
+    # Archived records keep the user id; resolve usernames for this page only
+    user_ids = {record['changed_by'] for record in archived_entries if record.get('changed_by')}
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids)).all()) if user_ids else {}
+    for record in archived_entries:
+        record['changed_by'] = usernames.get(record.get('changed_by'))
+
+    return entries + archived_entries, total, has_more
+
+def audit_log_stats(now=None):
+    """
+    Entry counts for the audit log page: today (UTC), last 24 hours, last 7
+    days, total, and users active in the last 7 days.
+
+    The hot table is counted in one aggregate query; archived months only
+    add to the total, which comes from the archive index.
+    """
+    now = now or datetime.utcnow()
+    today = datetime(now.year, now.month, now.day)
+    day_ago = now - timedelta(days=1)
+    week_ago = now - timedelta(days=7)
+
+    def since(start):
+        return db.func.sum(db.case((AuditLog.changed_at >= start, 1), else_=0))
+
+    row = db.session.query(
+        db.func.count(AuditLog.id),
+        since(today),
+        since(day_ago),
+        since(week_ago),
+        db.func.count(db.distinct(db.case((AuditLog.changed_at >= week_ago, AuditLog.changed_by))))
+    ).one()
+    total, today_count, day_count, week_count, active_users = row
+
+    archived = sum(
+        part['count'] for month in load_archive_index()['months'].values() for part in month['parts']
+    )
+    return {
+        'today': today_count or 0,
+        'last_24h': day_count or 0,
+        'last_7_days': week_count or 0,
+        'total': (total or 0) + archived,
+        'active_users': active_users or 0
+    }
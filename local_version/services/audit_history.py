@@ -0,0 +1,274 @@
+from datetime import datetime
+from flask import current_app
+from models_new import db, AuditLog, AuditSnapshot, AuditSnapshotWatermark
+from services.audit_archive import load_archive_index, iter_archive_part
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Records whose snapshots are written per commit while snapshotting
+SNAPSHOT_COMMIT_SIZE = 200
+
+# --- Folding audit entries ---------------------------------------------------
+
+def _entry_dict(log):
+    return {
+        'id': log.id,
+        'action': log.action,
+        'new_values': log.new_values,
+        'changed_at': log.changed_at
+    }
+
+def _position(entry):
+    """Where an entry sits in a record's history; ids alone are not monotonic across archival"""
+    return (entry['changed_at'], entry['id'])
+
+def _after(query, position):
+    changed_at, entry_id = position
+    return query.filter(db.or_(
+        AuditLog.changed_at > changed_at,
+        db.and_(AuditLog.changed_at == changed_at, AuditLog.id > entry_id)
+    ))
+
+def _apply_entry(state, entry):
+    """
+    Fold one audit entry into a record state; returns (state, complete_base).
+
+    INSERT entries carry every column and start a complete state, DELETE
+    ends it, and UPDATE entries carry the changed columns (older entries the
+    whole row), so they are merged over what is known.
+    """
+    action = entry['action']
+    if action == 'INSERT':
+        return dict(entry.get('new_values') or {}), True
+    if action == 'DELETE':
+        return None, True
+    merged = dict(state or {})
+    merged.update(entry.get('new_values') or {})
+    return merged, False
+
+# --- Reading entries -------------------------------------------------------------
+
+def _hot_entries(table_name, record_id, after=None, until=None, max_id=None):
+    query = AuditLog.query.filter(AuditLog.table_name == table_name, AuditLog.record_id == record_id)
+    if after:
+        query = _after(query, after)
+    if until is not None:
+        query = query.filter(AuditLog.changed_at <= until)
+    if max_id is not None:
+        query = query.filter(AuditLog.id <= max_id)
+    return [_entry_dict(log) for log in query.order_by(AuditLog.changed_at, AuditLog.id)]
+
+def _archive_parts(after=None, until=None):
+    """Archive parts that can hold entries after ``after`` and up to ``until``"""
+    index = load_archive_index()
+    for month_key in sorted(index['months']):
+        for part in index['months'][month_key]['parts']:
+            if after and datetime.fromisoformat(part['end']) <= after[0]:
+                continue
+            if until is not None and datetime.fromisoformat(part['start']) > until:
+                continue
+            yield part
+
+def _archived_entries(afters, until=None):
+    """
+    Archived entries of several records, oldest first.
+
+    ``afters`` maps (table_name, record_id) to the position already
+    accounted for (or None); parts wholly before all of them are skipped.
+    """
+    found = {key: [] for key in afters}
+    if not afters:
+        return found
+    positions = list(afters.values())
+    earliest = None if None in positions else min(positions)
+    for part in _archive_parts(earliest, until):
+        for record in iter_archive_part(part):
+            key = (record['table_name'], record['record_id'])
+            if key not in found:
+                continue
+            entry = dict(record, changed_at=datetime.fromisoformat(record['changed_at']))
+            if afters[key] and _position(entry) <= afters[key]:
+                continue
+            if until is not None and entry['changed_at'] > until:
+                continue
+            found[key].append(entry)
+    for entries in found.values():
+        entries.sort(key=_position)
+    return found
+
+def _merge(archived, hot):
+    """Archived then hot entries; a part whose rows were not deleted yet shows up in both"""
+    seen = {_position(entry) for entry in hot}
+    return sorted([entry for entry in archived if _position(entry) not in seen] + hot, key=_position)
+
+# --- Snapshots -----------------------------------------------------------------
+
+def _snapshot_position(snapshot):
+    return (snapshot.taken_at, snapshot.audit_log_id) if snapshot else None
+
+def _latest_snapshot(table_name, record_id, as_of=None, before=None):
+    query = AuditSnapshot.query.filter_by(table_name=table_name, record_id=record_id)
+    if as_of is not None:
+        query = query.filter(AuditSnapshot.taken_at <= as_of)
+    if before is not None:
+        query = query.filter(AuditSnapshot.taken_at < before)
+    return query.order_by(AuditSnapshot.taken_at.desc(), AuditSnapshot.audit_log_id.desc()).first()
+
+def _snapshot(table_name, record_id, state, complete, entry):
+    return AuditSnapshot(
+        table_name=table_name,
+        record_id=record_id,
+        audit_log_id=entry['id'],
+        state=state,
+        complete=complete,
+        taken_at=entry['changed_at']
+    )
+
+def _snapshot_watermark():
+    watermark = db.session.get(AuditSnapshotWatermark, 1)
+    if watermark is None:
+        watermark = AuditSnapshotWatermark(id=1, audit_log_id=0)
+        db.session.add(watermark)
+    return watermark
+
+def _watermark_id():
+    watermark = db.session.get(AuditSnapshotWatermark, 1)
+    return watermark.audit_log_id if watermark else 0
+
+def take_audit_snapshots(interval=None):
+    """
+    Snapshot every record with audit entries added since the last run.
+
+    A snapshot is written after every ``interval`` entries and at the
+    record's latest entry, so rebuilding any past state needs one snapshot
+    and at most ``interval`` entries, plus whatever arrived since the last
+    run. New entries are found by audit_log id rather than changed_at:
+    replayed spool files and a lagging audit writer insert rows dated
+    before snapshots already taken, and those records are rebuilt from
+    the last snapshot preceding their earliest new entry. Returns the
+    number of snapshots written.
+    """
+    if interval is None:
+        interval = current_app.config.get('AUDIT_SNAPSHOT_INTERVAL', 20)
+    interval = max(interval, 1)
+
+    watermark = _snapshot_watermark()
+    last_id = watermark.audit_log_id
+    high = db.session.query(db.func.max(AuditLog.id)).scalar() or 0
+    if high < last_id:
+        # SQLite hands out ids again once the newest rows were archived
+        last_id = 0
+    earliest = dict(
+        ((table_name, record_id), changed_at) for table_name, record_id, changed_at in
+        db.session.query(AuditLog.table_name, AuditLog.record_id, db.func.min(AuditLog.changed_at))
+        .filter(AuditLog.id > last_id, AuditLog.id <= high)
+        .group_by(AuditLog.table_name, AuditLog.record_id)
+    )
+    keys = list(earliest)
+    oldest_hot = db.session.query(db.func.min(AuditLog.changed_at)).scalar()
+
+    written = 0
+    for start in range(0, len(keys), SNAPSHOT_COMMIT_SIZE):
+        chunk = keys[start:start + SNAPSHOT_COMMIT_SIZE]
+        bases, rebuilt = {}, set()
+        for key in chunk:
+            base = _latest_snapshot(*key)
+            if base and base.taken_at >= earliest[key]:
+                # Late entries landed before existing snapshots; drop those and start over
+                AuditSnapshot.query.filter(
+                    AuditSnapshot.table_name == key[0],
+                    AuditSnapshot.record_id == key[1],
+                    AuditSnapshot.taken_at >= earliest[key]
+                ).delete(synchronize_session=False)
+                base = _latest_snapshot(*key, before=earliest[key])
+                rebuilt.add(key)
+            bases[key] = base
+        hot = {
+            key: _hot_entries(*key, after=_snapshot_position(base), max_id=high)
+            for key, base in bases.items()
+        }
+
+        # Records first seen here may have their start in the archive, and a
+        # rebuild may reach back past the hot table
+        gaps = {
+            key: _snapshot_position(bases[key]) for key in chunk
+            if (not bases[key] and (not hot[key] or hot[key][0]['action'] != 'INSERT'))
+            or (bases[key] and key in rebuilt and (oldest_hot is None or bases[key].taken_at < oldest_hot))
+        }
+        archived = _archived_entries(gaps) if gaps else {}
+
+        for key in chunk:
+            base = bases[key]
+            state = base.state if base else None
+            complete = base.complete if base else False
+            entries = _merge(archived.get(key, []), hot[key])
+            for number, entry in enumerate(entries, 1):
+                state, restarted = _apply_entry(state, entry)
+                complete = complete or restarted
+                if number % interval == 0 or number == len(entries):
+                    db.session.add(_snapshot(*key, state, complete, entry))
+                    written += 1
+        db.session.commit()
+
+    # Advanced last, so an interrupted run is redone (and its snapshots rebuilt) next time
+    watermark = _snapshot_watermark()
+    watermark.audit_log_id = high
+    db.session.commit()
+
+    logger.info(f"Wrote {written} audit snapshots for {len(keys)} records")
+    return written
+
+# --- Point-in-time reads -------------------------------------------------------
+
+def reconstruct_as_of(table_name, record_id, as_of):
+    """
+    State of an audited record at ``as_of`` (naive UTC), or None if it has no history by then.
+
+    Loads the newest snapshot taken at or before ``as_of`` (and before any
+    late entry the snapshots have not caught up with yet) and replays the
+    audit entries after it, reading archived months only when the gap
+    reaches back past the hot table.
+    """
+    snapshot = _latest_snapshot(table_name, record_id, as_of)
+    if snapshot:
+        # Late entries not snapshotted yet may sit before the snapshot
+        late = db.session.query(db.func.min(AuditLog.changed_at)).filter(
+            AuditLog.table_name == table_name,
+            AuditLog.record_id == record_id,
+            AuditLog.id > _watermark_id()
+        ).scalar()
+        if late is not None and late <= snapshot.taken_at:
+            snapshot = _latest_snapshot(table_name, record_id, before=late)
+    after = _snapshot_position(snapshot)
+    state = snapshot.state if snapshot else None
+    complete = snapshot.complete if snapshot else False
+
+    entries = _hot_entries(table_name, record_id, after=after, until=as_of)
+    oldest_hot = db.session.query(db.func.min(AuditLog.changed_at)).scalar()
+    # Archived months all precede the hot table, so the archive only matters
+    # when the snapshot (or the lack of one) leaves a gap reaching before it
+    if oldest_hot is None or not after or after[0] < oldest_hot:
+        key = (table_name, record_id)
+        entries = _merge(_archived_entries({key: after}, until=as_of)[key], entries)
+
+    if not snapshot and not entries:
+        return None
+
+    last_changed_at = snapshot.taken_at.isoformat() if snapshot else None
+    for entry in entries:
+        state, restarted = _apply_entry(state, entry)
+        complete = complete or restarted
+        last_changed_at = entry['changed_at'].isoformat()
+
+    return {
+        'table_name': table_name,
+        'record_id': record_id,
+        'as_of': as_of.isoformat(),
+        'exists': state is not None,
+        'values': state,
+        'complete': complete,
+        'last_changed_at': last_changed_at,
+        'snapshot_at': snapshot.taken_at.isoformat() if snapshot else None,
+        'entries_replayed': len(entries)
+    }
@@ -1,12 +1,19 @@
 from datetime import datetime
 from flask import current_app, g
 from models_new import db, AuditLog, User
-from sqlalchemy import event
+from services.audit_writer import audit_writer
+from sqlalchemy import event, inspect
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Column values never written to the audit log
+SENSITIVE_FIELDS = {'password_hash', 'api_key', 'secret_key'}
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
 class AuditLogger:
     """Audit logging service for tracking changes to key tables"""
     
@@ -24,9 +31,18 @@ class AuditLogger:
             'carriers': 'Carrier',
             'file_types': 'FileType'
         }
+        # Model class -> [(attribute key, column name)], filled lazily
+        self._column_attr_cache = {}
+        self.enabled = False
     
-    def log_change(self, table_name, record_id, action, old_values=None, new_values=None, user_id=None):
-        """Log a change to the audit log"""
+    def log_change(self, table_name, record_id, action, old_values=None, new_values=None, user_id=None, session=None):
+        """
+        Record a change to the audit log.
+
+        The entry is held on the session and handed to the audit writer when
+        the session commits (and dropped if it rolls back), so it is written
+        outside the business transaction.
+        """
         try:
             if user_id is None:
                 # Try to get current user from Flask-Login
@@ -34,33 +50,47 @@ class AuditLogger:
                 if hasattr(current_user, 'id') and current_user.is_authenticated:
                     user_id = current_user.id
             
-            audit_entry = AuditLog(
-                table_name=table_name,
-                record_id=record_id,
-                action=action,
-                old_values=old_values,
-                new_values=new_values,
-                changed_by=user_id,
-                changed_at=datetime.utcnow()
-            )
+            record = {
+                'table_name': table_name,
+                'record_id': record_id,
+                'action': action,
+                'old_values': old_values,
+                'new_values': new_values,
+                'changed_by': user_id,
+                'changed_at': datetime.utcnow().isoformat()
+            }
             
-            db.session.add(audit_entry)
-            logger.info(f"Audit log: {action} on {table_name}:{record_id} by user {user_id}")
+            session = session if session is not None else db.session()
+            session.info.setdefault('audit_pending', []).append(record)
+            logger.debug(f"Audit log: {action} on {table_name}:{record_id} by user {user_id}")
             
         except Exception as e:
             logger.error(f"Error logging audit entry: {str(e)}")
     
-    def log_insert(self, table_name, record_id, new_values=None, user_id=None):
+    def log_insert(self, table_name, record_id, new_values=None, user_id=None, session=None):
         """Log an insert operation"""
-        self.log_change(table_name, record_id, 'INSERT', new_values=new_values, user_id=user_id)
+        self.log_change(table_name, record_id, 'INSERT', new_values=new_values, user_id=user_id, session=session)
     
-    def log_update(self, table_name, record_id, old_values=None, new_values=None, user_id=None):
+    def log_update(self, table_name, record_id, old_values=None, new_values=None, user_id=None, session=None):
         """Log an update operation"""
-        self.log_change(table_name, record_id, 'UPDATE', old_values=old_values, new_values=new_values, user_id=user_id)
+        self.log_change(table_name, record_id, 'UPDATE', old_values=old_values, new_values=new_values, user_id=user_id, session=session)
     
-    def log_delete(self, table_name, record_id, old_values=None, user_id=None):
+    def log_delete(self, table_name, record_id, old_values=None, user_id=None, session=None):
         """Log a delete operation"""
-        self.log_change(table_name, record_id, 'DELETE', old_values=old_values, user_id=user_id)
+        self.log_change(table_name, record_id, 'DELETE', old_values=old_values, user_id=user_id, session=session)
+    
+    def log_bulk_insert(self, table_name, rows, session=None, action='INSERT'):
+        """
+        Log entries for rows written with a Core (bulk) statement, which the
+        flush hooks never see. ``rows`` are mappings of column name to value
+        that include the row's ``id``; for an UPDATE they are logged as the
+        new values.
+        """
+        if not self.enabled or table_name not in self.tracked_tables:
+            return
+        for row in rows:
+            new_values = {name: self._serialize_value(name, value) for name, value in row.items()}
+            self.log_change(table_name, row['id'], action, new_values=new_values, session=session)
     
     def get_changes_for_record(self, table_name, record_id, limit=50):
         """Get audit log entries for a specific record"""
@@ -83,6 +113,25 @@ class AuditLogger:
         
         return query.order_by(AuditLog.changed_at.desc()).limit(limit).all()
     
+    def _column_attrs(self, obj):
+        """(attribute key, column name) pairs for a model class, computed once per mapper"""
+        cls = type(obj)
+        attrs = self._column_attr_cache.get(cls)
+        if attrs is None:
+            mapper = inspect(cls)
+            attrs = [(prop.key, prop.columns[0].name) for prop in mapper.column_attrs]
+            self._column_attr_cache[cls] = attrs
+        return attrs
+    
+    def _serialize_value(self, field_name, value):
+        # Skip sensitive fields
+        if field_name in SENSITIVE_FIELDS:
+            return '[REDACTED]'
+        # Handle datetime objects
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+    
     def format_values_for_log(self, obj, include_fields=None, exclude_fields=None):
         """Format object values for audit logging"""
         if obj is None:
@@ -91,9 +140,7 @@ class AuditLogger:
         if hasattr(obj, '__table__'):
             # SQLAlchemy model instance
             data = {}
-            for column in obj.__table__.columns:
-                field_name = column.name
-                
+            for key, field_name in self._column_attrs(obj):
                 # Skip excluded fields
                 if exclude_fields and field_name in exclude_fields:
                     continue
@@ -102,28 +149,60 @@ class AuditLogger:
                 if include_fields and field_name not in include_fields:
                     continue
                 
-                # Skip sensitive fields
-                if field_name in ['password_hash', 'api_key', 'secret_key']:
-                    data[field_name] = '[REDACTED]'
-                    continue
-                
-                value = getattr(obj, field_name)
-                
-                # Handle datetime objects
-                if hasattr(value, 'isoformat'):
-                    data[field_name] = value.isoformat()
-                else:
-                    data[field_name] = value
+                data[field_name] = self._serialize_value(field_name, getattr(obj, key))
             
             return data
         else:
             # Regular dictionary or object
             return obj
     
+    def diff_values_for_log(self, obj):
+        """
+        Old and new values of only the columns changed on ``obj``, from attribute history.
+
+        Must be called before the flush completes (e.g. in after_flush), while
+        the history is still intact. Old values that were never loaded are
+        recorded as None. Returns ``(None, None)`` when no column changed.
+        """
+        state = inspect(obj)
+        old_values = {}
+        new_values = {}
+        for key, field_name in self._column_attrs(obj):
+            history = state.attrs[key].history
+            if not history.has_changes():
+                continue
+            old = history.deleted[0] if history.deleted else None
+            new = history.added[0] if history.added else None
+            if old == new and history.deleted:
+                continue
+            old_values[field_name] = self._serialize_value(field_name, old)
+            new_values[field_name] = self._serialize_value(field_name, new)
+        
+        if not new_values:
+            return None, None
+        return old_values, new_values
+    
+    def _enable_active_history(self):
+        """
+        Make tracked column attributes load their previous value before being
+        overwritten, so updates to expired (e.g. just committed) objects
+        still have an old value in their history.
+        """
+        for mapper in db.Model.registry.mappers:
+            if mapper.local_table is None or mapper.local_table.name not in self.tracked_tables:
+                continue
+            for prop in mapper.column_attrs:
+                attr = getattr(mapper.class_, prop.key)
+                if not event.contains(attr, 'set', _keep_old_value):
+                    event.listen(attr, 'set', _keep_old_value, active_history=True, retval=True)
+    
     def setup_model_hooks(self, app):
         """Set up SQLAlchemy event hooks for automatic audit logging"""
         from sqlalchemy import event
         
+        self._enable_active_history()
+        self.enabled = True
+        
         @event.listens_for(db.session, 'after_flush')
         def after_flush(session, context):
             """Log changes after session flush"""
@@ -133,16 +212,16 @@ class AuditLogger:
                     record_id = getattr(obj, 'id', None)
                     if record_id:
                         new_values = self.format_values_for_log(obj)
-                        self.log_insert(table_name, record_id, new_values)
+                        self.log_insert(table_name, record_id, new_values, session=session)
             
             for obj in session.dirty:
                 if hasattr(obj, '__tablename__') and obj.__tablename__ in self.tracked_tables:
                     table_name = obj.__tablename__
                     record_id = getattr(obj, 'id', None)
                     if record_id:
-                        # Only log new values for now (old_values not available)
-                        new_values = self.format_values_for_log(obj)
-                        self.log_update(table_name, record_id, None, new_values)
+                        old_values, new_values = self.diff_values_for_log(obj)
+                        if new_values:
+                            self.log_update(table_name, record_id, old_values, new_values, session=session)
             
             for obj in session.deleted:
                 if hasattr(obj, '__tablename__') and obj.__tablename__ in self.tracked_tables:
@@ -150,13 +229,31 @@ class AuditLogger:
                     record_id = getattr(obj, 'id', None)
                     if record_id:
                         old_values = self.format_values_for_log(obj)
-                        self.log_delete(table_name, record_id, old_values)
+                        self.log_delete(table_name, record_id, old_values, session=session)
+        
+        @event.listens_for(db.session, 'after_commit')
+        def after_commit(session):
+            """Hand the committed transaction's audit records to the writer"""
+            records = session.info.pop('audit_pending', None)
+            if records:
+                try:
+                    audit_writer.submit(records)
+                except Exception as e:
+                    logger.error(f"Error submitting audit records: {str(e)}")
+        
+        @event.listens_for(db.session, 'after_rollback')
+        def after_rollback(session):
+            session.info.pop('audit_pending', None)
 
 # Global audit logger instance
 audit_logger = AuditLogger()
 
 def init_audit_logger(app):
     """Initialize audit logger with the Flask app"""
+    if not app.config.get('AUDIT_LOG_ENABLED', True):
+        logger.info("Audit logging disabled")
+        return
+    audit_writer.init_app(app)
     audit_logger.setup_model_hooks(app)
     logger.info("Audit logger initialized")
 
@@ -0,0 +1,260 @@
+from datetime import datetime
+from models_new import db, AuditLog
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Backoff between retries of batches the database refused
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 300.0
+
+class AuditWriter:
+    """
+    Buffered writer that bulk-inserts audit records outside the business transaction.
+
+    Records are appended to a per-process spool file (JSON lines) before they
+    are buffered, and a background thread inserts them in batches. The spool
+    is rotated to an ``.inflight`` file while a batch is written and deleted
+    once it is committed. A batch the database refuses is retried by the
+    writer thread with exponential backoff, and records left behind by a
+    crash are replayed at the next startup (delivery is at-least-once). In
+    ``sync`` mode records are inserted immediately, which keeps tests
+    deterministic.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.mode = 'async'
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.spool_folder = None
+        self.fsync = True
+        self.condition = threading.Condition()
+        self.buffer = []
+        self.thread = None
+        self.running = False
+        self.inflight_seq = 0
+        # (records, inflight path) of batches waiting for a retry, oldest first
+        self.failed = []
+        self.retry_delay = RETRY_BASE_SECONDS
+        self.retry_at = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('AUDIT_LOG_MODE', 'async')
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_SECONDS', 1.0)
+        self.fsync = app.config.get('AUDIT_SPOOL_FSYNC', True)
+        self.spool_folder = app.config.get('AUDIT_SPOOL_FOLDER') or os.path.join(app.instance_path, 'audit_spool')
+        os.makedirs(self.spool_folder, exist_ok=True)
+
+        self.recover_spools()
+        atexit.register(self.stop)
+
+    # --- Spool files ---------------------------------------------------------
+
+    @property
+    def spool_path(self):
+        return os.path.join(self.spool_folder, f'audit-{os.getpid()}.jsonl')
+
+    def _append_to_spool(self, lines):
+        with open(self.spool_path, 'a', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _rotate_spool(self):
+        """Move the current spool aside for the batch being written (caller holds the condition)"""
+        if not os.path.exists(self.spool_path):
+            return None
+        self.inflight_seq += 1
+        inflight = os.path.join(self.spool_folder, f'audit-{os.getpid()}-{self.inflight_seq}.inflight')
+        os.replace(self.spool_path, inflight)
+        return inflight
+
+    @staticmethod
+    def _read_spool(path):
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    logger.warning(f"Skipping unreadable audit spool line in {path}")
+        return records
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def recover_spools(self):
+        """Insert records left behind by processes that exited before flushing"""
+        paths = glob.glob(os.path.join(self.spool_folder, 'audit-*.jsonl')) + \
+            glob.glob(os.path.join(self.spool_folder, 'audit-*.inflight'))
+        for path in paths:
+            try:
+                pid = int(os.path.basename(path).split('-')[1].split('.')[0])
+            except (IndexError, ValueError):
+                continue
+            if pid != os.getpid() and self._pid_alive(pid):
+                continue
+
+            # Renaming claims the file, so only one recovering process replays it
+            claimed = f'{path}.recovering-{os.getpid()}'
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+
+            records = self._read_spool(claimed)
+            try:
+                self._insert(records)
+                os.remove(claimed)
+                logger.info(f"Recovered {len(records)} audit records from {os.path.basename(path)}")
+            except Exception as e:
+                os.replace(claimed, path)
+                logger.error(f"Failed to recover audit spool {path}: {e}")
+
+    # --- Writing -------------------------------------------------------------
+
+    def _insert(self, records):
+        """Bulk insert records on a connection of their own"""
+        if not records:
+            return
+        rows = [{
+            'table_name': r['table_name'],
+            'record_id': r['record_id'],
+            'action': r['action'],
+            'old_values': r.get('old_values'),
+            'new_values': r.get('new_values'),
+            'changed_by': r.get('changed_by'),
+            'changed_at': datetime.fromisoformat(r['changed_at']) if isinstance(r['changed_at'], str) else r['changed_at']
+        } for r in records]
+
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                for start in range(0, len(rows), self.batch_size):
+                    connection.execute(AuditLog.__table__.insert(), rows[start:start + self.batch_size])
+
+    def submit(self, records):
+        """Hand over the audit records of a committed transaction"""
+        if not records:
+            return
+        # Round-trip through JSON so values like Decimal become plain JSON types
+        lines = [json.dumps(record, default=str) for record in records]
+        records = [json.loads(line) for line in lines]
+
+        if self.mode == 'sync' or self.app is None:
+            self._insert(records)
+            return
+
+        with self.condition:
+            self._append_to_spool(lines)
+            self.buffer.extend(records)
+            if not self.running:
+                self._start()
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def _start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self.thread.start()
+
+    def _take_batch(self):
+        """Take everything buffered plus the spool file it lives in (caller holds the condition)"""
+        batch, self.buffer = self.buffer, []
+        return batch, self._rotate_spool() if batch else None
+
+    def _write_batch(self, batch, inflight):
+        try:
+            self._insert(batch)
+        except Exception as e:
+            with self.condition:
+                if not self.failed:
+                    self.retry_at = time.monotonic() + self.retry_delay
+                self.failed.append((batch, inflight))
+            logger.error(f"Failed to write {len(batch)} audit records, kept in {inflight} for a retry: {e}")
+            return
+        if inflight:
+            os.remove(inflight)
+
+    def _retry_failed(self, force=False):
+        """Write the batches that failed earlier, once their backoff has passed (or now with ``force``)"""
+        with self.condition:
+            if not self.failed or (not force and time.monotonic() < self.retry_at):
+                return
+            failed, self.failed = self.failed, []
+
+        for position, (batch, inflight) in enumerate(failed):
+            try:
+                self._insert(batch)
+            except Exception as e:
+                with self.condition:
+                    self.failed = failed[position:] + self.failed
+                    self.retry_delay = min(self.retry_delay * 2, RETRY_MAX_SECONDS)
+                    self.retry_at = time.monotonic() + self.retry_delay
+                logger.error(
+                    f"Retrying {len(failed) - position} audit batches failed again, "
+                    f"next attempt in {self.retry_delay:.0f}s: {e}"
+                )
+                return
+            if inflight:
+                os.remove(inflight)
+
+        with self.condition:
+            if not self.failed:
+                self.retry_delay = RETRY_BASE_SECONDS
+        logger.info(f"Wrote {len(failed)} audit batches that had failed before")
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.running and len(self.buffer) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                batch, inflight = self._take_batch()
+                running = self.running
+            if batch:
+                self._write_batch(batch, inflight)
+            self._retry_failed(force=not running)
+            if not running:
+                return
+
+    def flush(self):
+        """Write everything buffered so far (and retry failed batches), synchronously"""
+        with self.condition:
+            batch, inflight = self._take_batch()
+        if batch:
+            self._write_batch(batch, inflight)
+        self._retry_failed(force=True)
+
+    def stop(self):
+        """Stop the background thread after writing what is buffered"""
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+# Global audit writer instance
+audit_writer = AuditWriter()
@@ -0,0 +1,207 @@
+from datetime import datetime
+from models_new import db, Cargo, EmailOutbox, EmailTemplate, ScheduledJob, User, responsible_association
+from services.cargo_listing import apply_cargo_filters
+from services.email_outbox import enqueue_many, outbox_row, split_recipients
+from services.job_worker import extend_lease
+from services.template_renderer import compile_template
+import logging
+
+logger = logging.getLogger(__name__)
+
+BULK_EMAIL_JOB = 'bulk_email'
+BULK_EMAIL_BATCH_SIZE = 200
+
+def _update_payload(job, **changes):
+    """Replace the JSON payload so SQLAlchemy notices the change"""
+    job.payload = {**(job.payload or {}), **changes}
+    job.updated_at = datetime.utcnow()
+
+def _cargo_query(filters):
+    query = db.session.query(
+        Cargo.id, Cargo.main_awb, Cargo.flight_no, Cargo.customer_name, Cargo.origin,
+        Cargo.destination, Cargo.eta, Cargo.lfd_date, Cargo.status, Cargo.pieces,
+        Cargo.weight, Cargo.description
+    ).filter(Cargo.is_archived == False)
+    return apply_cargo_filters(query, filters or {})
+
+def count_bulk_email_cargo(filters):
+    query = db.session.query(db.func.count(Cargo.id)).filter(Cargo.is_archived == False)
+    return apply_cargo_filters(query, filters or {}).scalar() or 0
+
+def _format_date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+def cargo_template_values(cargo):
+    """Placeholder values for one cargo row; mawb_number/consignee_name match the init_data templates"""
+    return {
+        'main_awb': cargo.main_awb,
+        'mawb_number': cargo.main_awb,
+        'flight_no': cargo.flight_no or '',
+        'customer_name': cargo.customer_name or '',
+        'consignee_name': cargo.customer_name or '',
+        'origin': cargo.origin or '',
+        'destination': cargo.destination or '',
+        'eta': _format_date(cargo.eta),
+        'lfd_date': _format_date(cargo.lfd_date),
+        'status': cargo.status or '',
+        'pieces': cargo.pieces if cargo.pieces is not None else '',
+        'weight': cargo.weight if cargo.weight is not None else '',
+        'description': cargo.description or ''
+    }
+
+def _responsible_emails(cargo_ids):
+    """Map cargo id -> responsible users' email addresses, for one batch"""
+    rows = db.session.query(responsible_association.c.cargo_id, User.email).join(
+        User, User.id == responsible_association.c.user_id
+    ).filter(
+        responsible_association.c.cargo_id.in_(cargo_ids),
+        User.is_active == True
+    ).all()
+    emails = {}
+    for cargo_id, email in rows:
+        if email:
+            emails.setdefault(cargo_id, []).append(email)
+    return emails
+
+def create_bulk_email_job(template_id, filters, user_id, to_emails=None,
+                          include_responsibles=False, variables=None, all_cargo=False):
+    """
+    Queue a mail-merge of one template across every cargo matching ``filters``.
+
+    Each cargo gets its own rendered message, addressed to ``to_emails``
+    plus (optionally) its responsible users. Raises ValueError when the
+    template is unknown, no recipients could ever be found, or no filter is
+    given without ``all_cargo`` (so a dropped filter cannot email every cargo).
+    """
+    filters = filters or {}
+    if not any(filters.values()) and not all_cargo:
+        raise ValueError("Give at least one cargo filter, or all=true to email every cargo")
+    template = db.session.get(EmailTemplate, template_id)
+    if not template or not template.is_active:
+        raise ValueError(f"Email template {template_id} not found")
+    to_emails = split_recipients(to_emails or [])
+    if not to_emails and not include_responsibles:
+        raise ValueError("Give recipients or include the responsible users")
+
+    job = ScheduledJob(
+        job_type=BULK_EMAIL_JOB,
+        run_at=datetime.utcnow(),
+        payload={
+            'template_id': template.id,
+            'filters': filters,
+            'all_cargo': bool(all_cargo),
+            'to_emails': to_emails,
+            'include_responsibles': bool(include_responsibles),
+            'variables': variables or {},
+            'requested_by': user_id,
+            'total': count_bulk_email_cargo(filters),
+            'processed': 0,
+            'enqueued': 0,
+            'skipped': 0,
+            'missing_variables': [],
+            'last_cargo_id': 0
+        }
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    logger.info(f"Queued bulk email job {job.id} ({template.name}) for user {user_id}")
+    return job
+
+def run_bulk_email(job):
+    """
+    Render and enqueue the messages of a bulk email job, one batch of cargo at a time.
+
+    The template is compiled once, recipients are fetched with one query
+    per batch, and each batch of outbox rows is bulk-inserted in the same
+    commit as the job's progress, so a retried job resumes after the last
+    batch instead of queueing duplicates. Delivery (and the EmailLog rows)
+    is left to the pooled email sender.
+    """
+    payload = job.payload or {}
+    template = db.session.get(EmailTemplate, payload.get('template_id'))
+    if not template:
+        raise ValueError(f"Email template {payload.get('template_id')} no longer exists")
+
+    compiled = compile_template(template)
+    filters = payload.get('filters') or {}
+    extra_values = payload.get('variables') or {}
+    fixed_recipients = payload.get('to_emails') or []
+    include_responsibles = payload.get('include_responsibles')
+    missing = set(payload.get('missing_variables') or [])
+    last_id = payload.get('last_cargo_id') or 0
+
+    job.status = 'running'
+    db.session.commit()
+
+    while True:
+        cargos = _cargo_query(filters).filter(Cargo.id > last_id).order_by(Cargo.id).limit(BULK_EMAIL_BATCH_SIZE).all()
+        if not cargos:
+            break
+        responsibles = _responsible_emails([cargo.id for cargo in cargos]) if include_responsibles else {}
+
+        now = datetime.utcnow()
+        rows = []
+        skipped = 0
+        for cargo in cargos:
+            # Fixed recipients first, then responsibles, without duplicates
+            recipients = list(dict.fromkeys(fixed_recipients + responsibles.get(cargo.id, [])))
+            if not recipients:
+                skipped += 1
+                continue
+            rendered = compiled.render({**extra_values, **cargo_template_values(cargo)})
+            missing.update(rendered.missing)
+            row = outbox_row(
+                recipients, rendered.subject, rendered.body,
+                cargo_id=cargo.id,
+                template_name=template.name,
+                created_by_id=payload.get('requested_by'),
+                now=now
+            )
+            row['job_id'] = job.id
+            rows.append(row)
+
+        enqueue_many(rows)
+        last_id = cargos[-1].id
+        payload = job.payload
+        _update_payload(
+            job,
+            processed=payload['processed'] + len(cargos),
+            enqueued=payload['enqueued'] + len(rows),
+            skipped=payload['skipped'] + skipped,
+            missing_variables=sorted(missing),
+            last_cargo_id=last_id
+        )
+        extend_lease(job)
+        db.session.commit()
+
+    payload = job.payload
+    logger.info(
+        f"Bulk email job {job.id} queued {payload['enqueued']} messages "
+        f"({payload['skipped']} cargo without recipients)"
+    )
+
+def get_bulk_email_progress(job):
+    """Queueing progress from the job plus delivery counts from the outbox"""
+    payload = job.payload or {}
+    total = payload.get('total') or 0
+    processed = payload.get('processed') or 0
+    delivery = dict(db.session.query(EmailOutbox.status, db.func.count(EmailOutbox.id)).filter(
+        EmailOutbox.job_id == job.id
+    ).group_by(EmailOutbox.status).all())
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'total': total,
+        'processed': processed,
+        'percent': 100 if job.status == 'completed' else (round(processed / total * 100) if total else 0),
+        'enqueued': payload.get('enqueued') or 0,
+        'skipped': payload.get('skipped') or 0,
+        'missing_variables': payload.get('missing_variables') or [],
+        'delivery': {
+            'pending': delivery.get('pending', 0) + delivery.get('sending', 0),
+            'sent': delivery.get('sent', 0),
+            'failed': delivery.get('failed', 0)
+        },
+        'error': payload.get('error')
+    }
@@ -0,0 +1,106 @@
+from models_new import db, Cargo, User, responsible_association
+from services.cargo_listing import apply_cargo_filters
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADERS = [
+    'MAWB', 'Flight No.', 'Customer', 'Origin', 'Destination',
+    'ETA', 'LFD', 'Status', 'Weight', 'Pieces', 'Responsibles',
+    'Created', 'Updated'
+]
+
+# Rows fetched per round trip while streaming an export
+EXPORT_BATCH_SIZE = 1000
+
+def count_export_rows(filters=None):
+    """Count the cargo rows an export with these filters would produce"""
+    query = db.session.query(db.func.count(Cargo.id)).filter(Cargo.is_archived == False)
+    return apply_cargo_filters(query, filters or {}).scalar() or 0
+
+def _load_responsibles(connection, cargo_ids):
+    """Map cargo id -> comma-separated responsible usernames for one batch"""
+    if not cargo_ids:
+        return {}
+    statement = db.select(
+        responsible_association.c.cargo_id, User.username
+    ).join(
+        User, User.id == responsible_association.c.user_id
+    ).where(
+        responsible_association.c.cargo_id.in_(cargo_ids)
+    ).order_by(responsible_association.c.cargo_id, User.username)
+    rows = connection.execute(statement).all()
+
+    responsibles = {}
+    for cargo_id, username in rows:
+        responsibles.setdefault(cargo_id, []).append(username)
+    return {cargo_id: ', '.join(names) for cargo_id, names in responsibles.items()}
+
+def _format_row(row, responsibles):
+    return [
+        row.main_awb,
+        row.flight_no or '',
+        row.customer_name or '',
+        row.origin or '',
+        row.destination or '',
+        row.eta.strftime('%Y-%m-%d') if row.eta else '',
+        row.lfd_date.strftime('%Y-%m-%d') if row.lfd_date else '',
+        row.status or '',
+        row.weight or '',
+        row.pieces or '',
+        responsibles.get(row.id, ''),
+        row.created_at.strftime('%Y-%m-%d %H:%M') if row.created_at else '',
+        row.updated_at.strftime('%Y-%m-%d %H:%M') if row.updated_at else ''
+    ]
+
+def _export_query(filters):
+    query = db.session.query(
+        Cargo.id, Cargo.main_awb, Cargo.flight_no, Cargo.customer_name,
+        Cargo.origin, Cargo.destination, Cargo.eta, Cargo.lfd_date,
+        Cargo.status, Cargo.weight, Cargo.pieces, Cargo.created_at,
+        Cargo.updated_at
+    ).filter(Cargo.is_archived == False)
+    return apply_cargo_filters(query, filters or {})
+
+def _iter_streamed_rows(filters, batch_size):
+    query = _export_query(filters).order_by(Cargo.id.desc()).yield_per(batch_size)
+    batch = []
+    for row in query:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _iter_keyset_rows(filters, batch_size):
+    last_id = None
+    while True:
+        query = _export_query(filters)
+        if last_id is not None:
+            query = query.filter(Cargo.id < last_id)
+        batch = query.order_by(Cargo.id.desc()).limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+def iter_export_batches(filters=None, batch_size=EXPORT_BATCH_SIZE, keyset=False):
+    """
+    Yield lists of export rows (without header), ``batch_size`` cargo at a time.
+
+    Rows are read with ``yield_per`` as plain column tuples and responsibles
+    are fetched with one IN query per batch, so memory stays flat regardless
+    of how many cargo match. The responsibles lookups use their own
+    connection because MySQL cannot run a second statement on a connection
+    that is still streaming results.
+
+    With ``keyset=True`` each batch is a separate ``id < last_id`` query
+    instead, so no cursor stays open between batches and the caller may
+    commit in between (SQLite cannot write while a read is in progress).
+    """
+    batches = _iter_keyset_rows(filters, batch_size) if keyset else _iter_streamed_rows(filters, batch_size)
+    with db.engine.connect() as lookup_connection:
+        for batch in batches:
+            responsibles = _load_responsibles(lookup_connection, [r.id for r in batch])
+            yield [_format_row(r, responsibles) for r in batch]
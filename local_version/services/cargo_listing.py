@@ -0,0 +1,167 @@
+from datetime import datetime
+from sqlalchemy import case, false
+from sqlalchemy.orm import selectinload
+from models_new import db, Cargo
+from services.search_index import search_filter
+import base64
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SORT_MODES = ('date_added', 'eta_soonest', 'eta_latest', 'lfd_overdue')
+
+# Dashboard tabs and the status each one is restricted to
+TAB_STATUSES = {
+    'all': None,
+    'in-progress': 'In Progress',
+    'completed': 'Completed'
+}
+
+# Query-string parameters understood by the cargo list and its exports
+CARGO_FILTER_PARAMS = ('status', 'mawb', 'flight', 'customer', 'responsible')
+
+def get_cargo_filters(args):
+    """Pick the cargo list filters out of request args (or any mapping)"""
+    return {key: args.get(key) for key in CARGO_FILTER_PARAMS if args.get(key)}
+
+def apply_cargo_filters(query, filters):
+    """Apply the cargo list filters to a query over Cargo"""
+    if filters.get('status'):
+        query = query.filter(Cargo.status == filters['status'])
+    if filters.get('mawb'):
+        query = query.filter(search_filter(Cargo, filters['mawb'], ['main_awb']))
+    if filters.get('flight'):
+        query = query.filter(search_filter(Cargo, filters['flight'], ['flight_no']))
+    if filters.get('customer'):
+        query = query.filter(search_filter(Cargo, filters['customer'], ['customer_name']))
+    if filters.get('responsible'):
+        try:
+            responsible_id = int(filters['responsible'])
+        except (TypeError, ValueError):
+            responsible_id = None
+        if responsible_id:
+            query = query.filter(Cargo.responsibles.any(id=responsible_id))
+    return query
+
+def _is_null_flag(column):
+    return case((column.is_(None), 1), else_=0)
+
+def get_sort_keys(sort_by, now):
+    """
+    Return the ORDER BY keys for a dashboard sort mode as (expression, descending) pairs.
+
+    ``now`` is the user's current wall-clock time as a naive datetime, since
+    naive ETA/LFD values are interpreted in the user's timezone.
+
+    Every nullable value column is preceded by its own is-null flag, so its
+    NULLs sort after all of its values (the keyset filter relies on this).
+    """
+    is_completed = case((Cargo.status == 'Completed', 1), else_=0)
+
+    if sort_by == 'eta_soonest':
+        # Upcoming ETAs first, then past ETAs, then completed / no ETA
+        return [
+            (case((Cargo.status == 'Completed', 1), (Cargo.eta < now, 1), else_=0), False),
+            (case((Cargo.status == 'Completed', 1), (Cargo.eta.is_(None), 1), else_=0), False),
+            (_is_null_flag(Cargo.eta), False),
+            (Cargo.eta, False),
+            (Cargo.id, False)
+        ]
+    if sort_by == 'eta_latest':
+        # Latest ETA first, no ETA at the bottom
+        return [
+            (_is_null_flag(Cargo.eta), False),
+            (Cargo.eta, True),
+            (Cargo.id, True)
+        ]
+    if sort_by == 'lfd_overdue':
+        # Most overdue LFD first, then soonest due; completed cargo at the bottom
+        return [
+            (is_completed, False),
+            (_is_null_flag(Cargo.lfd_date), False),
+            (Cargo.lfd_date, False),
+            (Cargo.id, False)
+        ]
+    # date_added: newest first
+    return [
+        (_is_null_flag(Cargo.created_at), False),
+        (Cargo.created_at, True),
+        (Cargo.id, True)
+    ]
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict) and '$dt' in value:
+        return datetime.fromisoformat(value['$dt'])
+    return value
+
+def encode_cursor(values):
+    """Encode the sort-key values of the last row into an opaque cursor"""
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, or return None if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        return [_decode_value(v) for v in json.loads(raw)]
+    except Exception:
+        logger.warning(f"Ignoring invalid dashboard cursor: {cursor!r}")
+        return None
+
+def _keyset_filter(sort_keys, values):
+    """Build the WHERE clause selecting rows strictly after the cursor row"""
+    clauses = []
+    for i, (expr, descending) in enumerate(sort_keys):
+        value = values[i]
+        if value is None:
+            # The preceding is-null flag puts NULLs after every value, so nothing sorts after them here
+            after = false()
+        else:
+            after = expr < value if descending else expr > value
+        equal_prefix = [
+            prev.is_(None) if prev_value is None else prev == prev_value
+            for (prev, _), prev_value in zip(sort_keys[:i], values[:i])
+        ]
+        clauses.append(db.and_(*equal_prefix, after))
+    return db.or_(*clauses)
+
+def get_cargo_page(sort_by, now, tab='all', cursor=None, per_page=100):
+    """
+    Fetch one keyset-paginated page of unarchived cargo for the dashboard.
+
+    Returns ``(cargos, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    sort_keys = get_sort_keys(sort_by, now)
+    key_columns = [expr.label(f'sort_key_{i}') for i, (expr, _) in enumerate(sort_keys)]
+
+    query = db.session.query(Cargo, *key_columns).options(
+        selectinload(Cargo.responsibles)
+    ).filter(Cargo.is_archived == False)
+
+    status = TAB_STATUSES.get(tab)
+    if status:
+        query = query.filter(Cargo.status == status)
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if values is not None and len(values) == len(sort_keys):
+            query = query.filter(_keyset_filter(sort_keys, values))
+
+    query = query.order_by(*[
+        expr.desc() if descending else expr.asc() for expr, descending in sort_keys
+    ])
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    cargos = [row[0] for row in rows]
+    next_cursor = encode_cursor(list(rows[-1][1:])) if has_more and rows else None
+    return cargos, next_cursor
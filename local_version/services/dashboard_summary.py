@@ -0,0 +1,122 @@
+from sqlalchemy import func
+from models_new import db, Cargo, Bill
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of entries shown in each "Today's Alerts" card
+ALERT_LIST_LIMIT = 5
+
+def _days_between(start, end):
+    """SQL expression for the (fractional) number of days from start to end"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return func.julianday(end) - func.julianday(start)
+    if dialect == 'mysql':
+        return func.timestampdiff(db.text('SECOND'), start, end) / 86400.0
+    # PostgreSQL and others support interval arithmetic
+    return func.extract('epoch', end - start) / 86400.0
+
+def _lfd_alert_filter():
+    """Cargo whose LFD falls 1 to 3 whole days after its ETA"""
+    days = _days_between(Cargo.eta, Cargo.lfd_date)
+    return db.and_(
+        Cargo.eta.isnot(None),
+        Cargo.lfd_date.isnot(None),
+        days >= 1,
+        days < 4
+    )
+
+def _unpaid_bill_filter():
+    return db.and_(Cargo.is_archived == False, Bill.payment_status == 'Unpaid')
+
+def get_status_counts():
+    """Count unarchived cargo per status in a single GROUP BY query"""
+    rows = db.session.query(
+        Cargo.status, func.count(Cargo.id)
+    ).filter(
+        Cargo.is_archived == False
+    ).group_by(Cargo.status).all()
+
+    status_counts = {}
+    for status, count in rows:
+        key = status or 'No Status'
+        status_counts[key] = status_counts.get(key, 0) + count
+    return status_counts
+
+def get_alert_counts():
+    """Count LFD alerts and unpaid bills in a single aggregate query"""
+    lfd_alerts = db.session.query(func.count(Cargo.id)).filter(
+        Cargo.is_archived == False, _lfd_alert_filter()
+    ).scalar_subquery()
+    unpaid_bills = db.session.query(func.count(Bill.id)).join(
+        Cargo, Bill.cargo_id == Cargo.id
+    ).filter(_unpaid_bill_filter()).scalar_subquery()
+
+    row = db.session.query(lfd_alerts, unpaid_bills).one()
+    return {'lfd_alerts': row[0] or 0, 'unpaid_bills': row[1] or 0}
+
+def get_lfd_alerts(limit=ALERT_LIST_LIMIT):
+    """Top-N cargo approaching LFD, soonest LFD first"""
+    cargos = Cargo.query.filter(
+        Cargo.is_archived == False, _lfd_alert_filter()
+    ).order_by(Cargo.lfd_date.asc(), Cargo.id.asc()).limit(limit).all()
+    return [{
+        'id': cargo.id,
+        'main_awb': cargo.main_awb,
+        'days_left': (cargo.lfd_date - cargo.eta).days
+    } for cargo in cargos]
+
+def get_unpaid_bills(limit=ALERT_LIST_LIMIT):
+    """Top-N unpaid bills with their MAWB, oldest first"""
+    rows = db.session.query(
+        Bill.id, Bill.supplier_name, Bill.amount, Bill.currency, Cargo.main_awb
+    ).join(
+        Cargo, Bill.cargo_id == Cargo.id
+    ).filter(
+        _unpaid_bill_filter()
+    ).order_by(Bill.uploaded_at.asc(), Bill.id.asc()).limit(limit).all()
+    return [{
+        'id': row.id,
+        'supplier_name': row.supplier_name,
+        'amount': row.amount,
+        'currency': row.currency,
+        'main_awb': row.main_awb
+    } for row in rows]
+
+def get_pending_actions(limit=ALERT_LIST_LIMIT):
+    """Top-N in-progress cargo, newest first"""
+    rows = db.session.query(Cargo.id, Cargo.main_awb).filter(
+        Cargo.is_archived == False,
+        Cargo.status == 'In Progress'
+    ).order_by(Cargo.created_at.desc(), Cargo.id.desc()).limit(limit).all()
+    return [{'id': row.id, 'main_awb': row.main_awb} for row in rows]
+
+def get_dashboard_summary(limit=ALERT_LIST_LIMIT):
+    """
+    Build the dashboard summary cards from SQL aggregates.
+
+    The cost depends on ``limit`` (the number of alerts shown), not on the
+    number of open cargo records.
+    """
+    status_counts = get_status_counts()
+    alert_counts = get_alert_counts()
+    total = sum(status_counts.values())
+
+    status_distribution = [{
+        'status': status,
+        'count': count,
+        'percent': round(count / total * 100, 1) if total else 0
+    } for status, count in sorted(status_counts.items(), key=lambda item: -item[1])]
+
+    return {
+        'total': total,
+        'in_progress': status_counts.get('In Progress', 0),
+        'completed': status_counts.get('Completed', 0),
+        'status_distribution': status_distribution,
+        'lfd_alerts': get_lfd_alerts(limit),
+        'lfd_alert_count': alert_counts['lfd_alerts'],
+        'unpaid_bills': get_unpaid_bills(limit),
+        'unpaid_bill_count': alert_counts['unpaid_bills'],
+        'pending_actions': get_pending_actions(limit)
+    }
@@ -0,0 +1,481 @@
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from flask import current_app
+from sqlalchemy import event, inspect
+from models_new import db, EmailOutbox, EmailLog
+from services.job_worker import make_worker_id
+import queue
+import smtplib
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SENDER = 'no-reply@wdtsupplychain.com'
+LEASE_SECONDS = 300
+MAX_RETRY_SECONDS = 3600
+# Replies about the session rather than the message: service closing, authentication required
+SESSION_REPLY_CODES = (421, 530)
+
+def split_recipients(recipients):
+    if isinstance(recipients, str):
+        recipients = recipients.split(',')
+    return [address.strip() for address in recipients if address and address.strip()]
+
+def enqueue_email(recipients, subject, body, cargo_id=None, template_name=None,
+                  created_by_id=None, sender=None, subtype='html'):
+    """
+    Add a message to the outbox (caller commits).
+
+    The background sender delivers it after the commit and writes the
+    EmailLog entry once it is sent.
+    """
+    message = EmailOutbox(
+        cargo_id=cargo_id,
+        template_name=template_name,
+        sender=sender or current_app.config.get('MAIL_DEFAULT_SENDER') or DEFAULT_SENDER,
+        recipients=', '.join(split_recipients(recipients)),
+        subject=subject,
+        body=body,
+        subtype=subtype,
+        status='pending',
+        next_attempt_at=datetime.utcnow(),
+        created_by_id=created_by_id
+    )
+    db.session.add(message)
+    return message
+
+def outbox_row(recipients, subject, body, cargo_id=None, template_name=None,
+               created_by_id=None, sender=None, subtype='html', now=None):
+    """A pending outbox row as a dict, for enqueue_many"""
+    now = now or datetime.utcnow()
+    return {
+        'cargo_id': cargo_id,
+        'template_name': template_name,
+        'sender': sender or current_app.config.get('MAIL_DEFAULT_SENDER') or DEFAULT_SENDER,
+        'recipients': ', '.join(split_recipients(recipients)),
+        'subject': subject,
+        'body': body,
+        'subtype': subtype,
+        'status': 'pending',
+        'attempts': 0,
+        'deferrals': 0,
+        'next_attempt_at': now,
+        'created_by_id': created_by_id,
+        'created_at': now
+    }
+
+def enqueue_many(rows):
+    """Add many outbox rows with one insert (caller commits)"""
+    if not rows:
+        return
+    db.session.execute(EmailOutbox.__table__.insert(), rows)
+    # Core inserts skip the ORM hook that wakes the sender
+    db.session.info['email_enqueued'] = True
+
+def build_message(outbox):
+    msg = MIMEText(outbox.body or '', outbox.subtype or 'html')
+    msg['Subject'] = outbox.subject or ''
+    msg['From'] = outbox.sender
+    msg['To'] = outbox.recipients
+    msg['Date'] = formatdate(localtime=False)
+    msg['Message-ID'] = make_msgid()
+    return msg
+
+# --- Claiming ------------------------------------------------------------------
+
+def _claimable(now):
+    """Pending messages that are due, plus sends whose owner let the lease expire"""
+    return db.or_(
+        db.and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+        db.and_(EmailOutbox.status == 'sending', EmailOutbox.locked_until < now)
+    )
+
+def _fail_exhausted_leases(now, max_attempts):
+    """Expired sends with no attempts left fail instead of being reclaimed"""
+    table = EmailOutbox.__table__
+    db.session.execute(table.update().where(
+        table.c.status == 'sending',
+        table.c.locked_until < now,
+        table.c.attempts + 1 >= max_attempts
+    ).ordered_values(
+        (table.c.attempts, table.c.attempts + 1),
+        (table.c.status, 'failed'),
+        (table.c.last_error, 'Sender stopped while delivering (lease expired)'),
+        (table.c.locked_by, None),
+        (table.c.locked_until, None)
+    ))
+
+def claim_outbox(worker_id, limit, lease_seconds=LEASE_SECONDS, max_attempts=5):
+    """
+    Atomically claim up to ``limit`` due messages; same scheme as job_worker.claim_due_jobs.
+
+    Reclaiming an expired lease counts as an attempt, so a message that
+    keeps killing its sender stops after ``max_attempts``.
+    """
+    if limit <= 0:
+        return []
+
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=lease_seconds)
+    candidates = db.session.query(EmailOutbox.id).filter(
+        _claimable(now)
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(limit)
+
+    try:
+        _fail_exhausted_leases(now, max_attempts)
+        if db.engine.dialect.name == 'mysql':
+            ids = [row.id for row in candidates.with_for_update(skip_locked=True)]
+            claim_filter = EmailOutbox.id.in_(ids)
+        else:
+            ids = [row.id for row in candidates]
+            claim_filter = db.and_(EmailOutbox.id.in_(ids), _claimable(now))
+
+        if not ids:
+            db.session.commit()
+            return []
+
+        # MySQL assigns SET values left to right, so attempts is computed before status changes
+        table = EmailOutbox.__table__
+        db.session.execute(table.update().where(claim_filter).ordered_values(
+            (table.c.attempts, db.case((table.c.status == 'sending', table.c.attempts + 1), else_=table.c.attempts)),
+            (table.c.status, 'sending'),
+            (table.c.locked_by, worker_id),
+            (table.c.locked_until, expires)
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if db.engine.dialect.name == 'mysql':
+        return ids
+    return [row.id for row in db.session.query(EmailOutbox.id).filter(
+        EmailOutbox.id.in_(ids),
+        EmailOutbox.locked_by == worker_id,
+        EmailOutbox.locked_until == expires
+    )]
+
+def extend_outbox_lease(worker_id, ids, lease_seconds=LEASE_SECONDS):
+    """Push out the lease of claimed messages still waiting in a batch (caller commits)"""
+    if not ids:
+        return
+    table = EmailOutbox.__table__
+    db.session.execute(table.update().where(
+        table.c.id.in_(ids),
+        table.c.status == 'sending',
+        table.c.locked_by == worker_id
+    ).values(locked_until=datetime.utcnow() + timedelta(seconds=lease_seconds)))
+
+# --- SMTP connections ------------------------------------------------------------
+
+class SMTPConnectionPool:
+    """
+    Persistent SMTP sessions shared by the sender threads.
+
+    A connection is reused for message after message; one that sat idle is
+    checked with NOOP first, and one that failed is closed instead of being
+    returned.
+    """
+
+    def __init__(self, host='localhost', port=25, use_tls=False, username=None, password=None,
+                 timeout=30, size=2, idle_check_seconds=30):
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.size = size
+        self.idle_check_seconds = idle_check_seconds
+        self.idle = queue.LifoQueue()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            host=config.get('MAIL_SERVER') or 'localhost',
+            port=config.get('MAIL_PORT', 25),
+            use_tls=config.get('MAIL_USE_TLS', False),
+            username=config.get('MAIL_USERNAME'),
+            password=config.get('MAIL_PASSWORD'),
+            timeout=config.get('MAIL_TIMEOUT', 30),
+            size=config.get('MAIL_POOL_SIZE', 2),
+            idle_check_seconds=config.get('MAIL_IDLE_CHECK_SECONDS', 30)
+        )
+
+    def _connect(self):
+        # SMTP() closes the socket itself when the greeting is refused
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    def acquire(self):
+        while True:
+            try:
+                smtp, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - released_at < self.idle_check_seconds:
+                return smtp
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close(smtp)
+
+    def release(self, smtp, broken=False):
+        if broken or self.idle.qsize() >= self.size:
+            self._close(smtp)
+        else:
+            self.idle.put((smtp, time.monotonic()))
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def close_all(self):
+        while True:
+            try:
+                smtp, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(smtp)
+
+# --- Sender --------------------------------------------------------------------
+
+class EmailSender:
+    """
+    Background delivery of the email outbox.
+
+    Each sender thread claims a batch of due messages (with a lease, so
+    several worker processes can run side by side), sends them one after
+    another over a pooled SMTP connection and records the outcome per
+    message. Temporary failures are retried with exponential backoff;
+    permanent (5xx) rejections and messages out of attempts are marked
+    failed. When the relay cannot be reached or refuses the session
+    (greeting, STARTTLS, login) the messages are put back without using
+    up an attempt, since none of them is at fault, up to
+    ``max_deferrals`` times in a row. The lease of the rest of the batch
+    is extended after every message, so slow sends cannot outlive it.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.pool = None
+        self.worker_id = make_worker_id()
+        self.threads = []
+        self.running = False
+        self.condition = threading.Condition()
+        self.wakeups = 0
+        self.batch_size = 20
+        self.max_attempts = 5
+        self.max_deferrals = 24
+        self.retry_base_seconds = 30
+        self.poll_seconds = 5
+
+    def init_app(self, app):
+        self.app = app
+        self.pool = SMTPConnectionPool.from_config(app.config)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 20)
+        self.max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', 5)
+        self.max_deferrals = app.config.get('MAIL_MAX_DEFERRALS', 24)
+        self.retry_base_seconds = app.config.get('MAIL_RETRY_BASE_SECONDS', 30)
+        self.poll_seconds = app.config.get('MAIL_POLL_SECONDS', 5)
+        _register_outbox_hooks(self)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._run, name=f'email-sender-{n}', daemon=True)
+            for n in range(max(self.pool.size, 1))
+        ]
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"Email sender started with {len(self.threads)} connections")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.pool:
+            self.pool.close_all()
+
+    def notify(self):
+        """Wake the sender threads for newly enqueued messages"""
+        with self.condition:
+            self.wakeups += 1
+            self.condition.notify_all()
+
+    def _run(self):
+        while self.running:
+            with self.condition:
+                wakeups = self.wakeups
+            try:
+                sent = self.send_due()
+            except Exception as e:
+                logger.error(f"Email sender error: {e}")
+                sent = 0
+            # A full batch means more may be due; otherwise sleep until woken or the next poll
+            if sent < self.batch_size:
+                with self.condition:
+                    if self.running and self.wakeups == wakeups:
+                        self.condition.wait(self.poll_seconds)
+
+    def _retry_delay(self, attempts):
+        return min(self.retry_base_seconds * 2 ** max(attempts - 1, 0), MAX_RETRY_SECONDS)
+
+    def _mark_sent(self, message, refused):
+        """Record a delivered message; returns its EmailLog row (None without a cargo)"""
+        now = datetime.utcnow()
+        message.status = 'sent'
+        message.sent_at = now
+        message.attempts += 1
+        message.locked_by = message.locked_until = None
+        message.last_error = f"Refused recipients: {', '.join(refused)}" if refused else None
+        if not message.cargo_id:
+            return None
+        return {
+            'cargo_id': message.cargo_id,
+            'template_name': message.template_name,
+            'recipients': message.recipients,
+            'subject': message.subject,
+            'body': message.body,
+            'sent_at': now,
+            'sent_by_id': message.created_by_id
+        }
+
+    def _mark_failed(self, message, error, permanent=False):
+        message.attempts += 1
+        message.deferrals = 0
+        message.last_error = str(error)
+        message.locked_by = message.locked_until = None
+        if permanent or message.attempts >= self.max_attempts:
+            message.status = 'failed'
+            logger.error(f"Giving up on email {message.id} after {message.attempts} attempts: {error}")
+        else:
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=self._retry_delay(message.attempts))
+            logger.warning(f"Email {message.id} failed (attempt {message.attempts}), retrying: {error}")
+
+    def _defer(self, messages, error):
+        """Put messages back after a connection failure without counting an attempt"""
+        logger.warning(f"SMTP connection failed, deferring {len(messages)} emails: {error}")
+        for message in messages:
+            message.deferrals += 1
+            if message.deferrals > self.max_deferrals:
+                self._mark_failed(message, f"{error} (deferred {self.max_deferrals} times)", permanent=True)
+                continue
+            message.status = 'pending'
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=self._retry_delay(message.deferrals))
+            message.last_error = str(error)
+            message.locked_by = message.locked_until = None
+
+    def send_due(self, limit=None):
+        """Claim and send one batch of due messages; returns the number claimed"""
+        with self.app.app_context():
+            ids = claim_outbox(self.worker_id, limit or self.batch_size, max_attempts=self.max_attempts)
+            if not ids:
+                return 0
+            messages = EmailOutbox.query.filter(EmailOutbox.id.in_(ids)).order_by(EmailOutbox.id).all()
+
+            smtp = None
+            email_logs = []
+            for index, message in enumerate(messages):
+                if smtp is None:
+                    try:
+                        smtp = self.pool.acquire()
+                    except (smtplib.SMTPException, OSError) as e:
+                        # Relay down or refusing the session: retry the rest of the batch later
+                        self._defer(messages[index:], e)
+                        db.session.commit()
+                        break
+                try:
+                    refused = smtp.sendmail(
+                        message.sender, split_recipients(message.recipients), build_message(message).as_string()
+                    )
+                    log = self._mark_sent(message, list(refused))
+                    if log:
+                        email_logs.append(log)
+                except smtplib.SMTPRecipientsRefused as e:
+                    self._mark_failed(message, e, permanent=True)
+                except smtplib.SMTPResponseException as e:
+                    if e.smtp_code in SESSION_REPLY_CODES:
+                        self._defer([message], e)
+                        self.pool.release(smtp, broken=True)
+                        smtp = None
+                    else:
+                        self._mark_failed(message, e, permanent=e.smtp_code >= 500)
+                except smtplib.SMTPNotSupportedError as e:
+                    # e.g. an internationalized address the relay cannot take
+                    self._mark_failed(message, e, permanent=True)
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Connection trouble: retry later on a fresh connection
+                    self._defer([message], e)
+                    self.pool.release(smtp, broken=True)
+                    smtp = None
+                except Exception as e:
+                    # Anything else is the message's fault (e.g. it cannot be encoded); the
+                    # session state is unknown, so the rest of the batch gets a fresh one
+                    logger.exception(f"Email {message.id} could not be sent")
+                    self._mark_failed(message, e)
+                    self.pool.release(smtp, broken=True)
+                    smtp = None
+                # Commit per message so a crash cannot resend what was already sent, and keep
+                # the rest of the batch leased so no other sender reclaims it meanwhile
+                extend_outbox_lease(self.worker_id, [waiting.id for waiting in messages[index + 1:]])
+                db.session.commit()
+
+            if smtp is not None:
+                self.pool.release(smtp)
+            # The outbox row is the delivery record; EmailLog entries follow in one insert
+            if email_logs:
+                db.session.execute(EmailLog.__table__.insert(), email_logs)
+                db.session.commit()
+            return len(ids)
+
+def _register_outbox_hooks(sender):
+    """Wake this process's sender after commits that enqueue email"""
+    if getattr(_register_outbox_hooks, 'registered', False):
+        return
+    _register_outbox_hooks.registered = True
+
+    @event.listens_for(EmailOutbox, 'after_insert')
+    def after_insert(mapper, connection, target):
+        session = inspect(target).session
+        if session is not None:
+            session.info['email_enqueued'] = True
+
+    @event.listens_for(db.session, 'after_commit')
+    def after_commit(session):
+        # Processes without a running sender leave it to the worker's poll
+        if session.info.pop('email_enqueued', False) and sender.running:
+            sender.notify()
+
+    @event.listens_for(db.session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop('email_enqueued', None)
+
+# Global email sender instance
+email_sender = EmailSender()
+
+def init_email_outbox(app):
+    """Initialize the email outbox sender for the Flask app"""
+    email_sender.init_app(app)
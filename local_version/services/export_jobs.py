@@ -0,0 +1,163 @@
+from datetime import datetime
+from flask import current_app
+from models_new import db, ScheduledJob
+from services.cargo_export import EXPORT_HEADERS, iter_export_batches, count_export_rows
+from services.job_worker import extend_lease
+import os
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXCEL_EXPORT_JOB = 'cargo_export_excel'
+
+# cargo_list_<job id>_<timestamp>.xlsx, plus the .part file written before the rename
+EXPORT_FILE_PATTERN = re.compile(r'^cargo_list_(\d+)_\d{8}_\d{6}\.xlsx(\.part)?$')
+
+def _export_folder():
+    folder = current_app.config.get('EXPORT_FOLDER') or os.path.join(current_app.root_path, 'exports')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def _update_payload(job, **changes):
+    """Replace the JSON payload so SQLAlchemy notices the change"""
+    job.payload = {**(job.payload or {}), **changes}
+    job.updated_at = datetime.utcnow()
+
+def create_excel_export_job(filters, user_id):
+    """Queue a background Excel export of the cargo list"""
+    job = ScheduledJob(
+        job_type=EXCEL_EXPORT_JOB,
+        run_at=datetime.utcnow(),
+        payload={
+            'filters': filters or {},
+            'requested_by': user_id,
+            'total': count_export_rows(filters),
+            'processed': 0,
+            'filename': None
+        }
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    logger.info(f"Queued Excel export job {job.id} for user {user_id}")
+    return job
+
+def get_export_file_path(job):
+    """Absolute path of a finished export, or None if it is not ready"""
+    filename = (job.payload or {}).get('filename')
+    if not filename or job.status != 'completed':
+        return None
+    path = os.path.join(_export_folder(), filename)
+    return path if os.path.exists(path) else None
+
+def get_export_progress(job):
+    """Progress information for the export status page"""
+    payload = job.payload or {}
+    total = payload.get('total') or 0
+    processed = payload.get('processed') or 0
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'total': total,
+        'processed': processed,
+        'percent': 100 if job.status == 'completed' else (round(processed / total * 100) if total else 0),
+        'error': payload.get('error'),
+        'ready': get_export_file_path(job) is not None
+    }
+
+def _discard_sheet(sheet):
+    """Close a write-only sheet that will not be saved and delete its temporary file"""
+    try:
+        if not sheet.closed:
+            sheet.close()
+        # What Workbook.save does after copying the sheet into the archive
+        sheet._writer.cleanup()
+    except Exception as e:
+        logger.warning(f"Could not clean up an abandoned export sheet: {e}")
+
+def run_excel_export(job):
+    """
+    Write the export with an openpyxl write-only workbook, one batch at a time.
+
+    Progress is committed after every batch so the status page can poll it.
+    The workbook is written to a temporary name and renamed when complete.
+    """
+    from openpyxl import Workbook
+
+    payload = job.payload or {}
+    filters = payload.get('filters') or {}
+    filename = f"cargo_list_{job.id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    final_path = os.path.join(_export_folder(), filename)
+    temp_path = final_path + '.part'
+
+    _update_payload(job, total=count_export_rows(filters), processed=0, error=None)
+    job.status = 'running'
+    db.session.commit()
+
+    sheet = None
+    try:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Cargo List')
+        sheet.append(EXPORT_HEADERS)
+
+        processed = 0
+        # Keyset batches leave no cursor open, so progress can be committed as we go
+        for rows in iter_export_batches(filters, keyset=True):
+            for row in rows:
+                sheet.append(row)
+            processed += len(rows)
+            _update_payload(job, processed=processed)
+            extend_lease(job)
+            db.session.commit()
+
+        workbook.save(temp_path)
+        os.replace(temp_path, final_path)
+    except Exception:
+        # The job processor rolls back and records the error on the job
+        if sheet is not None:
+            _discard_sheet(sheet)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    _update_payload(job, filename=filename)
+    logger.info(f"Excel export job {job.id} wrote {processed} rows to {filename}")
+
+def cleanup_export_files(max_age_hours):
+    """
+    Delete export files older than ``max_age_hours`` and expire their jobs.
+
+    Works from the files on disk (so leftover ``.part`` files and files of
+    deleted jobs go too) rather than scanning every export job ever run.
+    Returns the number of files removed.
+    """
+    folder = _export_folder()
+    cutoff = time.time() - max_age_hours * 3600
+    expired_job_ids = set()
+    removed = 0
+    for name in os.listdir(folder):
+        match = EXPORT_FILE_PATTERN.match(name)
+        path = os.path.join(folder, name)
+        if not match or os.path.getmtime(path) >= cutoff:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        if not match.group(2):
+            expired_job_ids.add(int(match.group(1)))
+
+    if expired_job_ids:
+        for job in ScheduledJob.query.filter(
+            ScheduledJob.id.in_(expired_job_ids),
+            ScheduledJob.job_type == EXCEL_EXPORT_JOB
+        ):
+            _update_payload(job, filename=None, error='This export has expired. Please export again.')
+        db.session.commit()
+
+    if removed:
+        logger.info(f"Removed {removed} export files older than {max_age_hours} hours")
+    return removed
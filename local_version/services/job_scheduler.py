@@ -1,13 +1,31 @@
-import time
+import heapq
+import json
 import schedule
+import socket
 import threading
 from datetime import datetime, timedelta
 from flask import current_app
+from sqlalchemy import event, inspect
 from models_new import db, ScheduledJob, MAWB, MAWBEvent, User
+from services.job_worker import job_row, upsert_jobs
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on a single wait, so clock changes cannot stall the loop for long
+MAX_SLEEP_SECONDS = 3600
+# Run times sent per wakeup datagram (about 30 bytes each)
+MAX_WAKEUP_RUN_TIMES = 500
+
+def parse_wakeup_address(value):
+    """'host:port' -> (host, port), or None when empty or malformed"""
+    host, _, port = (value or '').rpartition(':')
+    try:
+        return (host or '127.0.0.1', int(port)) if port else None
+    except ValueError:
+        logger.warning(f"Ignoring invalid JOB_WAKEUP_ADDRESS: {value!r}")
+        return None
+
 class JobScheduler:
     """Background job scheduler for processing scheduled tasks"""
     
@@ -16,18 +34,46 @@ class JobScheduler:
         self.running = False
         self.thread = None
         self.job_processor = None
+        self.worker_pool = None
+        self.app = None
+        # Min-heap of (run_at, job_id) for pending jobs, guarded by the condition
+        self.upcoming = []
+        self.condition = threading.Condition()
+        # Highest scheduled_jobs id seen, to find jobs queued by other processes
+        self.last_seen_id = 0
+        # UDP address the worker listens on for other processes' new jobs
+        self.wakeup_address = None
+        self.wakeup_socket = None
+        self.wakeup_thread = None
+        self.signal_socket = None
     
     def init_app(self, app):
         """Initialize the job scheduler with the Flask app"""
+        # Keep a reference so the background thread can push an app context
+        self.app = app
+        self.wakeup_address = parse_wakeup_address(app.config.get('JOB_WAKEUP_ADDRESS'))
+        if self.wakeup_address and self.signal_socket is None:
+            self.signal_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         with app.app_context():
             # Import and instantiate JobProcessor here to avoid circular imports
             from services.workflow_engine import JobProcessor
+            from services.job_worker import JobWorkerPool
             self.job_processor = JobProcessor()
+            self.worker_pool = JobWorkerPool(app, self.job_processor)
             
-            # Schedule regular jobs
-            self.scheduler.every(1).minutes.do(self.process_pending_jobs)
+            # Schedule regular jobs; scheduled_jobs rows are dispatched from the heap.
+            # The lease sweep picks up jobs whose worker died or that another process queued;
+            # the poll is the fallback for wakeup datagrams that never arrived.
+            self.scheduler.every(app.config.get('JOB_LEASE_SECONDS', 300)).seconds.do(self.process_pending_jobs)
+            if app.config.get('JOB_POLL_SECONDS', 5):
+                self.scheduler.every(app.config['JOB_POLL_SECONDS']).seconds.do(self.load_new_jobs)
             self.scheduler.every().day.at("09:00").do(self.check_overdue_mawbs)
             self.scheduler.every().day.at("14:00").do(self.send_daily_reminders)
+            self.scheduler.every().day.at("02:00").do(self.archive_audit_log)
+            self.scheduler.every().hour.do(self.snapshot_audit_log)
+            self.scheduler.every().hour.do(self.cleanup_export_files)
+        
+        _register_job_hooks(self)
     
     def start(self):
         """Start the job scheduler in a background thread"""
@@ -37,40 +83,176 @@ class JobScheduler:
         self.running = True
         self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
         self.thread.start()
+        self._start_wakeup_listener()
         logger.info("Job scheduler started")
     
     def stop(self):
         """Stop the job scheduler"""
-        self.running = False
+        with self.condition:
+            self.running = False
+            self.condition.notify()
         if self.thread:
             self.thread.join()
+        self._stop_wakeup_listener()
+        if self.worker_pool:
+            self.worker_pool.shutdown()
         logger.info("Job scheduler stopped")
     
+    def notify(self, run_at, job_id=None):
+        """Add a pending job's run time to the heap and wake the scheduler"""
+        with self.condition:
+            heapq.heappush(self.upcoming, (run_at, job_id or 0))
+            self.condition.notify()
+    
+    # --- Cross-process wakeups ------------------------------------------------
+    
+    def _start_wakeup_listener(self):
+        """Listen for run times of jobs committed by other processes (web workers)"""
+        if not self.wakeup_address:
+            return
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Several workers on one host share the port; any one of them may claim the job
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            sock.bind(self.wakeup_address)
+        except OSError as e:
+            sock.close()
+            logger.warning(f"Cannot listen for job wakeups on {self.wakeup_address}, relying on polling: {e}")
+            return
+        self.wakeup_socket = sock
+        self.wakeup_thread = threading.Thread(target=self._listen_for_wakeups, name='job-wakeups', daemon=True)
+        self.wakeup_thread.start()
+        logger.info(f"Listening for job wakeups on {sock.getsockname()[0]}:{sock.getsockname()[1]}")
+    
+    def _stop_wakeup_listener(self):
+        sock, self.wakeup_socket = self.wakeup_socket, None
+        if sock is None:
+            return
+        # An empty datagram unblocks recv so the thread sees that the scheduler stopped
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+                sender.sendto(b'', sock.getsockname())
+        except OSError:
+            pass
+        self.wakeup_thread.join(timeout=5)
+        sock.close()
+    
+    def _listen_for_wakeups(self):
+        sock = self.wakeup_socket
+        while self.running:
+            try:
+                data = sock.recv(65535)
+            except OSError:
+                return
+            if not data:
+                continue
+            try:
+                run_times = [datetime.fromisoformat(value) for value in json.loads(data)]
+            except (ValueError, TypeError):
+                logger.warning("Ignoring malformed job wakeup datagram")
+                continue
+            for run_at in run_times:
+                self.notify(run_at)
+    
+    def signal_worker(self, run_times):
+        """
+        Tell the worker about jobs this process committed, so it need not wait for its poll.
+        
+        One fire-and-forget UDP datagram; a lost one only delays the jobs
+        until the next JOB_POLL_SECONDS poll.
+        """
+        if not self.wakeup_address or not run_times:
+            return
+        payload = json.dumps(sorted({run_at.isoformat() for run_at in run_times})[:MAX_WAKEUP_RUN_TIMES])
+        try:
+            self.signal_socket.sendto(payload.encode(), self.wakeup_address)
+        except OSError as e:
+            logger.debug(f"Could not send job wakeup to {self.wakeup_address}: {e}")
+    
+    def load_pending_jobs(self):
+        """Fill the heap with the run times of all pending jobs"""
+        with self.app.app_context():
+            rows = db.session.query(ScheduledJob.run_at, ScheduledJob.id).filter(
+                ScheduledJob.status == 'pending'
+            ).all()
+            self.last_seen_id = db.session.query(db.func.max(ScheduledJob.id)).scalar() or 0
+        
+        with self.condition:
+            self.upcoming = [(run_at, job_id) for run_at, job_id in rows]
+            heapq.heapify(self.upcoming)
+        logger.info(f"Loaded {len(rows)} pending jobs into the scheduler")
+    
+    def load_new_jobs(self):
+        """Add jobs queued since the last check (e.g. by web processes) to the heap"""
+        with self.app.app_context():
+            rows = db.session.query(ScheduledJob.id, ScheduledJob.run_at, ScheduledJob.status).filter(
+                ScheduledJob.id > self.last_seen_id
+            ).order_by(ScheduledJob.id).all()
+        
+        for job_id, run_at, status in rows:
+            self.last_seen_id = max(self.last_seen_id, job_id)
+            if status == 'pending':
+                self.notify(run_at, job_id)
+    
+    def _seconds_until_next(self):
+        """Seconds until the next heap entry or daily task is due (caller holds the condition)"""
+        timeouts = [MAX_SLEEP_SECONDS]
+        if self.upcoming:
+            timeouts.append((self.upcoming[0][0] - datetime.utcnow()).total_seconds())
+        if self.scheduler.idle_seconds is not None:
+            timeouts.append(self.scheduler.idle_seconds)
+        return max(0, min(timeouts))
+    
+    def _pop_due(self):
+        """Drop every heap entry that is due; True if there was at least one"""
+        now = datetime.utcnow()
+        due = False
+        with self.condition:
+            while self.upcoming and self.upcoming[0][0] <= now:
+                heapq.heappop(self.upcoming)
+                due = True
+        return due
+    
     def _run_scheduler(self):
-        """Run the scheduler loop"""
+        """Sleep until the next job is due (or a new one is scheduled), then dispatch"""
+        try:
+            self.load_pending_jobs()
+        except Exception as e:
+            logger.error(f"Error loading pending jobs: {str(e)}")
+        
         while self.running:
             try:
+                with self.condition:
+                    timeout = self._seconds_until_next()
+                    if timeout > 0 and self.running:
+                        self.condition.wait(timeout)
+                if not self.running:
+                    break
+                
+                if self._pop_due():
+                    self.process_pending_jobs()
                 self.scheduler.run_pending()
-                time.sleep(60)  # Check every minute
             except Exception as e:
                 logger.error(f"Error in scheduler loop: {str(e)}")
-                time.sleep(60)  # Wait before retrying
+                with self.condition:
+                    self.condition.wait(60)  # Wait before retrying
     
     def process_pending_jobs(self):
-        """Process all pending jobs that are due"""
-        if not self.job_processor:
+        """Claim due jobs and hand them to the worker pool"""
+        if not self.worker_pool:
             logger.warning("Job processor not initialized")
             return
         
         try:
-            self.job_processor.process_pending_jobs()
+            self.worker_pool.run_due_jobs()
         except Exception as e:
             logger.error(f"Error processing pending jobs: {str(e)}")
     
     def check_overdue_mawbs(self):
         """Check for overdue MAWBs and send alerts"""
         try:
-            with current_app.app_context():
+            with self.app.app_context():
                 overdue_mawbs = MAWB.query.filter(
                     MAWB.lfd < datetime.now().date(),
                     MAWB.status == 'in_progress'
@@ -86,7 +268,7 @@ class JobScheduler:
     def send_daily_reminders(self):
         """Send daily reminders for pending tasks"""
         try:
-            with current_app.app_context():
+            with self.app.app_context():
                 # Get MAWBs approaching LFD (within 3 days)
                 three_days_from_now = datetime.now().date() + timedelta(days=3)
                 approaching_lfd = MAWB.query.filter(
@@ -103,8 +285,46 @@ class JobScheduler:
         except Exception as e:
             logger.error(f"Error sending daily reminders: {str(e)}")
     
-    def schedule_job(self, job_type, run_at, payload=None, mawb_id=None, hawb_id=None):
-        """Schedule a new job"""
+    def archive_audit_log(self):
+        """Move closed audit months to compressed archives"""
+        try:
+            with self.app.app_context():
+                from services.audit_archive import run_audit_maintenance
+                archived = run_audit_maintenance()
+                logger.info(f"Audit archival moved {archived} rows")
+        except Exception as e:
+            logger.error(f"Error archiving audit log: {str(e)}")
+    
+    def snapshot_audit_log(self):
+        """Snapshot records changed since the last run, for point-in-time reads"""
+        try:
+            with self.app.app_context():
+                from services.audit_history import take_audit_snapshots
+                take_audit_snapshots()
+        except Exception as e:
+            logger.error(f"Error snapshotting audit log: {str(e)}")
+    
+    def cleanup_export_files(self):
+        """Delete background export files past their retention period"""
+        try:
+            with self.app.app_context():
+                from services.export_jobs import cleanup_export_files
+                cleanup_export_files(current_app.config.get('EXPORT_RETENTION_HOURS', 24))
+        except Exception as e:
+            logger.error(f"Error cleaning up export files: {str(e)}")
+    
+    def schedule_job(self, job_type, run_at, payload=None, mawb_id=None, hawb_id=None, dedup_key=None):
+        """
+        Schedule a new job.
+        
+        With a ``dedup_key`` (see job_worker.make_dedup_key) this is an
+        upsert: if a job with that key exists and has not run yet it is moved
+        to ``run_at`` instead of a second job being added.
+        """
+        if dedup_key:
+            return self.schedule_jobs([job_row(
+                job_type, run_at, payload, mawb_id=mawb_id, hawb_id=hawb_id, dedup_key=dedup_key
+            )])[0]
         try:
             with current_app.app_context():
                 job = ScheduledJob(
@@ -124,6 +344,65 @@ class JobScheduler:
         except Exception as e:
             logger.error(f"Error scheduling job: {str(e)}")
             return None
+    
+    def schedule_jobs(self, rows):
+        """Schedule or reschedule many jobs (job_worker.job_row dicts) in one transaction"""
+        try:
+            with current_app.app_context():
+                upsert_jobs(rows)
+                db.session.commit()
+                
+                keys = [row['dedup_key'] for row in rows if row.get('dedup_key')]
+                jobs = {job.dedup_key: job for job in ScheduledJob.query.filter(ScheduledJob.dedup_key.in_(keys))} if keys else {}
+                logger.info(f"Scheduled {len(rows)} jobs")
+                return [jobs.get(row.get('dedup_key')) for row in rows]
+                
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error scheduling jobs: {str(e)}")
+            return [None] * len(rows)
+
+def _register_job_hooks(scheduler):
+    """
+    Wake the scheduler when pending jobs are inserted or rescheduled.
+
+    Run times are collected while the session flushes and handed to the
+    scheduler only after commit, so rolled-back jobs never wake it.
+    """
+    if getattr(_register_job_hooks, 'registered', False):
+        return
+    _register_job_hooks.registered = True
+    
+    def queue_wakeup(mapper, connection, target):
+        if target.status != 'pending' or target.run_at is None:
+            return
+        session = inspect(target).session
+        if session is not None:
+            session.info.setdefault('job_wakeups', []).append((target.run_at, target.id))
+    
+    @event.listens_for(ScheduledJob, 'after_insert')
+    def after_insert(mapper, connection, target):
+        queue_wakeup(mapper, connection, target)
+    
+    @event.listens_for(ScheduledJob, 'after_update')
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        if state.attrs.run_at.history.has_changes() or state.attrs.status.history.has_changes():
+            queue_wakeup(mapper, connection, target)
+    
+    @event.listens_for(db.session, 'after_commit')
+    def after_commit(session):
+        wakeups = session.info.pop('job_wakeups', [])
+        if scheduler.running:
+            for run_at, job_id in wakeups:
+                scheduler.notify(run_at, job_id)
+        elif wakeups:
+            # Processes that do not run the scheduler signal the worker's instead
+            scheduler.signal_worker([run_at for run_at, _ in wakeups])
+    
+    @event.listens_for(db.session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop('job_wakeups', None)
 
 # Global job scheduler instance
 job_scheduler = JobScheduler() 
\ No newline at end of file
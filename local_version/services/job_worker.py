@@ -0,0 +1,277 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from models_new import db, ScheduledJob
+from services.audit_logger import audit_logger
+import os
+import socket
+import threading
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 300
+
+def make_worker_id():
+    """Identify this process (and pool) in the scheduled_jobs lease columns"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def lease_expiry(lease_seconds=None):
+    if lease_seconds is None:
+        lease_seconds = current_app.config.get('JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+    return datetime.utcnow() + timedelta(seconds=lease_seconds)
+
+def extend_lease(job, lease_seconds=None):
+    """Push out the lease of a long-running job (caller commits)"""
+    if job.locked_by:
+        job.locked_until = lease_expiry(lease_seconds)
+
+def _claimable(now):
+    """Due pending jobs, plus running jobs whose owner let the lease expire"""
+    return db.or_(
+        db.and_(ScheduledJob.status == 'pending', ScheduledJob.run_at <= now),
+        db.and_(ScheduledJob.status == 'running', ScheduledJob.locked_until < now)
+    )
+
+def _fail_exhausted_leases(now):
+    """Expired leases of jobs with no attempts left end the job instead of being reclaimed"""
+    table = ScheduledJob.__table__
+    db.session.execute(table.update().where(
+        table.c.status == 'running',
+        table.c.locked_until < now,
+        table.c.attempts + 1 >= table.c.max_attempts
+    ).ordered_values(
+        (table.c.attempts, table.c.attempts + 1),
+        (table.c.status, 'failed_permanent'),
+        (table.c.locked_until, None),
+        (table.c.updated_at, now)
+    ))
+
+def claim_due_jobs(worker_id, limit, lease_seconds=None):
+    """
+    Atomically claim up to ``limit`` due jobs for ``worker_id``.
+
+    Claimed rows are marked running with ``locked_by``/``locked_until`` set,
+    so no other process picks them up until the lease expires. On MySQL the
+    candidates are locked with SELECT ... FOR UPDATE SKIP LOCKED; elsewhere
+    the UPDATE re-checks the claim condition, so concurrent claimers cannot
+    both win a row. Reclaiming an expired lease counts as a failed attempt,
+    so a job that keeps killing its worker stops after ``max_attempts``.
+    Returns the claimed job ids.
+    """
+    if limit <= 0:
+        return []
+
+    now = datetime.utcnow()
+    expires = lease_expiry(lease_seconds)
+    candidates = db.session.query(ScheduledJob.id).filter(
+        _claimable(now)
+    ).order_by(ScheduledJob.run_at, ScheduledJob.id).limit(limit)
+
+    try:
+        _fail_exhausted_leases(now)
+        if db.engine.dialect.name == 'mysql':
+            ids = [row.id for row in candidates.with_for_update(skip_locked=True)]
+            claim_filter = ScheduledJob.id.in_(ids)
+        else:
+            ids = [row.id for row in candidates]
+            claim_filter = db.and_(ScheduledJob.id.in_(ids), _claimable(now))
+
+        if not ids:
+            db.session.commit()
+            return []
+
+        # MySQL assigns SET values left to right, so attempts is computed before status changes
+        table = ScheduledJob.__table__
+        db.session.execute(table.update().where(claim_filter).ordered_values(
+            (table.c.attempts, db.case((table.c.status == 'running', table.c.attempts + 1), else_=table.c.attempts)),
+            (table.c.status, 'running'),
+            (table.c.locked_by, worker_id),
+            (table.c.locked_until, expires),
+            (table.c.updated_at, now)
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if db.engine.dialect.name == 'mysql':
+        return ids
+    # Read back which candidates this claim actually won
+    return [row.id for row in db.session.query(ScheduledJob.id).filter(
+        ScheduledJob.id.in_(ids),
+        ScheduledJob.locked_by == worker_id,
+        ScheduledJob.locked_until == expires
+    )]
+
+# --- Deduplicated scheduling ----------------------------------------------------
+
+# An existing job in one of these states takes the new run time and payload on upsert;
+# a running or completed job is left alone, so repeating a schedule call is harmless
+RESCHEDULABLE_STATUSES = ('pending', 'failed')
+UPSERT_COLUMNS = ('run_at', 'payload', 'attempts', 'locked_by', 'locked_until', 'updated_at', 'status')
+UPSERT_CHUNK_SIZE = 500
+
+def make_dedup_key(job_type, *parts):
+    """e.g. make_dedup_key('lfd_reminder', mawb_id, 'lfd_3_days') -> 'lfd_reminder:12:lfd_3_days'"""
+    return ':'.join(str(part) for part in (job_type,) + parts)
+
+def job_row(job_type, run_at, payload=None, mawb_id=None, hawb_id=None, dedup_key=None, now=None):
+    """A pending scheduled_jobs row as a dict, for upsert_jobs"""
+    now = now or datetime.utcnow()
+    return {
+        'mawb_id': mawb_id,
+        'hawb_id': hawb_id,
+        'job_type': job_type,
+        'run_at': run_at,
+        'status': 'pending',
+        'payload': payload,
+        'attempts': 0,
+        'max_attempts': 3,
+        'locked_by': None,
+        'locked_until': None,
+        'dedup_key': dedup_key,
+        'created_at': now,
+        'updated_at': now
+    }
+
+def _upsert_statement(table, rows):
+    reschedulable = table.c.status.in_(RESCHEDULABLE_STATUSES)
+    if db.engine.dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        # MySQL applies the assignments in order, so status (in the condition) goes last
+        return stmt.on_duplicate_key_update([
+            (name, db.func.IF(reschedulable, stmt.inserted[name], table.c[name]))
+            for name in UPSERT_COLUMNS
+        ])
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.dedup_key],
+        set_={name: stmt.excluded[name] for name in UPSERT_COLUMNS},
+        where=reschedulable
+    )
+
+def upsert_jobs(rows):
+    """
+    Schedule many jobs with one statement per chunk (caller commits).
+
+    Rows (see job_row) whose ``dedup_key`` already exists update that job
+    instead of adding another: a job that has not run yet moves to the new
+    run time, and one that is running or done stays as it is. Rows without
+    a key are plain inserts. Upserted jobs are audited and wake this
+    process's scheduler like ORM-inserted ones.
+    """
+    if not rows:
+        return
+    table = ScheduledJob.__table__
+    plain = [row for row in rows if not row.get('dedup_key')]
+    # The last row wins when a key repeats within one call
+    keyed = list({row['dedup_key']: row for row in rows if row.get('dedup_key')}.values())
+
+    audited = bool(keyed) and audit_logger.enabled and table.name in audit_logger.tracked_tables
+    existing = _existing_statuses(table, keyed) if audited else {}
+
+    if plain:
+        db.session.execute(table.insert(), plain)
+    for start in range(0, len(keyed), UPSERT_CHUNK_SIZE):
+        db.session.execute(_upsert_statement(table, keyed[start:start + UPSERT_CHUNK_SIZE]))
+
+    # Core statements skip the hook that wakes the job scheduler
+    db.session.info.setdefault('job_wakeups', []).extend((row['run_at'], 0) for row in rows)
+    if audited:
+        _audit_upserted(table, keyed, existing)
+
+def _existing_statuses(table, rows):
+    """dedup_key -> status of the jobs that already exist for these rows"""
+    keys = [row['dedup_key'] for row in rows]
+    existing = {}
+    for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+        existing.update(db.session.execute(
+            db.select(table.c.dedup_key, table.c.status).where(table.c.dedup_key.in_(keys[start:start + UPSERT_CHUNK_SIZE]))
+        ).all())
+    return existing
+
+def _audit_upserted(table, rows, existing):
+    """
+    Audit keyed rows by reading them back. A key that did not exist before
+    the upsert is an INSERT, one whose job was reschedulable an UPDATE, and
+    running or finished jobs were left alone.
+    """
+    keys = [row['dedup_key'] for row in rows]
+    inserted, updated = [], []
+    for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+        chunk = keys[start:start + UPSERT_CHUNK_SIZE]
+        for stored in db.session.execute(table.select().where(table.c.dedup_key.in_(chunk))).mappings():
+            status = existing.get(stored['dedup_key'])
+            if status is None:
+                inserted.append(stored)
+            elif status in RESCHEDULABLE_STATUSES:
+                updated.append(stored)
+    audit_logger.log_bulk_insert(table.name, inserted)
+    audit_logger.log_bulk_insert(table.name, updated, action='UPDATE')
+
+class JobWorkerPool:
+    """Run claimed scheduled jobs in parallel, one session per job"""
+
+    def __init__(self, app, job_processor, max_workers=None, batch_size=None, lease_seconds=None):
+        self.app = app
+        self.job_processor = job_processor
+        self.max_workers = max_workers or app.config.get('JOB_WORKER_THREADS', 4)
+        self.batch_size = batch_size or app.config.get('JOB_CLAIM_BATCH_SIZE', 10)
+        self.lease_seconds = lease_seconds or app.config.get('JOB_LEASE_SECONDS', DEFAULT_LEASE_SECONDS)
+        self.worker_id = make_worker_id()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job-worker')
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # Set when the last claim filled every free slot, so more jobs may be due
+        self.backlog = False
+
+    def run_due_jobs(self):
+        """Claim as many due jobs as there are idle workers and submit them"""
+        with self.lock:
+            free = self.max_workers - self.in_flight
+            if free <= 0:
+                self.backlog = True
+                return 0
+            limit = min(free, self.batch_size)
+            with self.app.app_context():
+                job_ids = claim_due_jobs(self.worker_id, limit, self.lease_seconds)
+            self.in_flight += len(job_ids)
+            self.backlog = len(job_ids) == limit
+
+        for job_id in job_ids:
+            future = self.executor.submit(self._run_job, job_id)
+            future.add_done_callback(self._job_done)
+        if job_ids:
+            logger.info(f"Worker {self.worker_id} claimed {len(job_ids)} jobs")
+        return len(job_ids)
+
+    def _run_job(self, job_id):
+        # A fresh app context gives this thread its own scoped session
+        with self.app.app_context():
+            job = db.session.get(ScheduledJob, job_id)
+            if job is None or job.locked_by != self.worker_id:
+                logger.warning(f"Job {job_id} is no longer leased by {self.worker_id}, skipping")
+                return
+            self.job_processor._process_job(job)
+
+    def _job_done(self, future):
+        if future.exception():
+            logger.error(f"Job worker crashed: {future.exception()}")
+        with self.lock:
+            self.in_flight -= 1
+            backlog = self.backlog
+        if backlog:
+            try:
+                self.run_due_jobs()
+            except Exception as e:
+                logger.error(f"Error claiming backlog jobs: {str(e)}")
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
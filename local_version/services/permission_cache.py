@@ -0,0 +1,146 @@
+from flask import g, has_request_context
+from sqlalchemy import event, inspect
+from models_new import db, Role, User, UserOverride, Feature, PermissionVersion
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PermissionCache:
+    """
+    Process-wide cache of each user's effective permissions.
+
+    Permissions are resolved once per user into a frozenset and reused
+    across requests while the permission version is unchanged. The version
+    lives in the ``permission_versions`` row and is bumped in the same
+    transaction as any change to role permissions, a user's role or a user
+    override. Each process re-reads it at most every ``check_seconds`` (and
+    at once after its own changes commit), and a request keeps the version
+    it first saw, so permission checks themselves run no queries.
+    """
+
+    def __init__(self):
+        self.check_seconds = 2.0
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0.0
+        self.entries = {}  # user id -> frozenset of permission keys
+
+    def init_app(self, app):
+        self.check_seconds = app.config.get('PERMISSION_VERSION_CHECK_SECONDS', 2.0)
+        _register_permission_hooks(self)
+
+    # --- Version ---------------------------------------------------------------
+
+    def current_version(self):
+        """The permission version for this request, refreshed from the database when due"""
+        if has_request_context() and 'permission_version' in g:
+            return g.permission_version
+
+        now = time.monotonic()
+        with self.lock:
+            version = self.version
+            due = version is None or now - self.checked_at >= self.check_seconds
+        if due:
+            version = db.session.query(PermissionVersion.version).filter_by(id=1).scalar() or 0
+            with self.lock:
+                if version != self.version:
+                    self.entries = {}
+                self.version = version
+                self.checked_at = now
+
+        if has_request_context():
+            g.permission_version = version
+        return version
+
+    def invalidate(self):
+        """Drop everything cached in this process and re-read the version next time"""
+        with self.lock:
+            self.version = None
+            self.entries = {}
+        if has_request_context():
+            g.pop('permission_version', None)
+
+    # --- Permissions -----------------------------------------------------------
+
+    @staticmethod
+    def _resolve(user):
+        """Role permissions plus permissions granted by user overrides"""
+        permissions = set()
+        if user.role and user.role.permissions:
+            try:
+                permissions.update(json.loads(user.role.permissions))
+            except ValueError:
+                logger.warning(f"Ignoring unreadable permissions on role {user.role.name}")
+        granted = db.session.query(Feature.key).join(UserOverride, UserOverride.feature_id == Feature.id).filter(
+            UserOverride.user_id == user.id,
+            UserOverride.granted.is_(True)
+        ).all()
+        permissions.update(key for key, in granted)
+        return frozenset(permissions)
+
+    def permissions_for(self, user):
+        """The user's effective permissions as a frozenset"""
+        if user.id is None:
+            return self._resolve(user)
+        version = self.current_version()
+        with self.lock:
+            permissions = self.entries.get(user.id) if version == self.version else None
+        if permissions is None:
+            permissions = self._resolve(user)
+            with self.lock:
+                if version == self.version:
+                    self.entries[user.id] = permissions
+        return permissions
+
+def _bump_version(session):
+    connection = session.connection()
+    table = PermissionVersion.__table__
+    result = connection.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+    if not result.rowcount:
+        connection.execute(table.insert().values(id=1, version=1))
+
+def _changes_permissions(session):
+    for obj in session.new | session.deleted:
+        if isinstance(obj, (UserOverride, Role)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, UserOverride):
+            return True
+        if isinstance(obj, Role) and inspect(obj).attrs.permissions.history.has_changes():
+            return True
+        if isinstance(obj, User):
+            attrs = inspect(obj).attrs
+            if attrs.role_id.history.has_changes() or attrs.role.history.has_changes():
+                return True
+    return False
+
+def _register_permission_hooks(cache):
+    """Bump the permission version with any flush that changes permissions"""
+    if getattr(_register_permission_hooks, 'registered', False):
+        return
+    _register_permission_hooks.registered = True
+
+    @event.listens_for(db.session, 'before_flush')
+    def before_flush(session, flush_context, instances):
+        if _changes_permissions(session):
+            _bump_version(session)
+            session.info['permissions_changed'] = True
+
+    @event.listens_for(db.session, 'after_commit')
+    def after_commit(session):
+        if session.info.pop('permissions_changed', False):
+            cache.invalidate()
+
+    @event.listens_for(db.session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop('permissions_changed', None)
+
+# Global permission cache instance
+permission_cache = PermissionCache()
+
+def init_permission_cache(app):
+    """Initialize the permission cache for the Flask app"""
+    permission_cache.init_app(app)
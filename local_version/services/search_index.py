@@ -0,0 +1,191 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.mysql import match
+from models_new import db, Cargo, MAWB, HAWB
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Searchable text columns per model. The index keeps substring semantics
+# (trigrams on SQLite, n-grams on MySQL) so results match the old LIKE '%term%'.
+SEARCH_COLUMNS = {
+    Cargo: ('main_awb', 'flight_no', 'customer_name'),
+    MAWB: ('mawb_number', 'consignee', 'shipper'),
+    HAWB: ('hawb_number', 'consignee', 'shipper')
+}
+
+# Shortest term each backend can answer from the index; shorter terms fall back to LIKE
+MIN_TERM_LENGTH = {
+    'sqlite': 3,  # FTS5 trigram tokenizer
+    'mysql': 2    # default ngram_token_size
+}
+
+# Models whose index is ready, filled in by init_search_index
+_indexed_models = set()
+_sync_hooks_registered = False
+
+def _fts_table(model):
+    return f'{model.__tablename__}_fts'
+
+def _fulltext_index(model, columns):
+    return f"ft_{model.__tablename__}_{'_'.join(columns) if len(columns) == 1 else 'all'}"
+
+def _dialect():
+    return db.engine.dialect.name
+
+def _quote_phrase(term):
+    """Quote a user term as a single phrase so operators in it are not interpreted"""
+    return '"' + term.replace('"', '""' if _dialect() == 'sqlite' else '') + '"'
+
+# --- SQLite FTS5 -------------------------------------------------------------
+
+def _sqlite_row_values(target, columns):
+    return {column: getattr(target, column) or '' for column in columns}
+
+def _sqlite_delete(connection, model, row_id):
+    connection.execute(
+        db.text(f'DELETE FROM {_fts_table(model)} WHERE rowid = :id'), {'id': row_id}
+    )
+
+def _sqlite_insert(connection, model, target):
+    columns = SEARCH_COLUMNS[model]
+    connection.execute(
+        db.text(
+            f"INSERT INTO {_fts_table(model)}(rowid, {', '.join(columns)}) "
+            f"VALUES (:id, {', '.join(':' + c for c in columns)})"
+        ),
+        {'id': target.id, **_sqlite_row_values(target, columns)}
+    )
+
+def _register_sync_hooks():
+    """Mirror ORM inserts, updates and deletes into the FTS5 tables"""
+    global _sync_hooks_registered
+    if _sync_hooks_registered:
+        return
+    _sync_hooks_registered = True
+
+    for model in SEARCH_COLUMNS:
+        @event.listens_for(model, 'after_insert')
+        def after_insert(mapper, connection, target, model=model):
+            if model in _indexed_models:
+                _sqlite_insert(connection, model, target)
+
+        @event.listens_for(model, 'after_update')
+        def after_update(mapper, connection, target, model=model):
+            if model not in _indexed_models:
+                return
+            state = inspect(target)
+            if any(state.attrs[c].history.has_changes() for c in SEARCH_COLUMNS[model]):
+                _sqlite_delete(connection, model, target.id)
+                _sqlite_insert(connection, model, target)
+
+        @event.listens_for(model, 'after_delete')
+        def after_delete(mapper, connection, target, model=model):
+            if model in _indexed_models:
+                _sqlite_delete(connection, model, target.id)
+
+def _rebuild_sqlite_index(connection, model):
+    columns = ', '.join(SEARCH_COLUMNS[model])
+    table = _fts_table(model)
+    source_columns = ', '.join(f"COALESCE({c}, '')" for c in SEARCH_COLUMNS[model])
+    connection.execute(db.text(f'DELETE FROM {table}'))
+    connection.execute(db.text(
+        f'INSERT INTO {table}(rowid, {columns}) '
+        f'SELECT id, {source_columns} FROM {model.__tablename__}'
+    ))
+
+# --- MySQL FULLTEXT ----------------------------------------------------------
+
+def _mysql_index_names(connection, model):
+    return {
+        row[0] for row in connection.execute(db.text(
+            'SELECT DISTINCT index_name FROM information_schema.statistics '
+            'WHERE table_schema = DATABASE() AND table_name = :table'
+        ), {'table': model.__tablename__})
+    }
+
+def _has_index(connection, inspector, model):
+    """Whether the migration (d9b3f6e2a871) created the index for ``model``"""
+    if _dialect() == 'sqlite':
+        return inspector.has_table(_fts_table(model))
+    columns = SEARCH_COLUMNS[model]
+    return _fulltext_index(model, columns) in _mysql_index_names(connection, model)
+
+# --- Public API --------------------------------------------------------------
+
+def init_search_index(app):
+    """
+    Use the search index where the migrations created it.
+
+    No DDL runs here: the FTS5 tables and FULLTEXT indexes come from
+    ``flask db upgrade``, and a drifted SQLite index is repaired with
+    ``flask rebuild-search-index``.
+    """
+    _indexed_models.clear()
+    if not app.config.get('SEARCH_INDEX_ENABLED', True):
+        logger.info("Search index disabled, using LIKE filters")
+        return
+
+    dialect = _dialect()
+    if dialect not in MIN_TERM_LENGTH:
+        logger.info(f"No search index support for {dialect}, using LIKE filters")
+        return
+
+    if dialect == 'sqlite':
+        _register_sync_hooks()
+    _register_cli(app)
+
+    try:
+        with db.engine.connect() as connection:
+            inspector = inspect(connection)
+            for model in SEARCH_COLUMNS:
+                if _has_index(connection, inspector, model):
+                    _indexed_models.add(model)
+                else:
+                    logger.info(f"No search index for {model.__tablename__} (run flask db upgrade), using LIKE filters")
+    except Exception as e:
+        logger.error(f"Failed to check the search index: {e}")
+
+def _register_cli(app):
+    if 'rebuild-search-index' in app.cli.commands:
+        return
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Repopulate the SQLite search index from the source tables"""
+        rebuild_search_index()
+
+def rebuild_search_index():
+    """Repopulate the SQLite FTS tables from scratch (MySQL maintains its own indexes)"""
+    if _dialect() != 'sqlite':
+        return
+    with db.engine.begin() as connection:
+        for model in _indexed_models:
+            _rebuild_sqlite_index(connection, model)
+            logger.info(f"Rebuilt search index {_fts_table(model)}")
+
+def search_filter(model, term, columns=None):
+    """
+    Build a filter matching ``term`` as a substring of any of ``columns``
+    (default: all searchable columns of ``model``).
+
+    Uses the full-text index when it is available and the term is long
+    enough for it, otherwise falls back to a case-insensitive LIKE.
+    """
+    columns = tuple(columns or SEARCH_COLUMNS[model])
+    term = (term or '').strip()
+    dialect = _dialect()
+
+    if model not in _indexed_models or len(term) < MIN_TERM_LENGTH.get(dialect, 0):
+        return db.or_(*[getattr(model, c).ilike(f'%{term}%') for c in columns])
+
+    if dialect == 'sqlite':
+        table = _fts_table(model)
+        query = '{' + ' '.join(columns) + '} : ' + _quote_phrase(term)
+        matching_ids = db.select(db.literal_column('rowid')).select_from(
+            db.table(table)
+        ).where(db.literal_column(table).op('MATCH')(query))
+        return model.id.in_(matching_ids)
+
+    return match(
+        *[getattr(model, c) for c in columns], against=_quote_phrase(term)
+    ).in_boolean_mode()
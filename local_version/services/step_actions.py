@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from models_new import db, MAWB, EmailTemplate, ScheduledJob
+from services.email_outbox import enqueue_email
+from services.job_worker import RESCHEDULABLE_STATUSES, job_row, make_dedup_key, upsert_jobs
+import logging
+
+logger = logging.getLogger(__name__)
+
+STEP_ACTION_JOB = 'step_action'
+
+# Step code -> names of the actions that run when a MAWB enters it, in order
+STEP_ACTIONS = {}
+_handlers = {}
+
+def step_action(step_code, name):
+    """Register ``func(mawb, payload)`` to run as a job when a MAWB enters ``step_code``"""
+    def register(func):
+        STEP_ACTIONS.setdefault(step_code, []).append(name)
+        _handlers[name] = func
+        return func
+    return register
+
+def actions_for(step_code):
+    return STEP_ACTIONS.get(step_code, ())
+
+def step_action_payload(step_code, action, user_id):
+    return {'step': step_code, 'action': action, 'user_id': user_id}
+
+def run_step_action(job):
+    """
+    Run one step action job (the job processor commits).
+
+    Each action is its own job, so a failing action is retried on its own
+    without repeating the workflow transition or the other actions.
+    """
+    payload = job.payload or {}
+    handler = _handlers.get(payload.get('action'))
+    if handler is None:
+        raise ValueError(f"Unknown step action: {payload.get('action')}")
+
+    mawb = db.session.get(MAWB, job.mawb_id)
+    if not mawb:
+        logger.warning(f"Skipping step action {payload['action']}: MAWB {job.mawb_id} no longer exists")
+        return
+    handler(mawb, payload)
+
+# Days before the LFD -> reminder type
+LFD_REMINDERS = ((3, 'lfd_3_days'), (1, 'lfd_1_day'))
+
+def _add_reminder(mawb_id, job_type, run_at, reminder_type, *key_parts, **payload):
+    """Upsert the reminder, so a repeated action moves it rather than adding a second one"""
+    dedup_key = make_dedup_key(job_type, mawb_id, reminder_type, *key_parts)
+    upsert_jobs([job_row(
+        job_type, run_at, {'reminder_type': reminder_type, **payload},
+        mawb_id=mawb_id,
+        dedup_key=dedup_key
+    )])
+    return dedup_key
+
+@step_action('T03', 'pickup_reminder')  # Pickup Scheduled
+def schedule_pickup_reminder(mawb, payload):
+    """Schedule pickup reminder job"""
+    _add_reminder(mawb.id, 'pickup_reminder', datetime.utcnow() + timedelta(hours=24), 'pickup')
+
+@step_action('T05', 'pre_alert_email')  # At Origin Port
+def send_pre_alert_email(mawb, payload):
+    """Queue the pre-alert email"""
+    template = EmailTemplate.query.filter_by(name='PRE-ALERT', is_active=True).first()
+    if not template:
+        logger.warning("PRE-ALERT email template not found")
+        return
+
+    rendered = template.render(
+        mawb_number=mawb.mawb_number,
+        origin_port=mawb.origin_port or 'N/A',
+        dest_port=mawb.dest_port or 'N/A',
+        eta=mawb.eta.strftime('%Y-%m-%d') if mawb.eta else 'N/A',
+        consignee=mawb.consignee or 'N/A',
+        pieces=mawb.pieces or 0,
+        weight=mawb.weight or 0
+    )
+    if rendered.missing:
+        logger.warning(f"PRE-ALERT template has no values for: {', '.join(rendered.missing)}")
+
+    # Delivered by the email outbox sender (MAWBs have no cargo, so no EmailLog entry)
+    enqueue_email(
+        current_app.config.get('PRE_ALERT_RECIPIENTS') or 'operations@company.com',
+        rendered.subject,
+        rendered.body,
+        template_name='PRE-ALERT',
+        created_by_id=payload.get('user_id')
+    )
+    logger.info(f"Pre-alert email queued for MAWB {mawb.id}")
+
+@step_action('T06', 'lfd_reminders')  # Loaded on Vessel
+def schedule_lfd_reminders(mawb, payload):
+    """
+    Schedule LFD reminder jobs, 3 days and 1 day before the LFD (caller commits).
+
+    Also called when the LFD changes. The LFD is part of the dedup key, so
+    a reminder that already ran for an earlier LFD does not block the one
+    for the new LFD, and reminders the current LFD no longer produces
+    (moved, in the past now, or no LFD at all) are cancelled.
+    """
+    keep = []
+    if mawb.lfd:
+        today = datetime.now().date()
+        for days, reminder_type in LFD_REMINDERS:
+            reminder_date = mawb.lfd - timedelta(days=days)
+            if reminder_date > today:
+                keep.append(_add_reminder(
+                    mawb.id, 'lfd_reminder', datetime.combine(reminder_date, datetime.min.time()),
+                    reminder_type, mawb.lfd.isoformat(), lfd=mawb.lfd.isoformat()
+                ))
+
+    stale = ScheduledJob.query.filter(
+        ScheduledJob.mawb_id == mawb.id,
+        ScheduledJob.job_type == 'lfd_reminder',
+        ScheduledJob.status.in_(RESCHEDULABLE_STATUSES),
+        db.or_(ScheduledJob.dedup_key.is_(None), ScheduledJob.dedup_key.notin_(keep))
+    )
+    for job in stale:
+        job.status = 'cancelled'
+        job.updated_at = datetime.utcnow()
+
+@step_action('T11', 'isc_reminders')  # Customs Clearance
+def schedule_isc_reminders(mawb, payload):
+    """Schedule ISC payment reminders at the next 9 AM and 2 PM"""
+    now = datetime.now()
+    for hour, reminder_type in ((9, 'isc_morning'), (14, 'isc_afternoon')):
+        run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        if run_at < now:
+            run_at += timedelta(days=1)
+        _add_reminder(mawb.id, 'isc_reminder', run_at, reminder_type)
+
+@step_action('T14', 'empty_return_reminder')  # Delivered
+def schedule_empty_return_reminder(mawb, payload):
+    """Schedule empty return reminder"""
+    _add_reminder(mawb.id, 'empty_return_reminder', datetime.utcnow() + timedelta(days=7), 'empty_return')
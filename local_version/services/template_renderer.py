@@ -0,0 +1,101 @@
+from collections import namedtuple
+import re
+import threading
+
+# {{name}} placeholders, as used by the templates in init_data.py
+PLACEHOLDER_RE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+RenderedEmail = namedtuple('RenderedEmail', ['subject', 'body', 'missing'])
+
+class TemplateVariableError(ValueError):
+    """Raised by strict rendering when placeholders have no value"""
+
+    def __init__(self, template_name, missing):
+        self.template_name = template_name
+        self.missing = tuple(missing)
+        super().__init__(f"Template {template_name!r} is missing values for: {', '.join(self.missing)}")
+
+class CompiledText:
+    """A text split once into literal segments and the placeholder names between them"""
+
+    __slots__ = ('literals', 'names', 'variables')
+
+    def __init__(self, text):
+        text = text or ''
+        literals, names = [], []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(text):
+            literals.append(text[position:match.start()])
+            names.append(match.group(1))
+            position = match.end()
+        literals.append(text[position:])
+        self.literals = tuple(literals)
+        self.names = tuple(names)
+        self.variables = frozenset(names)
+
+    def render(self, values, missing):
+        """Fill the placeholders; unknown ones are kept verbatim and added to ``missing``"""
+        if not self.names:
+            return self.literals[0]
+        parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            if name in values:
+                parts.append(str(values[name]))
+            else:
+                missing.add(name)
+                parts.append('{{' + name + '}}')
+            parts.append(literal)
+        return ''.join(parts)
+
+class CompiledTemplate:
+    __slots__ = ('name', 'subject', 'body', 'variables')
+
+    def __init__(self, name, subject, body):
+        self.name = name
+        self.subject = CompiledText(subject)
+        self.body = CompiledText(body)
+        self.variables = self.subject.variables | self.body.variables
+
+    def render(self, values, strict=False):
+        missing = set()
+        subject = self.subject.render(values, missing)
+        body = self.body.render(values, missing)
+        if missing and strict:
+            raise TemplateVariableError(self.name, sorted(missing))
+        return RenderedEmail(subject, body, tuple(sorted(missing)))
+
+_cache = {}  # template id -> (updated_at, CompiledTemplate)
+_cache_lock = threading.Lock()
+
+def compile_template(template):
+    """The compiled form of an EmailTemplate, reused until its updated_at changes"""
+    if template.id is None:
+        return CompiledTemplate(template.name, template.subject, template.body)
+    with _cache_lock:
+        entry = _cache.get(template.id)
+    if entry and entry[0] == template.updated_at:
+        return entry[1]
+    compiled = CompiledTemplate(template.name, template.subject, template.body)
+    with _cache_lock:
+        _cache[template.id] = (template.updated_at, compiled)
+    return compiled
+
+def render_email(template, values=None, strict=False, **kwargs):
+    """
+    Render an EmailTemplate's subject and body in one pass.
+
+    Returns ``RenderedEmail(subject, body, missing)``; placeholders without
+    a value are left as written and listed in ``missing`` (or raise
+    TemplateVariableError when ``strict``).
+    """
+    values = dict(values or {}, **kwargs)
+    return compile_template(template).render(values, strict=strict)
+
+def render_many(template, rows, strict=False):
+    """Render one template for many value dicts, compiling it once"""
+    compiled = compile_template(template)
+    return [compiled.render(values, strict=strict) for values in rows]
+
+def clear_template_cache():
+    with _cache_lock:
+        _cache.clear()
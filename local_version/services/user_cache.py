@@ -0,0 +1,127 @@
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+from models_new import db, User, Role
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserCache:
+    """
+    TTL/LRU cache of detached users (with their role) for the login user loader.
+
+    A hit is merged into the request's session with ``load=False``, which
+    attaches a copy without a query, so ``current_user`` and
+    ``current_user.role`` cost no round trips and changes to the user still
+    save normally. Entries are dropped when a commit in this process changes
+    a user or a role; changes made by other processes show up once the
+    entry's TTL runs out.
+    """
+
+    def __init__(self):
+        self.ttl = 30.0
+        self.max_size = 1000
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # user id -> (loaded_at, detached user)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('USER_CACHE_TTL_SECONDS', 30.0)
+        self.max_size = app.config.get('USER_CACHE_SIZE', 1000)
+        _register_user_cache_hooks(self)
+
+    @staticmethod
+    def _load_snapshot(user_id):
+        """Load a user and role on a short-lived session of their own; closing it detaches them"""
+        with Session(db.engine) as session:
+            return session.get(User, user_id, options=[joinedload(User.role)])
+
+    def get(self, user_id):
+        """The user attached to the current session, or None"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and now - entry[0] < self.ttl:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                snapshot = entry[1]
+            else:
+                self.misses += 1
+                snapshot = None
+                generation = self.generation
+
+        if snapshot is None:
+            snapshot = self._load_snapshot(user_id)
+            if snapshot is None:
+                return None
+            with self.lock:
+                # Skip caching if an invalidation ran while it was loading
+                if generation == self.generation:
+                    self.entries[user_id] = (now, snapshot)
+                    self.entries.move_to_end(user_id)
+                    while len(self.entries) > self.max_size:
+                        self.entries.popitem(last=False)
+                        self.evictions += 1
+
+        return db.session.merge(snapshot, load=False)
+
+    def invalidate(self, user_ids=None):
+        """Drop the given users, or everyone when user_ids is None"""
+        with self.lock:
+            self.generation += 1
+            if user_ids is None:
+                self.entries.clear()
+            else:
+                for user_id in user_ids:
+                    self.entries.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+def _register_user_cache_hooks(cache):
+    """Invalidate cached users after commits that change users or roles"""
+    if getattr(_register_user_cache_hooks, 'registered', False):
+        return
+    _register_user_cache_hooks.registered = True
+
+    @event.listens_for(db.session, 'before_flush')
+    def before_flush(session, flush_context, instances):
+        pending = session.info.setdefault('user_cache_invalidate', set())
+        for obj in session.dirty | session.deleted:
+            if isinstance(obj, Role) and (obj in session.deleted or session.is_modified(obj)):
+                pending.add(None)  # a role is shared, so drop everyone
+            elif isinstance(obj, User) and (obj in session.deleted or session.is_modified(obj)):
+                pending.add(obj.id)
+
+    @event.listens_for(db.session, 'after_commit')
+    def after_commit(session):
+        pending = session.info.pop('user_cache_invalidate', None)
+        if not pending:
+            return
+        cache.invalidate(None if None in pending else pending)
+
+    @event.listens_for(db.session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop('user_cache_invalidate', None)
+
+# Global user cache instance
+user_cache = UserCache()
+
+def init_user_cache(app):
+    """Initialize the user cache for the Flask app"""
+    user_cache.init_app(app)
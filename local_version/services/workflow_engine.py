@@ -1,45 +1,50 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from flask import current_app
-from models_new import (
-    db, MAWB, MAWBWorkflow, WorkflowStep, ScheduledJob, 
-    MAWBEvent, User, EmailTemplate, EmailLog
-)
-import json
+from models_new import db, MAWB, MAWBWorkflow, ScheduledJob, MAWBEvent
+from services.audit_logger import audit_logger
+from services.job_worker import make_worker_id, claim_due_jobs, job_row, make_dedup_key, upsert_jobs
+from services.step_actions import STEP_ACTION_JOB, actions_for, step_action_payload, run_step_action
+from services.workflow_graph import workflow_graph
 import logging
 
 logger = logging.getLogger(__name__)
 
-class WorkflowEngine:
-    """Workflow engine for managing MAWB lifecycle"""
+class _AdvanceBatch:
+    """Rows collected while advancing workflows, written with one insert per table"""
     
-    def __init__(self):
-        self.workflow_steps = {}
-        # Don't load workflow steps during initialization to avoid app context issues
+    def __init__(self, now, user_id):
+        self.now = now
+        self.user_id = user_id
+        self.events = []
+        self.jobs = []
     
-    def _load_workflow_steps(self):
-        """Load workflow steps from database"""
-        steps = {}
-        try:
-            # Only load if we have an app context
-            if current_app:
-                for step in WorkflowStep.query.filter_by(is_active=True).all():
-                    steps[step.code] = {
-                        'id': step.id,
-                        'name': step.name,
-                        'description': step.description,
-                        'next_step': step.next_step
-                    }
-        except Exception as e:
-            logger.warning(f"Could not load workflow steps: {str(e)}")
-            # Return empty dict if tables don't exist yet or no app context
-            steps = {}
-        return steps
+    def add_job(self, mawb_id, job_type, run_at, payload, dedup_key=None):
+        self.jobs.append(job_row(job_type, run_at, payload, mawb_id=mawb_id, dedup_key=dedup_key, now=self.now))
+
+def _bulk_insert(model, rows, created_at):
+    """
+    Insert MAWB-linked rows with one executemany and audit them like ORM inserts.
+    
+    The new ids are read back by the batch's shared ``created_at`` so the
+    audit log still gets an INSERT entry per row.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    db.session.execute(table.insert(), rows)
+    if audit_logger.enabled and table.name in audit_logger.tracked_tables:
+        inserted = db.session.execute(table.select().where(
+            table.c.created_at == created_at,
+            table.c.mawb_id.in_({row['mawb_id'] for row in rows})
+        )).mappings()
+        audit_logger.log_bulk_insert(table.name, inserted)
+
+class WorkflowEngine:
+    """Workflow engine for managing MAWB lifecycle"""
     
     def get_workflow_steps(self):
-        """Get workflow steps, loading them if needed"""
-        if not self.workflow_steps:
-            self.workflow_steps = self._load_workflow_steps()
-        return self.workflow_steps
+        """Active workflow steps by code, from the shared compiled step graph"""
+        return workflow_graph.get().by_code
     
     def create_workflow(self, mawb_id, initial_step='T01'):
         """Create a new workflow for a MAWB"""
@@ -70,224 +75,130 @@ class WorkflowEngine:
     
     def advance_workflow(self, mawb_id, user_id, event_details=None):
         """Advance workflow to next step"""
+        advanced, errors = self.advance_workflows([mawb_id], user_id, event_details=event_details)
+        if errors:
+            raise ValueError(errors[mawb_id])
+        return db.session.get(MAWBWorkflow, advanced[0]['workflow_id'])
+    
+    @staticmethod
+    def _transition_error(graph, mawb_id, workflow, to_step):
+        """Why a workflow cannot move on (None when it can)"""
+        if not workflow:
+            return f"No active workflow found for MAWB {mawb_id}"
+        if workflow.is_completed:
+            return f"Workflow for MAWB {mawb_id} is already completed"
+        if workflow.current_step not in graph:
+            return f"Invalid workflow step: {workflow.current_step}"
+        next_step = graph.next_step(workflow.current_step)
+        if not next_step:
+            return f"No next step defined for {workflow.current_step}"
+        if to_step and not graph.can_transition(workflow.current_step, to_step):
+            return f"Cannot move from {workflow.current_step} to {to_step}"
+        return None
+    
+    def advance_workflows(self, mawb_ids, user_id, to_step=None, event_details=None):
+        """
+        Advance many MAWBs to their next step in a single transaction.
+        
+        Workflows and MAWBs are loaded with one query each and every
+        transition is checked against the step graph (and against
+        ``to_step`` when given). MAWBs that cannot move are left out and
+        reported; the rest are updated in one flush, and their events and
+        step action jobs are bulk-inserted before the one commit. The step
+        actions themselves (reminders, pre-alert email) run later in the job
+        worker.
+        
+        Returns ``(advanced, errors)``: a list of
+        ``{mawb_id, workflow_id, from_step, to_step}`` and a dict of
+        mawb id -> error message.
+        """
+        mawb_ids = list(dict.fromkeys(mawb_ids))
+        graph = workflow_graph.get()
+        # Whole seconds, so the bulk-insert read-back matches on MySQL DATETIME columns too
+        now = datetime.utcnow().replace(microsecond=0)
+        advanced, errors = [], {}
+        batch = _AdvanceBatch(now, user_id)
+        
         try:
-            workflow = MAWBWorkflow.query.filter_by(
-                mawb_id=mawb_id, is_active=True
-            ).first()
-            
-            if not workflow:
-                raise ValueError(f"No active workflow found for MAWB {mawb_id}")
-            
-            if workflow.is_completed:
-                raise ValueError(f"Workflow for MAWB {mawb_id} is already completed")
-            
-            workflow_steps = self.get_workflow_steps()
-            current_step_info = workflow_steps.get(workflow.current_step)
-            if not current_step_info:
-                raise ValueError(f"Invalid workflow step: {workflow.current_step}")
-            
-            next_step = current_step_info['next_step']
-            if not next_step:
-                raise ValueError(f"No next step defined for {workflow.current_step}")
-            
-            # Update workflow
-            old_step = workflow.current_step
-            workflow.current_step = next_step
-            workflow.updated_at = datetime.utcnow()
-            
-            # Check if workflow is completed
-            if next_step == 'COMPLETE':
-                workflow.completed_at = datetime.utcnow()
-                mawb = MAWB.query.get(mawb_id)
+            workflows = {
+                workflow.mawb_id: workflow
+                for workflow in MAWBWorkflow.query.filter(
+                    MAWBWorkflow.mawb_id.in_(mawb_ids),
+                    MAWBWorkflow.is_active == True
+                )
+            }
+            mawbs = {mawb.id: mawb for mawb in MAWB.query.filter(MAWB.id.in_(mawb_ids))}
+            
+            for mawb_id in mawb_ids:
+                workflow = workflows.get(mawb_id)
+                error = self._transition_error(graph, mawb_id, workflow, to_step)
+                if error:
+                    errors[mawb_id] = error
+                    continue
+                
+                old_step = workflow.current_step
+                next_step = graph.next_step(old_step)
+                workflow.current_step = next_step
+                workflow.updated_at = now
+                
+                mawb = mawbs.get(mawb_id)
+                # Check if workflow is completed
+                if next_step == 'COMPLETE':
+                    workflow.completed_at = now
+                    if mawb:
+                        mawb.status = 'complete'
+                        mawb.progress = 'delivered'
+                
+                batch.events.append({
+                    'mawb_id': mawb_id,
+                    'event_type': 'workflow_advanced',
+                    'event_time': now,
+                    'details': {
+                        'from_step': old_step,
+                        'to_step': next_step,
+                        'step_name': graph.get(old_step)['name'],
+                        'user_id': user_id,
+                        **(event_details or {})
+                    },
+                    'created_by': user_id,
+                    'created_at': now
+                })
+                
+                # Trigger step-specific actions
                 if mawb:
-                    mawb.status = 'complete'
-                    mawb.progress = 'delivered'
-            
-            # Create workflow event
-            event = MAWBEvent(
-                mawb_id=mawb_id,
-                event_type='workflow_advanced',
-                event_time=datetime.utcnow(),
-                details={
+                    self._handle_step_actions(mawb, next_step, batch)
+                
+                advanced.append({
+                    'mawb_id': mawb_id,
+                    'workflow_id': workflow.id,
                     'from_step': old_step,
-                    'to_step': next_step,
-                    'step_name': current_step_info['name'],
-                    'user_id': user_id,
-                    **(event_details or {})
-                },
-                created_by=user_id
-            )
+                    'to_step': next_step
+                })
             
-            db.session.add(event)
+            db.session.flush()
+            _bulk_insert(MAWBEvent, batch.events, now)
+            upsert_jobs(batch.jobs)
             db.session.commit()
             
-            logger.info(f"Advanced workflow for MAWB {mawb_id}: {old_step} -> {next_step}")
-            
-            # Trigger step-specific actions
-            self._handle_step_actions(mawb_id, next_step, user_id)
-            
-            return workflow
-            
         except Exception as e:
             db.session.rollback()
-            logger.error(f"Error advancing workflow for MAWB {mawb_id}: {str(e)}")
+            logger.error(f"Error advancing workflows for {len(mawb_ids)} MAWBs: {str(e)}")
             raise
-    
-    def _handle_step_actions(self, mawb_id, step_code, user_id):
-        """Handle step-specific actions"""
-        mawb = MAWB.query.get(mawb_id)
-        if not mawb:
-            return
-        
-        if step_code == 'T03':  # Pickup Scheduled
-            # Schedule pickup reminder
-            self._schedule_pickup_reminder(mawb_id)
-            
-        elif step_code == 'T05':  # At Origin Port
-            # Send pre-alert email
-            self._send_pre_alert_email(mawb_id)
-            
-        elif step_code == 'T06':  # Loaded on Vessel
-            # Schedule LFD reminders
-            if mawb.lfd:
-                self._schedule_lfd_reminders(mawb_id, mawb.lfd)
-                
-        elif step_code == 'T11':  # Customs Clearance
-            # Schedule ISC payment reminders
-            self._schedule_isc_reminders(mawb_id)
-            
-        elif step_code == 'T14':  # Delivered
-            # Schedule empty return reminder
-            self._schedule_empty_return_reminder(mawb_id)
-    
-    def _schedule_pickup_reminder(self, mawb_id):
-        """Schedule pickup reminder job"""
-        reminder_time = datetime.utcnow() + timedelta(hours=24)
         
-        job = ScheduledJob(
-            mawb_id=mawb_id,
-            job_type='pickup_reminder',
-            run_at=reminder_time,
-            payload={'reminder_type': 'pickup'}
-        )
-        
-        db.session.add(job)
-        db.session.commit()
-    
-    def _schedule_lfd_reminders(self, mawb_id, lfd_date):
-        """Schedule LFD reminder jobs"""
-        # 3 days before LFD
-        reminder_3_days = lfd_date - timedelta(days=3)
-        if reminder_3_days > datetime.now().date():
-            job = ScheduledJob(
-                mawb_id=mawb_id,
-                job_type='lfd_reminder',
-                run_at=datetime.combine(reminder_3_days, datetime.min.time()),
-                payload={'reminder_type': 'lfd_3_days'}
-            )
-            db.session.add(job)
-        
-        # 1 day before LFD
-        reminder_1_day = lfd_date - timedelta(days=1)
-        if reminder_1_day > datetime.now().date():
-            job = ScheduledJob(
-                mawb_id=mawb_id,
-                job_type='lfd_reminder',
-                run_at=datetime.combine(reminder_1_day, datetime.min.time()),
-                payload={'reminder_type': 'lfd_1_day'}
-            )
-            db.session.add(job)
-        
-        db.session.commit()
-    
-    def _schedule_isc_reminders(self, mawb_id):
-        """Schedule ISC payment reminders"""
-        # Morning reminder (9 AM)
-        morning_time = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
-        if morning_time < datetime.now():
-            morning_time += timedelta(days=1)
-        
-        job = ScheduledJob(
-            mawb_id=mawb_id,
-            job_type='isc_reminder',
-            run_at=morning_time,
-            payload={'reminder_type': 'isc_morning'}
-        )
-        db.session.add(job)
-        
-        # Afternoon reminder (2 PM)
-        afternoon_time = datetime.now().replace(hour=14, minute=0, second=0, microsecond=0)
-        if afternoon_time < datetime.now():
-            afternoon_time += timedelta(days=1)
-        
-        job = ScheduledJob(
-            mawb_id=mawb_id,
-            job_type='isc_reminder',
-            run_at=afternoon_time,
-            payload={'reminder_type': 'isc_afternoon'}
-        )
-        db.session.add(job)
-        
-        db.session.commit()
+        for item in advanced:
+            logger.info(f"Advanced workflow for MAWB {item['mawb_id']}: {item['from_step']} -> {item['to_step']}")
+        for mawb_id, error in errors.items():
+            logger.warning(f"Did not advance workflow for MAWB {mawb_id}: {error}")
+        return advanced, errors
     
-    def _schedule_empty_return_reminder(self, mawb_id):
-        """Schedule empty return reminder"""
-        reminder_time = datetime.utcnow() + timedelta(days=7)
-        
-        job = ScheduledJob(
-            mawb_id=mawb_id,
-            job_type='empty_return_reminder',
-            run_at=reminder_time,
-            payload={'reminder_type': 'empty_return'}
-        )
-        
-        db.session.add(job)
-        db.session.commit()
-    
-    def _send_pre_alert_email(self, mawb_id):
-        """Send pre-alert email"""
-        try:
-            mawb = MAWB.query.get(mawb_id)
-            if not mawb:
-                return
-            
-            # Get pre-alert template
-            template = EmailTemplate.query.filter_by(
-                name='PRE-ALERT', is_active=True
-            ).first()
-            
-            if not template:
-                logger.warning("PRE-ALERT email template not found")
-                return
-            
-            # Render template
-            email_body = template.render_template(
-                mawb_number=mawb.mawb_number,
-                origin_port=mawb.origin_port or 'N/A',
-                dest_port=mawb.dest_port or 'N/A',
-                eta=mawb.eta.strftime('%Y-%m-%d') if mawb.eta else 'N/A',
-                consignee=mawb.consignee or 'N/A',
-                pieces=mawb.pieces or 0,
-                weight=mawb.weight or 0
+    def _handle_step_actions(self, mawb, step_code, batch):
+        """Queue one job per action registered for the step (see services.step_actions)"""
+        for action in actions_for(step_code):
+            batch.add_job(
+                mawb.id, STEP_ACTION_JOB, batch.now,
+                step_action_payload(step_code, action, batch.user_id),
+                dedup_key=make_dedup_key(STEP_ACTION_JOB, mawb.id, step_code, action)
             )
-            
-            # Log email (in real implementation, send actual email)
-            email_log = EmailLog(
-                cargo_id=None,  # Will be updated when we link to cargo
-                template_name='PRE-ALERT',
-                recipients='operations@company.com',  # Configure based on business rules
-                subject=template.subject,
-                body=email_body,
-                sent_by_id=1  # System user
-            )
-            
-            db.session.add(email_log)
-            db.session.commit()
-            
-            logger.info(f"Pre-alert email logged for MAWB {mawb_id}")
-            
-        except Exception as e:
-            logger.error(f"Error sending pre-alert email for MAWB {mawb_id}: {str(e)}")
 
 class JobProcessor:
     """Process scheduled jobs"""
@@ -303,20 +214,24 @@ class JobProcessor:
                 logger.warning("No Flask app context available for job processing")
                 return
                 
-            now = datetime.utcnow()
-            pending_jobs = ScheduledJob.query.filter(
-                ScheduledJob.status == 'pending',
-                ScheduledJob.run_at <= now
-            ).all()
-            
-            for job in pending_jobs:
-                self._process_job(job)
+            # Claim the jobs first so another process cannot run them too
+            worker_id = make_worker_id()
+            batch_size = current_app.config.get('JOB_CLAIM_BATCH_SIZE', 10)
+            
+            while True:
+                job_ids = claim_due_jobs(worker_id, batch_size)
+                for job_id in job_ids:
+                    self._process_job(db.session.get(ScheduledJob, job_id))
+                if len(job_ids) < batch_size:
+                    break
                 
         except Exception as e:
             logger.error(f"Error processing pending jobs: {str(e)}")
     
     def _process_job(self, job):
         """Process a single job"""
+        job_id = job.id
+        locked_by = job.locked_by
         try:
             logger.info(f"Processing job {job.id} of type {job.job_type}")
             
@@ -328,26 +243,56 @@ class JobProcessor:
                 self._handle_isc_reminder(job)
             elif job.job_type == 'empty_return_reminder':
                 self._handle_empty_return_reminder(job)
+            elif job.job_type == STEP_ACTION_JOB:
+                run_step_action(job)
+            elif job.job_type == 'cargo_export_excel':
+                self._handle_excel_export(job)
+            elif job.job_type == 'bulk_email':
+                self._handle_bulk_email(job)
             else:
-                logger.warning(f"Unknown job type: {job.job_type}")
-                job.status = 'failed'
-                job.attempts += 1
+                raise ValueError(f"Unknown job type: {job.job_type}")
             
             # Mark job as completed
             job.status = 'completed'
             job.updated_at = datetime.utcnow()
+            job.locked_until = None
             db.session.commit()
             
         except Exception as e:
-            logger.error(f"Error processing job {job.id}: {str(e)}")
+            logger.error(f"Error processing job {job_id}: {str(e)}")
+            self._record_failure(job_id, locked_by, e)
+    
+    def _record_failure(self, job_id, locked_by, error):
+        """
+        Mark a job failed on a clean session.
+        
+        The handler's half-done work is rolled back first (after a database
+        error nothing more could be committed otherwise) and the job is
+        reloaded, unless another worker has taken over its lease since.
+        The error goes into the payload, where the export and bulk email
+        progress reads it.
+        """
+        db.session.rollback()
+        try:
+            job = db.session.get(ScheduledJob, job_id)
+            if job is None or job.locked_by != locked_by:
+                logger.warning(f"Job {job_id} is no longer leased by {locked_by}, not recording the failure")
+                return
+            
             job.status = 'failed'
             job.attempts += 1
+            job.payload = {**(job.payload or {}), 'error': str(error)}
             job.updated_at = datetime.utcnow()
+            job.locked_until = None
             
             if job.attempts >= job.max_attempts:
                 job.status = 'failed_permanent'
             
             db.session.commit()
+        except Exception as e:
+            # The lease runs out and the claim counts the attempt instead
+            db.session.rollback()
+            logger.error(f"Could not record the failure of job {job_id}: {str(e)}")
     
     def _handle_pickup_reminder(self, job):
         """Handle pickup reminder"""
@@ -424,5 +369,15 @@ class JobProcessor:
         
         logger.info(f"Empty return reminder processed for MAWB {job.mawb_id}")
 
+    def _handle_excel_export(self, job):
+        """Handle a background Excel export of the cargo list"""
+        from services.export_jobs import run_excel_export
+        run_excel_export(job)
+
+    def _handle_bulk_email(self, job):
+        """Handle a bulk mail-merge across filtered cargo"""
+        from services.bulk_email import run_bulk_email
+        run_bulk_email(job)
+
 # Global instances
 # job_processor = JobProcessor() 
\ No newline at end of file
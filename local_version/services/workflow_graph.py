@@ -0,0 +1,181 @@
+from sqlalchemy import event
+from models_new import db, WorkflowStep
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StepGraph:
+    """
+    The active workflow steps compiled once into lookup tables.
+
+    ``steps`` is in topological order of the ``next_step`` chain (ties and
+    unreachable steps fall back to id order), ``ordinals`` maps a code to its
+    position in that order, ``transitions`` maps a code to its next step and
+    ``ancestors`` holds every step that leads to a code, so "is this step
+    done?" and "is this a valid transition?" are dictionary lookups that also
+    hold for branching chains.
+    """
+
+    __slots__ = ('version', 'steps', 'by_code', 'ordinals', 'transitions', 'ancestors')
+
+    def __init__(self, rows, version=0):
+        self.version = version
+        by_code = {}
+        for step in rows:
+            by_code[step['code']] = step
+        self.by_code = by_code
+        self.transitions = {
+            code: step['next_step'] for code, step in by_code.items() if step['next_step']
+        }
+
+        order = self._topological_order(by_code, self.transitions)
+        self.steps = tuple(by_code[code] for code in order)
+        self.ordinals = {code: position for position, code in enumerate(order)}
+
+        predecessors = {}
+        for code, next_code in self.transitions.items():
+            predecessors.setdefault(next_code, []).append(code)
+        self.ancestors = {code: self._collect(code, predecessors) for code in order}
+
+    @staticmethod
+    def _topological_order(by_code, transitions):
+        """Kahn's algorithm over next_step edges, taking ready steps in their original order"""
+        incoming = {code: 0 for code in by_code}
+        for next_code in transitions.values():
+            if next_code in incoming:
+                incoming[next_code] += 1
+        ready = [code for code in by_code if incoming[code] == 0]
+        order = []
+        while ready:
+            code = ready.pop(0)
+            order.append(code)
+            next_code = transitions.get(code)
+            if next_code in incoming:
+                incoming[next_code] -= 1
+                if incoming[next_code] == 0:
+                    ready.append(next_code)
+        if len(order) < len(by_code):
+            placed = set(order)
+            cyclic = [code for code in by_code if code not in placed]
+            logger.warning(f"Workflow steps form a cycle: {', '.join(cyclic)}")
+            order.extend(cyclic)
+        return order
+
+    @staticmethod
+    def _collect(code, predecessors):
+        seen = set()
+        pending = list(predecessors.get(code, ()))
+        while pending:
+            step = pending.pop()
+            if step not in seen:
+                seen.add(step)
+                pending.extend(predecessors.get(step, ()))
+        seen.discard(code)
+        return frozenset(seen)
+
+    def __contains__(self, code):
+        return code in self.by_code
+
+    def get(self, code):
+        return self.by_code.get(code)
+
+    def ordinal(self, code):
+        return self.ordinals.get(code)
+
+    def next_step(self, code):
+        return self.transitions.get(code)
+
+    def can_transition(self, from_code, to_code):
+        return self.transitions.get(from_code) == to_code
+
+    def is_completed(self, code, current_code):
+        """Whether ``code`` lies before ``current_code`` on the step chain"""
+        return code in self.ancestors.get(current_code, ())
+
+    def has_reached(self, current_code, code):
+        """Whether a workflow at ``current_code`` is at or past ``code``"""
+        return current_code == code or self.is_completed(code, current_code)
+
+class WorkflowGraphCache:
+    """
+    One compiled StepGraph per process, shared by the API and every engine.
+
+    The graph is rebuilt right after a commit in this process changes
+    workflow steps. Other processes' changes are picked up when the step rows
+    are re-read every ``check_seconds``; ``version`` only moves when their
+    content actually changed.
+    """
+
+    def __init__(self):
+        self.check_seconds = 60.0
+        self.lock = threading.Lock()
+        self.graph = None
+        self.rows = None
+        self.checked_at = None
+        self.version = 0
+
+    def init_app(self, app):
+        self.check_seconds = app.config.get('WORKFLOW_GRAPH_CHECK_SECONDS', 60.0)
+        _register_workflow_graph_hooks(self)
+
+    @staticmethod
+    def _load_rows():
+        return tuple({
+            'code': step.code,
+            'name': step.name,
+            'description': step.description,
+            'next_step': step.next_step
+        } for step in WorkflowStep.query.filter_by(is_active=True).order_by(WorkflowStep.id))
+
+    def get(self):
+        """The current StepGraph, rebuilt only when the steps changed"""
+        now = time.monotonic()
+        with self.lock:
+            graph = self.graph
+            if graph is not None and self.checked_at is not None and now - self.checked_at < self.check_seconds:
+                return graph
+
+        rows = self._load_rows()
+        with self.lock:
+            if self.graph is None or rows != self.rows:
+                self.version += 1
+                self.graph = StepGraph(rows, self.version)
+                self.rows = rows
+                logger.info(f"Compiled workflow step graph v{self.version} ({len(rows)} steps)")
+            self.checked_at = now
+            return self.graph
+
+    def invalidate(self):
+        with self.lock:
+            self.checked_at = None
+
+def _register_workflow_graph_hooks(cache):
+    """Recompile the step graph after commits that change workflow steps"""
+    if getattr(_register_workflow_graph_hooks, 'registered', False):
+        return
+    _register_workflow_graph_hooks.registered = True
+
+    @event.listens_for(db.session, 'before_flush')
+    def before_flush(session, flush_context, instances):
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, WorkflowStep):
+                session.info['workflow_steps_changed'] = True
+                return
+
+    @event.listens_for(db.session, 'after_commit')
+    def after_commit(session):
+        if session.info.pop('workflow_steps_changed', False):
+            cache.invalidate()
+
+    @event.listens_for(db.session, 'after_rollback')
+    def after_rollback(session):
+        session.info.pop('workflow_steps_changed', None)
+
+# Global workflow step graph
+workflow_graph = WorkflowGraphCache()
+
+def init_workflow_graph(app):
+    """Initialize the workflow step graph for the Flask app"""
+    workflow_graph.init_app(app)
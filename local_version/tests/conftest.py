@@ -0,0 +1,42 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp(prefix='wdt-tests-')
+
+# Point the app at a scratch SQLite database before app.py builds its module-level app
+import config
+
+config.Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(_tmp, 'test.db')
+config.Config.SQLALCHEMY_ENGINE_OPTIONS = {}
+config.Config.WTF_CSRF_ENABLED = False
+config.Config.AUDIT_LOG_MODE = 'sync'
+config.Config.AUDIT_SPOOL_FOLDER = os.path.join(_tmp, 'audit_spool')
+config.Config.AUDIT_ARCHIVE_FOLDER = os.path.join(_tmp, 'audit_archive')
+config.Config.EXPORT_FOLDER = os.path.join(_tmp, 'exports')
+config.Config.JOB_WAKEUP_ADDRESS = ''
+
+from app import app as flask_app
+from extensions import db
+from services.permission_cache import permission_cache
+from services.user_cache import user_cache
+from services.workflow_graph import workflow_graph
+
+
+@pytest.fixture
+def app():
+    """The app with freshly created, empty tables"""
+    shutil.rmtree(config.Config.AUDIT_ARCHIVE_FOLDER, ignore_errors=True)
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        permission_cache.invalidate()
+        user_cache.invalidate()
+        workflow_graph.invalidate()
+        yield flask_app
+        db.session.remove()
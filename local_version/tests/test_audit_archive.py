@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models_new import AuditLog, User
+from services import audit_archive
+from services.audit_archive import archive_closed_months, read_audit_log
+
+NOW = datetime(2026, 10, 18, 12, 0)
+ARCHIVED_MONTHS = (datetime(2026, 4, 1), datetime(2026, 5, 1), datetime(2026, 6, 1))
+
+
+def _user(username):
+    user = User(username=username, email=f'{username}@example.com', first_name=username, last_name='Test')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+@pytest.fixture
+def audit_rows(app):
+    """Audit rows for 3 archived months plus the hot table, 2 users x 3 records"""
+    users = [_user('alice'), _user('bob')]
+    rows = []
+    for month in ARCHIVED_MONTHS + (datetime(2026, 10, 1),):
+        for day in range(10):
+            for record_id in (1, 2, 3):
+                rows.append({
+                    'table_name': 'mawbs',
+                    'record_id': record_id,
+                    'action': 'UPDATE',
+                    'new_values': {'day': day},
+                    'changed_by': users[(day + record_id) % 2],
+                    'changed_at': month + timedelta(days=day, hours=record_id)
+                })
+    db.session.execute(AuditLog.__table__.insert(), rows)
+    db.session.commit()
+    assert archive_closed_months(now=NOW, hot_months=3) == 90
+    return {'users': users, 'rows': rows}
+
+
+@pytest.fixture
+def opened_parts(monkeypatch):
+    opened = []
+    read_part = audit_archive.iter_archive_part
+
+    def spy(part):
+        opened.append(part['file'])
+        return read_part(part)
+    monkeypatch.setattr(audit_archive, 'iter_archive_part', spy)
+    return opened
+
+
+def _expected(rows, since=None, before=None, **filters):
+    matching = [
+        row for row in rows
+        if all(row[field] == value for field, value in filters.items())
+        and (since is None or row['changed_at'] >= since)
+        and (before is None or row['changed_at'] < before)
+    ]
+    return sorted(matching, key=lambda row: row['changed_at'], reverse=True)
+
+
+def _read_all(per_page, **kwargs):
+    entries, page = [], 1
+    while True:
+        page_entries, total, has_more = read_audit_log(page=page, per_page=per_page, **kwargs)
+        entries.extend(page_entries)
+        if not has_more:
+            return entries, total
+        page += 1
+
+
+def test_user_filter_is_counted_from_the_index(audit_rows, opened_parts):
+    alice = audit_rows['users'][0]
+
+    entries, total, has_more = read_audit_log({'changed_by': alice}, page=1, per_page=5)
+
+    assert total == len(_expected(audit_rows['rows'], changed_by=alice))
+    assert has_more
+    assert len(entries) == 5
+    assert opened_parts == []
+
+
+def test_record_filter_does_not_scan_the_archive_for_a_total(audit_rows, opened_parts):
+    entries, total, has_more = read_audit_log({'table_name': 'mawbs', 'record_id': 2}, page=1, per_page=5)
+
+    assert total is None
+    assert has_more
+    assert [entry['changed_at'] for entry in entries] == [
+        row['changed_at'].isoformat() for row in _expected(audit_rows['rows'], record_id=2)[:5]
+    ]
+    assert opened_parts == []
+
+
+def test_date_range_only_opens_overlapping_parts(audit_rows, opened_parts):
+    since, before = datetime(2026, 5, 3), datetime(2026, 5, 6)
+
+    entries, total, has_more = read_audit_log({'record_id': 1}, page=1, per_page=50, since=since, before=before)
+
+    assert opened_parts == ['audit_log-2026-05.1.jsonl.gz']
+    assert total is None
+    assert not has_more
+    assert len(entries) == len(_expected(audit_rows['rows'], since=since, before=before, record_id=1))
+
+
+@pytest.mark.parametrize('filter_by', [None, 'record_id', 'action', 'changed_by'])
+def test_paging_returns_every_match_across_hot_table_and_archive(audit_rows, filter_by):
+    values = {'record_id': 3, 'action': 'UPDATE', 'changed_by': audit_rows['users'][1]}
+    filters = {filter_by: values[filter_by]} if filter_by else {}
+    expected = _expected(audit_rows['rows'], **filters)
+
+    entries, total = _read_all(per_page=7, filters=filters)
+
+    assert [entry['changed_at'] for entry in entries] == [row['changed_at'].isoformat() for row in expected]
+    assert total in (None, len(expected))
+
+
+def test_parts_without_user_counts_fall_back_to_has_more_paging(audit_rows, opened_parts):
+    index = audit_archive.load_archive_index()
+    for month in index['months'].values():
+        for part in month['parts']:
+            del part['counts_by_user']
+    audit_archive._save_archive_index(index)
+    alice = audit_rows['users'][0]
+
+    entries, total, has_more = read_audit_log({'changed_by': alice}, page=1, per_page=5)
+
+    assert total is None
+    assert has_more
+    assert opened_parts == []
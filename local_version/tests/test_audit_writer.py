@@ -0,0 +1,74 @@
+import glob
+import os
+import time
+
+import pytest
+
+from models_new import AuditLog
+from services import audit_writer as audit_writer_module
+from services.audit_writer import AuditWriter
+
+
+def _record(record_id):
+    return {
+        'table_name': 'mawbs',
+        'record_id': record_id,
+        'action': 'INSERT',
+        'new_values': {'id': record_id},
+        'changed_by': None,
+        'changed_at': '2026-10-18T12:00:00'
+    }
+
+
+@pytest.fixture
+def writer(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(audit_writer_module, 'RETRY_BASE_SECONDS', 0.1)
+    writer = AuditWriter()
+    writer.app = app
+    writer.flush_interval = 0.02
+    writer.fsync = False
+    writer.spool_folder = str(tmp_path)
+    writer.retry_delay = audit_writer_module.RETRY_BASE_SECONDS
+    yield writer
+    writer.stop()
+
+
+def _wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failed_batch_is_retried_without_a_restart(writer, monkeypatch):
+    insert = writer._insert
+    outages = []
+
+    def flaky_insert(records):
+        if len(outages) < 2:
+            outages.append(len(records))
+            raise RuntimeError('database unavailable')
+        insert(records)
+    monkeypatch.setattr(writer, '_insert', flaky_insert)
+
+    writer.submit([_record(1), _record(2)])
+
+    # The first write and the first retry fail, the second retry succeeds
+    assert _wait_for(lambda: AuditLog.query.count() == 2)
+    assert outages == [2, 2]
+    assert writer.failed == []
+    assert writer.retry_delay == audit_writer_module.RETRY_BASE_SECONDS
+    assert glob.glob(os.path.join(writer.spool_folder, '*.inflight')) == []
+
+
+def test_failed_batch_stays_spooled_while_the_database_is_down(writer, monkeypatch):
+    def failing_insert(records):
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(writer, '_insert', failing_insert)
+
+    writer.submit([_record(1)])
+
+    assert _wait_for(lambda: writer.retry_delay >= 0.4)
+    assert len(writer.failed) == 1
+    assert len(glob.glob(os.path.join(writer.spool_folder, '*.inflight'))) == 1
+    assert AuditLog.query.count() == 0
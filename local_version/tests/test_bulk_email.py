@@ -0,0 +1,31 @@
+import pytest
+
+from extensions import db
+from models_new import EmailTemplate
+from services.bulk_email import create_bulk_email_job
+
+
+@pytest.fixture
+def template_id(app):
+    template = EmailTemplate(name='Arrival notice', subject='Arrival {{ main_awb }}', body='Hello')
+    db.session.add(template)
+    db.session.commit()
+    return template.id
+
+
+@pytest.mark.parametrize('filters', [None, {}, {'status': '', 'mawb': None}])
+def test_bulk_send_without_filters_is_refused(template_id, filters):
+    with pytest.raises(ValueError, match='all=true'):
+        create_bulk_email_job(template_id, filters, user_id=1, to_emails='ops@example.com')
+
+
+def test_bulk_send_to_all_cargo_must_be_explicit(template_id):
+    job = create_bulk_email_job(template_id, {}, user_id=1, to_emails='ops@example.com', all_cargo=True)
+    assert job.payload['filters'] == {}
+    assert job.payload['all_cargo'] is True
+
+
+def test_bulk_send_with_a_filter(template_id):
+    job = create_bulk_email_job(template_id, {'status': 'Arrived'}, user_id=1, to_emails='ops@example.com')
+    assert job.payload['filters'] == {'status': 'Arrived'}
+    assert job.payload['all_cargo'] is False
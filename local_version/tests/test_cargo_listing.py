@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models_new import Cargo
+from services.cargo_listing import SORT_MODES, get_cargo_page
+
+NOW = datetime(2026, 10, 18, 12, 0)
+
+
+def _add_cargo(awb, status=None, eta=None, lfd_date=None, created_at=None):
+    cargo = Cargo(main_awb=awb, status=status, eta=eta, lfd_date=lfd_date,
+                  created_at=created_at or NOW, is_archived=False)
+    db.session.add(cargo)
+    return cargo
+
+
+def _all_pages(sort_by, per_page, tab='all'):
+    seen, cursor = [], None
+    while True:
+        cargos, cursor = get_cargo_page(sort_by, NOW, tab=tab, cursor=cursor, per_page=per_page)
+        seen.extend(cargo.main_awb for cargo in cargos)
+        if cursor is None:
+            return seen
+
+
+def _first_page(sort_by, tab='all'):
+    cargos, _ = get_cargo_page(sort_by, NOW, tab=tab, per_page=1000)
+    return [cargo.main_awb for cargo in cargos]
+
+
+def test_eta_soonest_pages_through_null_and_set_etas_in_one_group(app):
+    # Completed cargo with and without an ETA share the same "completed / no ETA" group
+    for i in range(3):
+        _add_cargo(f'C-NULL-{i}', status='Completed')
+        _add_cargo(f'C-ETA-{i}', status='Completed', eta=NOW + timedelta(days=i))
+    db.session.commit()
+
+    paged = _all_pages('eta_soonest', per_page=2)
+
+    assert len(paged) == 6
+    assert paged == _first_page('eta_soonest')
+    # ETAs come before the cargo without one
+    assert paged[:3] == ['C-ETA-0', 'C-ETA-1', 'C-ETA-2']
+
+
+@pytest.mark.parametrize('sort_by', SORT_MODES)
+def test_paging_matches_single_page_for_every_sort(app, sort_by):
+    for i in range(12):
+        _add_cargo(
+            f'AWB-{i:02d}',
+            status='Completed' if i % 4 == 0 else 'In Progress',
+            eta=None if i % 3 == 0 else NOW + timedelta(days=i - 6),
+            lfd_date=None if i % 5 == 0 else NOW + timedelta(days=6 - i),
+            created_at=NOW - timedelta(hours=i % 6)
+        )
+    db.session.commit()
+
+    expected = _first_page(sort_by)
+
+    for per_page in (1, 2, 5):
+        assert _all_pages(sort_by, per_page) == expected
+    assert sorted(expected) == sorted(f'AWB-{i:02d}' for i in range(12))
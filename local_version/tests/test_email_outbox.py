@@ -0,0 +1,202 @@
+import smtplib
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models_new import EmailOutbox
+from services import email_outbox
+from services.email_outbox import EmailSender, SMTPConnectionPool, claim_outbox, enqueue_email
+
+
+class FakeSMTP:
+    """Records deliveries; ``replies`` maps a recipient to the exception sendmail raises for it"""
+
+    def __init__(self, replies=None):
+        self.replies = replies or {}
+        self.sent = []
+        self.closed = False
+
+    def before_send(self, recipients):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        self.before_send(recipients)
+        for recipient in recipients:
+            if recipient in self.replies:
+                raise self.replies[recipient]
+        self.sent.extend(recipients)
+        return {}
+
+    def noop(self):
+        return (250, b'OK')
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    """Hands out the queued connections (or raises the queued errors) in order"""
+
+    def __init__(self, *connections):
+        self.connections = list(connections)
+        self.released = []
+        self.size = 1
+
+    def acquire(self):
+        connection = self.connections.pop(0)
+        if isinstance(connection, Exception):
+            raise connection
+        return connection
+
+    def release(self, smtp, broken=False):
+        assert smtp is not None
+        self.released.append((smtp, broken))
+
+
+@pytest.fixture
+def sender(app):
+    sender = EmailSender()
+    sender.app = app
+    return sender
+
+
+def _enqueue(*recipients):
+    messages = [enqueue_email(recipient, 'Subject', 'Body') for recipient in recipients]
+    db.session.commit()
+    return [message.id for message in messages]
+
+
+def _messages(ids):
+    db.session.expire_all()
+    return [db.session.get(EmailOutbox, message_id) for message_id in ids]
+
+
+@pytest.mark.parametrize('error', [
+    smtplib.SMTPConnectError(421, b'Too many connections'),
+    smtplib.SMTPConnectError(554, b'No SMTP service here'),
+    smtplib.SMTPAuthenticationError(535, b'Authentication credentials invalid'),
+    ConnectionRefusedError(111, 'Connection refused'),
+])
+def test_connection_failure_defers_batch_without_using_attempts(sender, error):
+    ids = _enqueue('a@example.com', 'b@example.com')
+    sender.pool = FakePool(error)
+
+    assert sender.send_due() == 2
+    for message in _messages(ids):
+        assert message.status == 'pending'
+        assert message.attempts == 0
+        assert message.deferrals == 1
+        assert message.locked_by is None
+        assert str(error) in message.last_error
+    assert sender.pool.released == []
+
+
+def test_session_reply_mid_batch_reconnects_for_the_rest(sender):
+    first = FakeSMTP({'b@example.com': smtplib.SMTPSenderRefused(421, b'Closing', 'no-reply@example.com')})
+    second = FakeSMTP()
+    ids = _enqueue('a@example.com', 'b@example.com', 'c@example.com')
+    sender.pool = FakePool(first, second)
+
+    sender.send_due()
+    assert [(m.status, m.attempts) for m in _messages(ids)] == [('sent', 1), ('pending', 0), ('sent', 1)]
+    assert first.sent == ['a@example.com'] and second.sent == ['c@example.com']
+    assert sender.pool.released == [(first, True), (second, False)]
+
+
+def test_message_rejection_fails_only_that_message(sender):
+    smtp = FakeSMTP({'b@example.com': smtplib.SMTPDataError(552, b'Message too large')})
+    ids = _enqueue('a@example.com', 'b@example.com')
+    sender.pool = FakePool(smtp)
+
+    sender.send_due()
+    assert [(m.status, m.attempts) for m in _messages(ids)] == [('sent', 1), ('failed', 1)]
+
+
+def test_connect_closes_socket_when_login_fails(monkeypatch):
+    connections = []
+
+    class RefusingSMTP(FakeSMTP):
+        def __init__(self, *args, **kwargs):
+            super().__init__()
+            connections.append(self)
+
+        def starttls(self):
+            pass
+
+        def login(self, username, password):
+            raise smtplib.SMTPAuthenticationError(535, b'Authentication credentials invalid')
+
+    monkeypatch.setattr(email_outbox.smtplib, 'SMTP', RefusingSMTP)
+    pool = SMTPConnectionPool(use_tls=True, username='user', password='wrong')
+
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        pool.acquire()
+    assert len(connections) == 1 and connections[0].closed
+
+
+def test_deferrals_are_capped(sender):
+    [message_id] = _enqueue('a@example.com')
+    sender.max_deferrals = 2
+    for _ in range(3):
+        db.session.execute(EmailOutbox.__table__.update().values(next_attempt_at=datetime.utcnow()))
+        db.session.commit()
+        sender.pool = FakePool(ConnectionRefusedError(111, 'Connection refused'))
+        assert sender.send_due() == 1
+
+    [message] = _messages([message_id])
+    assert message.status == 'failed'
+    assert 'deferred 2 times' in message.last_error
+
+
+@pytest.mark.parametrize('error', [
+    smtplib.SMTPNotSupportedError('SMTPUTF8 not supported by server'),
+    UnicodeEncodeError('ascii', 'ü', 0, 1, 'ordinal not in range(128)'),
+])
+def test_message_errors_count_an_attempt_and_the_batch_goes_on(sender, error):
+    first = FakeSMTP({'a@example.com': error})
+    second = FakeSMTP()
+    ids = _enqueue('a@example.com', 'b@example.com')
+    sender.pool = FakePool(first, second)
+
+    sender.send_due()
+    failed, sent = _messages(ids)
+    assert (failed.attempts, failed.deferrals) == (1, 0)
+    assert failed.status == ('failed' if isinstance(error, smtplib.SMTPException) else 'pending')
+    assert sent.status == 'sent'
+
+
+def test_reclaimed_send_counts_an_attempt(app):
+    ids = _enqueue('a@example.com', 'b@example.com')
+    db.session.execute(EmailOutbox.__table__.update().where(EmailOutbox.id == ids[1]).values(attempts=4))
+    db.session.commit()
+    assert sorted(claim_outbox('sender-a', 10, lease_seconds=-1)) == ids
+
+    assert claim_outbox('sender-b', 10, max_attempts=5) == [ids[0]]
+    reclaimed, exhausted = _messages(ids)
+    assert (reclaimed.status, reclaimed.attempts, reclaimed.locked_by) == ('sending', 1, 'sender-b')
+    assert (exhausted.status, exhausted.attempts, exhausted.locked_by) == ('failed', 5, None)
+
+
+def test_lease_of_waiting_messages_is_extended(sender):
+    ids = _enqueue('a@example.com', 'b@example.com')
+    seen = []
+
+    class SlowSMTP(FakeSMTP):
+        def before_send(self, recipients):
+            table = EmailOutbox.__table__
+            if recipients == ['a@example.com']:
+                # This send takes so long that the batch's lease runs out
+                db.session.execute(table.update().values(locked_until=datetime(2026, 1, 1)))
+            else:
+                seen.append(db.session.execute(
+                    db.select(table.c.locked_until).where(table.c.id == ids[1])
+                ).scalar())
+
+    sender.pool = FakePool(SlowSMTP())
+    sender.send_due()
+    assert seen[0] > datetime.utcnow() + timedelta(seconds=60)
+    assert [m.status for m in _messages(ids)] == ['sent', 'sent']
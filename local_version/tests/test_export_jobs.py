@@ -0,0 +1,66 @@
+import os
+import time
+from datetime import datetime
+
+from extensions import db
+from models_new import ScheduledJob
+from services import export_jobs
+from services.export_jobs import (
+    EXCEL_EXPORT_JOB, cleanup_export_files, create_excel_export_job, get_export_file_path,
+    get_export_progress
+)
+from services.job_worker import claim_due_jobs
+from services.workflow_engine import JobProcessor
+
+
+def _finished_export(app, age_hours):
+    job = ScheduledJob(job_type=EXCEL_EXPORT_JOB, run_at=datetime.utcnow(), status='completed', payload={})
+    db.session.add(job)
+    db.session.commit()
+    filename = f'cargo_list_{job.id}_20261018_120000.xlsx'
+    path = os.path.join(app.config['EXPORT_FOLDER'], filename)
+    os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'xlsx')
+    mtime = time.time() - age_hours * 3600
+    os.utime(path, (mtime, mtime))
+    job.payload = {'filename': filename, 'total': 1, 'processed': 1}
+    db.session.commit()
+    return job, path
+
+
+def test_cleanup_removes_only_expired_exports(app):
+    old_job, old_path = _finished_export(app, age_hours=30)
+    new_job, new_path = _finished_export(app, age_hours=1)
+    stale_part = os.path.join(app.config['EXPORT_FOLDER'], 'cargo_list_999_20261001_000000.xlsx.part')
+    open(stale_part, 'wb').close()
+    os.utime(stale_part, (0, 0))
+
+    assert cleanup_export_files(24) == 2
+
+    assert not os.path.exists(old_path)
+    assert not os.path.exists(stale_part)
+    assert os.path.exists(new_path)
+    assert get_export_file_path(db.session.get(ScheduledJob, new_job.id)) == new_path
+
+    progress = get_export_progress(db.session.get(ScheduledJob, old_job.id))
+    assert not progress['ready']
+    assert 'expired' in progress['error']
+
+
+def test_failed_export_keeps_its_error(app, monkeypatch):
+    def failing_batches(filters, keyset=False):
+        raise OSError('No space left on device')
+        yield
+    monkeypatch.setattr(export_jobs, 'iter_export_batches', failing_batches)
+
+    job_id = create_excel_export_job({}, user_id=1).id
+    [claimed] = claim_due_jobs('worker-a', 10)
+    JobProcessor()._process_job(db.session.get(ScheduledJob, claimed))
+
+    db.session.expire_all()
+    job = db.session.get(ScheduledJob, job_id)
+    progress = get_export_progress(job)
+    assert progress['status'] == 'failed'
+    assert progress['error'] == 'No space left on device'
+    assert not [name for name in os.listdir(app.config['EXPORT_FOLDER']) if name.startswith(f'cargo_list_{job_id}_')]
@@ -0,0 +1,65 @@
+import socket
+import time
+from datetime import datetime
+
+import pytest
+
+from extensions import db
+from models_new import ScheduledJob
+from services.job_scheduler import JobScheduler, job_scheduler, parse_wakeup_address
+
+
+def test_parse_wakeup_address():
+    assert parse_wakeup_address('127.0.0.1:5599') == ('127.0.0.1', 5599)
+    assert parse_wakeup_address(':5599') == ('127.0.0.1', 5599)
+    assert parse_wakeup_address('') is None
+    assert parse_wakeup_address('localhost:http') is None
+
+
+@pytest.fixture
+def worker():
+    """A scheduler listening for wakeups on a free port, without its dispatch loop"""
+    scheduler = JobScheduler()
+    scheduler.wakeup_address = ('127.0.0.1', 0)
+    scheduler.running = True
+    scheduler._start_wakeup_listener()
+    yield scheduler
+    scheduler.running = False
+    scheduler._stop_wakeup_listener()
+    assert not scheduler.wakeup_thread.is_alive()
+
+
+def _wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_job_committed_in_another_process_wakes_the_worker(app, worker, monkeypatch):
+    # This process plays the web worker: its scheduler is not running
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    monkeypatch.setattr(job_scheduler, 'wakeup_address', worker.wakeup_socket.getsockname())
+    monkeypatch.setattr(job_scheduler, 'signal_socket', sender)
+    run_at = datetime(2026, 10, 19, 9, 0)
+
+    db.session.add(ScheduledJob(job_type='pickup_reminder', run_at=run_at))
+    db.session.add(ScheduledJob(job_type='pickup_reminder', run_at=run_at))
+    db.session.commit()
+
+    assert _wait_for(lambda: worker.upcoming)
+    assert worker.upcoming == [(run_at, 0)]
+    sender.close()
+
+
+def test_rolled_back_jobs_send_no_wakeup(app, worker, monkeypatch):
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    monkeypatch.setattr(job_scheduler, 'wakeup_address', worker.wakeup_socket.getsockname())
+    monkeypatch.setattr(job_scheduler, 'signal_socket', sender)
+
+    db.session.add(ScheduledJob(job_type='pickup_reminder', run_at=datetime(2026, 10, 19, 9, 0)))
+    db.session.flush()
+    db.session.rollback()
+
+    assert not _wait_for(lambda: worker.upcoming, seconds=0.3)
+    sender.close()
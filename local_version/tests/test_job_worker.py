@@ -0,0 +1,194 @@
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects import mysql
+
+from extensions import db
+from models_new import AuditLog, Cargo, ScheduledJob
+from services import job_worker
+from services.job_worker import UPSERT_COLUMNS, claim_due_jobs, job_row, upsert_jobs
+from services.workflow_engine import JobProcessor
+
+
+def _job(job_type='pickup_reminder', **values):
+    job = ScheduledJob(job_type=job_type, run_at=datetime.utcnow() - timedelta(seconds=1), payload={}, **values)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def _reload(job_id):
+    db.session.expire_all()
+    return db.session.get(ScheduledJob, job_id)
+
+
+def test_claim_leases_due_jobs_once(app):
+    due = _job()
+    later = ScheduledJob(job_type='pickup_reminder', run_at=datetime.utcnow() + timedelta(hours=1))
+    db.session.add(later)
+    db.session.commit()
+
+    assert claim_due_jobs('worker-a', 10) == [due]
+    assert claim_due_jobs('worker-b', 10) == []
+
+    job = _reload(due)
+    assert job.status == 'running'
+    assert job.locked_by == 'worker-a'
+    assert job.locked_until > datetime.utcnow()
+    assert job.attempts == 0
+
+
+def test_expired_lease_is_reclaimed_as_another_attempt(app):
+    job_id = _job()
+    claim_due_jobs('worker-a', 10, lease_seconds=-1)
+
+    assert claim_due_jobs('worker-b', 10) == [job_id]
+
+    job = _reload(job_id)
+    assert job.locked_by == 'worker-b'
+    assert job.status == 'running'
+    assert job.attempts == 1
+
+
+def test_expired_lease_without_attempts_left_fails_permanently(app):
+    job_id = _job(attempts=2, max_attempts=3)
+    claim_due_jobs('worker-a', 10, lease_seconds=-1)
+
+    assert claim_due_jobs('worker-b', 10) == []
+
+    job = _reload(job_id)
+    assert job.status == 'failed_permanent'
+    assert job.attempts == 3
+    assert job.locked_until is None
+
+
+def test_database_error_in_handler_is_recorded_as_failure(app, monkeypatch):
+    def broken_handler(self, job):
+        db.session.add(Cargo(main_awb=None))
+        db.session.flush()
+    monkeypatch.setattr(JobProcessor, '_handle_pickup_reminder', broken_handler)
+
+    job_id = _job()
+    [claimed] = claim_due_jobs('worker-a', 10)
+    JobProcessor()._process_job(db.session.get(ScheduledJob, claimed))
+
+    job = _reload(job_id)
+    assert job.status == 'failed'
+    assert job.attempts == 1
+    assert job.locked_until is None
+    assert Cargo.query.count() == 0
+
+
+def test_unknown_job_type_is_not_marked_completed(app):
+    job_id = _job(job_type='no_such_job')
+    [claimed] = claim_due_jobs('worker-a', 10)
+    JobProcessor()._process_job(db.session.get(ScheduledJob, claimed))
+
+    job = _reload(job_id)
+    assert job.status == 'failed'
+    assert job.attempts == 1
+
+
+def test_failure_is_not_recorded_after_losing_the_lease(app, monkeypatch):
+    def slow_failing_handler(self, job):
+        # Another worker reclaims the job while this one is still running it
+        db.session.execute(
+            ScheduledJob.__table__.update().where(ScheduledJob.id == job.id).values(locked_by='worker-b')
+        )
+        db.session.commit()
+        raise RuntimeError('boom')
+    monkeypatch.setattr(JobProcessor, '_handle_pickup_reminder', slow_failing_handler)
+
+    job_id = _job()
+    [claimed] = claim_due_jobs('worker-a', 10)
+    JobProcessor()._process_job(db.session.get(ScheduledJob, claimed))
+
+    job = _reload(job_id)
+    assert job.status == 'running'
+    assert job.locked_by == 'worker-b'
+    assert job.attempts == 0
+
+
+def _jobs_by_key():
+    db.session.expire_all()
+    return {job.dedup_key: job for job in ScheduledJob.query.order_by(ScheduledJob.id)}
+
+
+def test_upsert_reschedules_pending_jobs_instead_of_duplicating(app):
+    first = datetime(2026, 11, 1, 9, 0)
+    later = datetime(2026, 11, 2, 9, 0)
+    upsert_jobs([
+        job_row('lfd_reminder', first, {'days': 3}, dedup_key='lfd_reminder:1:lfd_3_days'),
+        job_row('lfd_reminder', first, {'days': 1}, dedup_key='lfd_reminder:1:lfd_1_day'),
+        job_row('pickup_reminder', first)
+    ])
+    db.session.commit()
+
+    upsert_jobs([
+        job_row('lfd_reminder', first, {'days': 3}, dedup_key='lfd_reminder:1:lfd_3_days'),
+        # The last row wins when a key repeats within one call
+        job_row('lfd_reminder', later, {'days': 3}, dedup_key='lfd_reminder:1:lfd_3_days'),
+        job_row('pickup_reminder', later)
+    ])
+    db.session.commit()
+
+    assert ScheduledJob.query.count() == 4
+    jobs = _jobs_by_key()
+    assert jobs['lfd_reminder:1:lfd_3_days'].run_at == later
+    assert jobs['lfd_reminder:1:lfd_1_day'].run_at == first
+
+
+def test_upsert_leaves_running_and_completed_jobs_alone(app):
+    first = datetime(2026, 11, 1, 9, 0)
+    upsert_jobs([job_row('lfd_reminder', first, dedup_key=key) for key in ('running', 'completed', 'failed')])
+    db.session.commit()
+    jobs = _jobs_by_key()
+    jobs['running'].status = 'running'
+    jobs['running'].locked_by = 'worker-a'
+    jobs['completed'].status = 'completed'
+    jobs['failed'].status = 'failed'
+    jobs['failed'].attempts = 3
+    db.session.commit()
+
+    later = first + timedelta(days=1)
+    upsert_jobs([job_row('lfd_reminder', later, dedup_key=key) for key in ('running', 'completed', 'failed')])
+    db.session.commit()
+
+    jobs = _jobs_by_key()
+    assert (jobs['running'].status, jobs['running'].run_at, jobs['running'].locked_by) == ('running', first, 'worker-a')
+    assert (jobs['completed'].status, jobs['completed'].run_at) == ('completed', first)
+    assert (jobs['failed'].status, jobs['failed'].run_at, jobs['failed'].attempts) == ('pending', later, 0)
+
+
+def test_mysql_upsert_checks_status_before_assigning_it(app, monkeypatch):
+    monkeypatch.setattr(db.engine.dialect, 'name', 'mysql')
+    stmt = job_worker._upsert_statement(
+        ScheduledJob.__table__, [job_row('lfd_reminder', datetime(2026, 11, 1), dedup_key='key')]
+    )
+    sql = str(stmt.compile(dialect=mysql.dialect()))
+
+    assignments = re.findall(r'(\w+) = IF\(scheduled_jobs\.status IN \(', sql.split('ON DUPLICATE KEY UPDATE')[1])
+    # MySQL applies assignments left to right, so status must come after every column read under it
+    assert assignments == list(UPSERT_COLUMNS)
+    assert assignments[-1] == 'status'
+
+
+def _audited_actions(job_id):
+    logs = AuditLog.query.filter_by(table_name='scheduled_jobs', record_id=job_id).order_by(AuditLog.id)
+    return [log.action for log in logs]
+
+
+def test_upsert_audits_a_rearm_within_the_same_second_as_an_update(app):
+    now = datetime(2026, 11, 1, 9, 0)
+    for run_at in (now, now + timedelta(hours=1)):
+        upsert_jobs([job_row('lfd_reminder', run_at, dedup_key='key', now=now)])
+        db.session.commit()
+    job = _jobs_by_key()['key']
+    job.status = 'completed'
+    db.session.commit()
+    # Inserted, re-armed in the same second, then completed through the ORM
+    assert _audited_actions(job.id) == ['INSERT', 'UPDATE', 'UPDATE']
+
+    upsert_jobs([job_row('lfd_reminder', now + timedelta(hours=2), dedup_key='key', now=now)])
+    db.session.commit()
+    assert _audited_actions(job.id) == ['INSERT', 'UPDATE', 'UPDATE']
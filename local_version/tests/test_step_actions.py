@@ -0,0 +1,95 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models_new import MAWB, ScheduledJob
+from services.step_actions import schedule_lfd_reminders
+
+TODAY = datetime.now().date()
+
+
+@pytest.fixture
+def mawb(app):
+    mawb = MAWB(mawb_number='176-12345675', lfd=TODAY + timedelta(days=10))
+    db.session.add(mawb)
+    db.session.commit()
+    return mawb
+
+
+def _set_lfd(mawb, lfd):
+    mawb.lfd = lfd
+    schedule_lfd_reminders(mawb, {})
+    db.session.commit()
+
+
+def _reminders(mawb):
+    """(reminder type, run date, status) of the MAWB's LFD reminders"""
+    db.session.expire_all()
+    jobs = ScheduledJob.query.filter_by(mawb_id=mawb.id, job_type='lfd_reminder').order_by(ScheduledJob.id)
+    return [(job.payload['reminder_type'], job.run_at.date(), job.status) for job in jobs]
+
+
+def _reminder_date(lfd, days):
+    return lfd - timedelta(days=days)
+
+
+def test_rescheduling_the_same_lfd_keeps_one_job_per_reminder(mawb):
+    lfd = mawb.lfd
+    _set_lfd(mawb, lfd)
+    _set_lfd(mawb, lfd)
+    assert _reminders(mawb) == [
+        ('lfd_3_days', _reminder_date(lfd, 3), 'pending'),
+        ('lfd_1_day', _reminder_date(lfd, 1), 'pending'),
+    ]
+
+
+def test_postponed_lfd_schedules_again_after_a_reminder_ran(mawb):
+    old_lfd = mawb.lfd
+    _set_lfd(mawb, old_lfd)
+    ran = ScheduledJob.query.filter_by(mawb_id=mawb.id).order_by(ScheduledJob.id).first()
+    ran.status = 'completed'
+    db.session.commit()
+
+    new_lfd = old_lfd + timedelta(days=5)
+    _set_lfd(mawb, new_lfd)
+    assert _reminders(mawb) == [
+        ('lfd_3_days', _reminder_date(old_lfd, 3), 'completed'),
+        ('lfd_1_day', _reminder_date(old_lfd, 1), 'cancelled'),
+        ('lfd_3_days', _reminder_date(new_lfd, 3), 'pending'),
+        ('lfd_1_day', _reminder_date(new_lfd, 1), 'pending'),
+    ]
+
+
+def test_advanced_lfd_cancels_reminders_now_in_the_past(mawb):
+    old_lfd = mawb.lfd
+    _set_lfd(mawb, old_lfd)
+
+    # The 3-day reminder date has passed for the new LFD, the 1-day one has not
+    new_lfd = TODAY + timedelta(days=2)
+    _set_lfd(mawb, new_lfd)
+    assert _reminders(mawb) == [
+        ('lfd_3_days', _reminder_date(old_lfd, 3), 'cancelled'),
+        ('lfd_1_day', _reminder_date(old_lfd, 1), 'cancelled'),
+        ('lfd_1_day', _reminder_date(new_lfd, 1), 'pending'),
+    ]
+
+
+def test_cleared_lfd_cancels_pending_reminders(mawb):
+    old_lfd = mawb.lfd
+    _set_lfd(mawb, old_lfd)
+
+    _set_lfd(mawb, None)
+    assert [status for _, _, status in _reminders(mawb)] == ['cancelled', 'cancelled']
+
+
+def test_unkeyed_reminders_are_cancelled_too(mawb):
+    legacy = ScheduledJob(
+        job_type='lfd_reminder', mawb_id=mawb.id, run_at=datetime(2026, 1, 1),
+        payload={'reminder_type': 'lfd_3_days'}
+    )
+    db.session.add(legacy)
+    db.session.commit()
+
+    _set_lfd(mawb, date(2000, 1, 1))
+    assert _reminders(mawb) == [('lfd_3_days', date(2026, 1, 1), 'cancelled')]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Background worker for WDT Supply Chain.
+
+Runs the job scheduler (scheduled jobs, exports, daily checks), the email
+outbox sender and the startup Google Sheets sync, separately from the web processes. Run one or
+more of these next to the web workers:
+
+    python worker.py
+    python worker.py --threads 8
+
+Jobs are claimed with leases, so several workers can run side by side.
+"""
+import argparse
+import logging
+import os
+import signal
+import threading
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the background job worker')
+    parser.add_argument('--threads', type=int, help='job worker threads (default: JOB_WORKER_THREADS)')
+    args = parser.parse_args()
+
+    if args.threads:
+        # Read by Config when the app is imported below
+        os.environ['JOB_WORKER_THREADS'] = str(args.threads)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    from app import app, start_background_services
+    from services.job_scheduler import job_scheduler
+    from services.email_outbox import email_sender
+
+    stopping = threading.Event()
+    def handle_signal(signum, frame):
+        logging.getLogger('worker').info(f"Received signal {signum}, shutting down")
+        stopping.set()
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    start_background_services(app)
+    stopping.wait()
+    job_scheduler.stop()
+    email_sender.stop()
+
+if __name__ == '__main__':
+    main()